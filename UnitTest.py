@@ -1,426 +1,18 @@
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
 import time
-
-from enum import Enum
-
-
-class OrderType(Enum):
-    LIMIT = 1
-    MARKET = 2
-    IOC = 3
-
-
-class OrderSide(Enum):
-    BUY = 1
-    SELL = 2
-
-
-class NonPositiveQuantity(Exception):
-    pass
-
-
-class NonPositivePrice(Exception):
-    pass
-
-
-class InvalidSide(Exception):
-    pass
-
-
-class UndefinedOrderType(Exception):
-    pass
-
-
-class UndefinedOrderSide(Exception):
-    pass
-
-
-class NewQuantityNotSmaller(Exception):
-    pass
-
-
-class UndefinedTraderAction(Exception):
-    pass
-
-
-class UndefinedResponse(Exception):
-    pass
-
-
-from abc import ABC
-
-
-class Order(ABC):
-    def __init__(self, id, symbol, quantity, side, time):
-        self.id = id
-        self.symbol = symbol
-        if quantity > 0:
-            self.quantity = quantity
-        else:
-            raise NonPositiveQuantity("Quantity Must Be Positive!")
-        if side in [OrderSide.BUY, OrderSide.SELL]:
-            self.side = side
-        else:
-            raise InvalidSide("Side Must Be Either \"Buy\" or \"OrderSide.SELL\"!")
-        self.time = time
-
-
-class LimitOrder(Order):
-    def __init__(self, id, symbol, quantity, price, side, time):
-        super().__init__(id, symbol, quantity, side, time)
-        if price > 0:
-            self.price = price
-        else:
-            raise NonPositivePrice("Price Must Be Positive!")
-        self.type = OrderType.LIMIT
-
-
-class MarketOrder(Order):
-    def __init__(self, id, symbol, quantity, side, time):
-        super().__init__(id, symbol, quantity, side, time)
-        self.type = OrderType.MARKET
-
-
-class IOCOrder(Order):
-    def __init__(self, id, symbol, quantity, price, side, time):
-        super().__init__(id, symbol, quantity, side, time)
-        if price > 0:
-            self.price = price
-        else:
-            raise NonPositivePrice("Price Must Be Positive!")
-        self.type = OrderType.IOC
-
-
-class FilledOrder(Order):
-    def __init__(self, id, symbol, quantity, price, side, time, limit=False):
-        super().__init__(id, symbol, quantity, side, time)
-        self.price = price
-        self.limit = limit
-
-
-# Paste in your implementation for the matching engine below
-
-# ----------------------------------------------------------
-class MatchingEngine():
-
-    def __init__(self):
-        self.bid_book = []  # price from high to low / buy, then sorted by the time
-        self.ask_book = []  # price from low to high / sell, then sorted by the time
-        # These are the order books you are given and expected to use for matching the orders below
-
-    # Note: As you implement the following functions keep in mind that these enums are available:
-    #     class OrderType(Enum):
-    #         LIMIT = 1
-    #         MARKET = 2
-    #         IOC = 3
-    #     class OrderSide(Enum):
-    #         BUY = 1
-    #         SELL = 2
-
-    def handle_order(self, order):
-        # Implement this function
-        # In this function you need to call different functions from the matching engine
-        # depending on the type of order you are given
-        if order.type == OrderType.LIMIT:
-            self.handle_limit_order(order)
-        elif order.type == OrderType.MARKET:
-            self.handle_market_order(order)
-        elif order.type == OrderType.IOC:
-            self.handle_ioc_order(order)
-        else:
-            raise UndefinedOrderType("Undefined Order Type!")
-
-    def handle_limit_order(self, order):
-        filled_orders = []
-        # The orders that are filled from the market order need to be inserted into the above list
-        total_quantity = order.quantity
-        if order.side == OrderSide.BUY:
-            order_fully_traded = False
-            if len(self.ask_book) != 0:
-                for ask_order in self.ask_book:
-                    if (ask_order.type == OrderType.LIMIT and ask_order.price >= order.price) or ask_order.type == OrderType.MARKET:
-                        # then those two limit orders / a limit and a market could be traded
-                        if ask_order.quantity < order.quantity:
-                            order.quantity -= ask_order.quantity
-                            filled_order = FilledOrder(ask_order.id, ask_order.symbol, ask_order.quantity,
-                                                       ask_order.price if ask_order.type == OrderType.LIMIT else order.price,
-                                                       OrderSide.BUY, ask_order.time,
-                                                       True if ask_order.type == 1 else False)
-                            filled_orders.append(filled_order)
-                        elif ask_order.quantity > order.quantity:  # matching is complete
-                            ask_order.quantity -= order.quantity
-                            order_fully_traded = True
-                            filled_order = FilledOrder(order.id, order.symbol, total_quantity, order.price,
-                                                       OrderSide.BUY, order.time,
-                                                       True)  # the trade price is order.price?
-                            filled_order_2 = FilledOrder(ask_order.id, ask_order.symbol, order.quantity,
-                                                         ask_order.price if ask_order.type == OrderType.LIMIT else order.price,
-                                                         OrderSide.SELL, ask_order.time,
-                                                         True if ask_order.type == OrderType.LIMIT else False)
-                            filled_orders.append(filled_order)
-                            filled_orders.append(filled_order_2)
-                            break
-                        else:
-                            order_fully_traded == True
-                            filled_order_1 = FilledOrder(order.id, order.symbol, total_quantity, ask_order.price,
-                                                         OrderSide.BUY, order.time, True)
-                            filled_order_2 = FilledOrder(ask_order.id, ask_order.symbol, ask_order.quantity,
-                                                         ask_order.price if ask_order.type == OrderType.MARKET else order.price,
-                                                         OrderSide.SELL, ask_order.time,
-                                                         True if ask_order.type == OrderType.LIMIT else False)
-                            filled_orders.append(filled_order_1, filled_order_2)
-                            break
-
-                self.ask_book = self.ask_book[len(filled_orders) - 2:]  # to update the current self.ask_book
-                # after the for loop, if the order still is not fully traded, then insert the remaining
-                if order_fully_traded == False:
-                    self.insert_limit_order(order)
-                    if order.quantity < total_quantity:
-                        filled_order = FilledOrder(order.id, order.symbol, total_quantity - order.quantity, order.price,
-                                                   OrderSide.SELL, order.time, True)
-                        filled_orders.append(filled_order)
-            else:
-                self.insert_limit_order(order)
-
-        elif order.side == OrderSide.SELL:
-            order_fully_traded = False
-            if len(self.bid_book) != 0:
-                for bid_order in self.bid_book:
-                    if (bid_order.type == OrderType.LIMIT and bid_order.price > order.price) or bid_order.type == OrderType.MARKET:
-                        # then the trade is between two limited orders / a limited order and a market order
-                        if bid_order.quantity < order.quantity:
-                            order.quantity -= bid_order.quantity;
-                            filled_order = FilledOrder(bid_order.id, bid_order.symbol, bid_order.quantity,
-                                                       bid_order.price, OrderSide.BUY, bid_order.time,
-                                                       True if bid_order.type == OrderType.LIMIT else False)
-                            filled_orders.append(filled_order)
-
-                        elif bid_order.quantity > order.quantity:  # the order is filled
-                            bid_order.quantity -= order.quantity
-                            order_fully_traded = True
-                            filled_order_1 = FilledOrder(order.id, bid_order.symbol, total_quantity, order.price,
-                                                         OrderSide.SELL, order.time, True)
-                            filled_order_2 = FilledOrder(bid_order.id, bid_order.symbol, order.quantity,
-                                                         bid_order.price, OrderSide.BUY, bid_order.time,
-                                                         True if bid_order.type == OrderType.LIMIT else False)
-                            filled_orders.append(filled_order_1)
-                            filled_orders.append(filled_order_2)
-                            break
-                        else:
-                            order_fully_traded == True
-                            filled_order_1 = FilledOrder(order.id, order.symbol, total_quantity, order.price,
-                                                         OrderSide.SELL, order.time, True)
-                            filled_order_2 = FilledOrder(bid_order.id, bid_order.symbol, bid_order.quantity,
-                                                         bid_order.price if bid_order.type == OrderType.MARKET else order.price,
-                                                         OrderSide.BUY, bid_order.time,
-                                                         True if bid_order.type == OrderType.LIMIT else False)
-                            filled_orders.append(filled_order_1)
-                            filled_orders.append(filled_order_2)
-                            break
-
-                self.bid_book = self.bid_book[len(filled_orders) - 2:]  # to update the order book
-                if order_fully_traded == False:
-                    self.insert_limit_order(order)
-                    if order.quantity < total_quantity:
-                        filled_order = FilledOrder(order.id, order.symbol, total_quantity - order.quantity, order.price,
-                                                   OrderSide.SELL, order.time, True)
-                        filled_orders.append(filled_order)
-            else:
-                self.insert_limit_order(order)
-        else:
-            # You need to raise the following error if the side the order is for is ambiguous
-            raise UndefinedOrderSide("Undefined Order Side!")
-        return filled_orders
-
-    def handle_market_order(self, order):
-        # Implement this function
-        filled_orders = []
-        total_quantity = order.quantity
-        if order.side == OrderSide.BUY:  # buy, then go to check the self.ask_book, and take whatever the price is
-            if len(self.ask_book) != 0:  # there're still some orders
-                total_quantity = order.quantity
-
-                for ask_order in self.ask_book:
-                    if ask_order.quantity < order.quantity:
-                        order.quantity -= ask_order.quantity  # the remaining quantity to be traded
-                        traded_order = FilledOrder(ask_order.id, ask_order.symbol, ask_order.quantity,
-                                                   0 if ask_order.type == OrderType.MARKET else ask_order.price,
-                                                   OrderSide.SELL, ask_order.time,
-                                                   False if ask_order.type == OrderType.MARKET else True)
-                        filled_orders.append(traded_order)
-
-                    elif ask_order.quantity > order.quantity:  # order.quantity now will be zero, the order is fully traded
-                        ask_order.quantity -= order.quantity
-                        filled_order_1 = FilledOrder(order.id, order.symbol, total_quantity, ask_order.price,
-                                                     OrderSide.BUY,
-                                                     order.time, False)
-                        filled_order_2 = FilledOrder(ask_order.id, ask_order.symbol, order.quantity, ask_order.price,
-                                                     OrderSide.SELL, ask_order.time, False)
-                        filled_orders.append(filled_order_1)
-                        filled_orders.append(filled_order_2)
-                        self.ask_book = self.ask_book[len(filled_orders) - 2:]
-                        break
-
-                    else:
-                        filled_order_1 = FilledOrder(ask_order.id, ask_order.symbol, ask_order.quantity,
-                                                     0 if ask_order.type == OrderType.MARKET else ask_order.price,
-                                                     OrderSide.SELL, ask_order.time,
-                                                     False if ask_order.type == OrderType.MARKET else True)
-                        filled_order_2 = FilledOrder(order.id, order.symbol, total_quantity,
-                                                     0 if ask_order.type == OrderType.MARKET else ask_order.price,
-                                                     OrderSide.BUY, order.time,
-                                                     False)
-                        filled_orders.append(filled_order_1, filled_order_2)
-                        self.ask_book = self.ask_book[len(filled_orders):]
-                        break
-            else:  # the ask book is empty
-                self.bid_book.append(order)
-
-        elif order.side == OrderSide.SELL:  # now the order is to sell
-            if len(self.bid_book) != 0:
-                total_quantity = order.quantity
-                for bid_order in self.bid_book:
-                    if bid_order.quantity < order.quantity:
-                        order.quantity -= bid_order.quantity  # the remaining quantity to be traded
-                        traded_order = FilledOrder(bid_order.id, bid_order.symbol, bid_order.quantity,
-                                                   0 if bid_order.type == OrderType.MARKET else bid_order.price,
-                                                   OrderSide.BUY, bid_order.time,
-                                                   False if bid_order.type == OrderType.MARKET else True)
-                        filled_orders.append(traded_order)
-
-                    elif bid_order.quantity > order.quantity:  # order.quantity now will be zero, the order is fully traded
-                        bid_order.quantity -= order.quantity
-                        filled_order_1 = FilledOrder(order.id, order.symbol, total_quantity, bid_order.price,
-                                                     OrderSide.SELL,
-                                                     order.time, False)
-                        filled_order_2 = FilledOrder(bid_order.id, bid_order.symbol, order.quantity,
-                                                     bid_order.price if bid_order.type == OrderType.LIMIT else 0,
-                                                     OrderSide.BUY, bid_order.time,
-                                                     True if bid_order.type == OrderType.LIMIT else False)
-                        filled_orders.append(filled_order_1)
-                        filled_orders.append(filled_order_2)
-                        self.bid_book = self.bid_book[len(filled_orders) - 2:]
-                        break
-                    else:
-                        filled_order_1 = FilledOrder(bid_order.id, bid_order.symbol, bid_order.quantity,
-                                                     0 if bid_order.type == OrderType.MARKET else bid_order.price,
-                                                     OrderSide.BUY, bid_order.time,
-                                                     False if bid_order.type == OrderType.MARKET else True)
-                        filled_order_2 = FilledOrder(order.id, order.symbol, total_quantity,
-                                                     0 if bid_order.type == OrderType.MARKET else bid_order.price,
-                                                     OrderSide.SELL, order.time,
-                                                     False)
-                        filled_orders.append(filled_order_1)
-                        filled_orders.append(filled_order_2)
-            else:  # the ask book is empty
-                self.ask_book.append(order)
-
-        # The orders that are filled from the market order need to be inserted into the above list
-        else:
-            raise UndefinedOrderSide("Undefined Order Side!")
-
-        return filled_orders
-
-    def handle_ioc_order(self, order):
-
-        filled_orders = []
-        # The orders that are filled from the ioc order need to be inserted into the above list
-        if order.side == OrderSide.BUY:  # to check the existing sell order book
-            if len(self.ask_book) > 0:
-                order_traded = self.ask_book[0]  # The IOC should trade with any existing order
-                if (order_traded.type == 2) or (
-                        order_traded.type == 1 and order.price >= order_traded.price):  # market order, trade price will equal to IOC
-                    traded_quantity = min(order.quantity, order_traded.quantity)
-                    if traded_quantity == order_traded.quantity:  # the first order is fully traded
-                        self.ask_book = self.ask_book[1:]
-                        filled_order_1 = FilledOrder(order_traded.id, order_traded.symbol, traded_quantity, order.price,
-                                                     2, order_traded.time, False if order_traded.type == 2 else True)
-                        filled_IOC = FilledOrder(order.id, order.symbol, traded_quantity, order.price, 1, order.time,
-                                                 False)
-                        filled_orders.append(filled_order_1)
-                        filled_orders.append(filled_IOC)  # IOC order
-                    else:  # the first order is partially traded, will update its remaining quantity
-                        filled_IOC = FilledOrder(order.id, order.symbol, traded_quantity, order.price, 1, order.time,
-                                                 False)
-                        order_traded.quantity -= traded_quantity
-                        filled_orders.append(filled_IOC)  # IOC order
-
-        elif order.side == OrderSide.SELL:  # it's a sell order, to check the self buy order book
-            if len(self.bid_book) > 0:
-                order_traded = self.bid_book[0]
-                if (order_traded.type == OrderType.MARKET) or (
-                        order_traded.type == OrderType.LIMIT and order.price < order_traded.price):
-                    traded_quantity = min(order.quantity, order_traded.quantity)
-                    if traded_quantity == order_traded.quantity:  # the first order is fully traded
-                        self.bid_book = self.bid_book[1:]
-                        filled_order_1 = FilledOrder(order_traded.id, order_traded.symbol, traded_quantity, order.price,
-                                                     OrderSide.BUY, order_traded.time,
-                                                     False if order_traded.type == OrderType.MARKET else True)
-                        filled_IOC = FilledOrder(order.id, order.symbol, traded_quantity, order.price,OrderSide.SELL, order.time,
-                                                 False)
-                        filled_orders.append(filled_order_1)
-                        filled_orders.append(filled_IOC)  # IOC order
-                    else:  # the first order is partially traded, will update its remaining quantity
-                        filled_order_1 = FilledOrder(order_traded.id, order_traded.symbol, traded_quantity, order.price,
-                                                     OrderSide.BUY, order_traded.time,
-                                                     False if order_traded.type == OrderType.MARKET else True)
-                        filled_IOC = FilledOrder(order.id, order.symbol, traded_quantity, order.price, OrderSide.SELL,
-                                                 order.time,
-                                                 False)
-                        order_traded.quantity -= traded_quantity
-                        filled_orders.append(filled_order_1)
-                        filled_orders.append(filled_IOC)  # IOC order
-        else:
-            raise UndefinedOrderSide("Undefined Order Side!")
-        return filled_orders
-
-    def insert_limit_order(self, order):
-        assert order.type == OrderType.LIMIT
-        list_of_bids = []
-        list_of_offrs = []
-
-        if order.side == OrderSide.BUY:  # BUY Order
-            list_of_bids.append(order)
-            self.bid_book += list_of_bids
-            self.bid_book = sorted(self.bid_book, key=lambda x: (x.price, -x.time), reverse=True)
-
-        elif order.side == OrderSide.SELL:
-            list_of_offrs.append(order)
-            self.ask_book += list_of_offrs
-            self.ask_book = sorted(self.ask_book, key=lambda x: (x.price, -x.time))
-        else:
-            raise UndefinedOrderSide("Undefined Order Side!")
-
-    def amend_quantity(self, id, quantity):
-
-        for order in self.bid_book:
-            if order.id == id:
-                if order.quantity > quantity:
-                    order.quantity = quantity
-                    return True
-                else:
-                    raise NewQuantityNotSmaller("Amendment Must Reduce Quantity!")
-        for order in self.ask_book:
-            if order.id == id:
-                if order.quantity > quantity:
-                    order.quantity = quantity
-                    return True
-                else:
-                    raise NewQuantityNotSmaller("Amendment Must Reduce Quantity!")
-        return False
-
-    def cancel_order(self, id):
-        for order in self.bid_book:
-            if order.id == id:
-                self.bid_book.remove(order)
-                return True
-        for order in self.ask_book:
-            if order.id == id:
-                self.ask_book.remove(order)
-                return True
-        return False
-# -----------------------------------------------------------
-# You need to build additional unittests for your implementation
 import unittest
+from collections import Counter
+from itertools import count
+
+from trading_system import Ack, Exchange, FlowGenerator, FOKOrder, Fill, IcebergOrder, IOCOrder, Journal, \
+    LatencyHistogram, Ledger, LimitOrder, MarketOrder, MatchingEngine, NewQuantityNotSmaller, NonPositiveQuantity, \
+    OrderActions, OrderSide, OrderStore, OrderType, Reject, RiskLimits, StaleOrderHandle, StopLimitOrder, StopOrder, \
+    TimeInForce, Trader, exchange_to_trader, read_journal, run_session, trader_to_exchange
 
 
 class TestOrderBook(unittest.TestCase):
@@ -465,6 +57,265 @@ class TestOrderBook(unittest.TestCase):
 
         self.assertEqual(len(matching_engine.bid_book),0)
 
+    def test_price_time_priority(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 11, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(3, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(4, 'S', 5, 12, OrderSide.SELL, time.time()))
+
+        self.assertEqual([order.id for order in matching_engine.ask_book], [2, 3, 1, 4])
+        self.assertEqual(len(matching_engine.ask_book), 4)
+        self.assertEqual(matching_engine.ask_book[-1].id, 4)
+
+        filled_orders = matching_engine.handle_limit_order(LimitOrder(5, 'S', 7, 10, OrderSide.BUY, time.time()))
+        self.assertEqual(filled_orders[0].id, 2)
+        self.assertEqual(matching_engine.ask_book[0].id, 3)
+        self.assertEqual(matching_engine.ask_book[0].quantity, 3)
+        self.assertEqual(len(matching_engine.bid_book), 0)
+
+    def test_cancel_order_empties_price_level(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 10, OrderSide.BUY, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 5, 9, OrderSide.BUY, time.time()))
+        matching_engine.cancel_order(1)
+
+        self.assertEqual(matching_engine.bid_book[0].price, 9)
+        self.assertEqual(matching_engine.bid_book.keys, [9])
+
+    def test_cancel_order_middle_of_level(self):
+        matching_engine = MatchingEngine()
+        for id in range(1, 4):
+            matching_engine.handle_limit_order(LimitOrder(id, 'S', 5, 10, OrderSide.SELL, time.time()))
+        self.assertTrue(matching_engine.cancel_order(2))
+        self.assertFalse(matching_engine.cancel_order(2))
+
+        self.assertEqual([order.id for order in matching_engine.ask_book], [1, 3])
+        self.assertEqual(matching_engine.ask_book.best_level().count, 2)
+
+    def test_order_index_follows_fills(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(3, 'S', 7, 10, OrderSide.BUY, time.time()))
+
+        self.assertNotIn(1, matching_engine.order_index)
+        self.assertFalse(matching_engine.cancel_order(1))
+        self.assertTrue(matching_engine.amend_quantity(2, 1))
+        self.assertEqual(matching_engine.ask_book[0].quantity, 1)
+        with self.assertRaises(NewQuantityNotSmaller):
+            matching_engine.amend_quantity(2, 1)
+        with self.assertRaises(NonPositiveQuantity):
+            matching_engine.amend_quantity(2, 0)
+        self.assertEqual(matching_engine.depth(), ([], [(10, 1, 1)]))
+
+    def test_trader_order_newest(self):
+        matching_engine = MatchingEngine()
+        for order_id, price in ((1, 12), (2, 10), (3, 11)):
+            order = LimitOrder(7, 'S', 5, price, OrderSide.BUY, order_id)
+            order.order_id = order_id
+            matching_engine.handle_order(order)
+        self.assertEqual(matching_engine.trader_order(7).order_id, 3)
+        matching_engine.remove_order(matching_engine.trader_order(7))
+        self.assertEqual(matching_engine.trader_order(7).order_id, 2)
+        self.assertEqual(matching_engine.trader_order(7, 1).price, 12)
+        self.assertIsNone(matching_engine.trader_order(8))
+
+    def test_handle_limit_order_sweeps_levels(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 5, 11, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(3, 'S', 5, 12, OrderSide.SELL, time.time()))
+
+        filled_orders = matching_engine.handle_limit_order(LimitOrder(4, 'S', 10, 11, OrderSide.BUY, time.time()))
+        self.assertEqual([(order.id, order.quantity, order.price) for order in filled_orders],
+                         [(1, 5, 10), (4, 5, 10), (2, 5, 11), (4, 5, 11)])
+        self.assertEqual(filled_orders[0].side, OrderSide.SELL)
+        self.assertEqual(filled_orders[1].side, OrderSide.BUY)
+        self.assertEqual(filled_orders[1], Fill(4, 'S', 5, 10, OrderSide.BUY, filled_orders[1].time, True, 4))
+        self.assertEqual(len(matching_engine.bid_book), 0)
+        self.assertEqual(matching_engine.ask_book[0].id, 3)
+
+    def test_handle_market_order_exact_quantity(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 10, OrderSide.BUY, time.time()))
+        filled_orders = matching_engine.handle_market_order(MarketOrder(2, 'S', 5, OrderSide.SELL, time.time()))
+
+        self.assertEqual(len(filled_orders), 2)
+        self.assertEqual(len(matching_engine.bid_book), 0)
+        self.assertEqual(len(matching_engine.ask_book), 0)
+        self.assertNotIn(1, matching_engine.order_index)
+
+    def test_ioc_and_fok_sweep_levels(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 5, 11, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(3, 'S', 5, 12, OrderSide.SELL, time.time()))
+
+        # a fill or kill order that the crossing levels can not fill leaves the book as it was
+        self.assertEqual(matching_engine.handle_order(FOKOrder(4, 'S', 11, 11, OrderSide.BUY, time.time())), [])
+        self.assertEqual(matching_engine.depth(), ([], [(10, 5, 1), (11, 5, 1), (12, 5, 1)]))
+
+        filled_orders = matching_engine.handle_order(FOKOrder(5, 'S', 8, 11, OrderSide.BUY, time.time()))
+        self.assertEqual([(order.id, order.quantity, order.price) for order in filled_orders],
+                         [(1, 5, 10), (5, 5, 10), (2, 3, 11), (5, 3, 11)])
+
+        # an IOC trades at the resting prices and its remainder does not rest
+        filled_orders = matching_engine.handle_order(IOCOrder(6, 'S', 10, 12, OrderSide.BUY, time.time()))
+        self.assertEqual([(order.id, order.quantity, order.price) for order in filled_orders],
+                         [(2, 2, 11), (6, 2, 11), (3, 5, 12), (6, 5, 12)])
+        self.assertEqual(matching_engine.depth(), ([], []))
+
+    def test_iceberg_order_replenishes(self):
+        matching_engine = MatchingEngine()
+        matching_engine.handle_limit_order(IcebergOrder(1, 'S', 25, 10, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 5, 10, OrderSide.SELL, time.time()))
+        self.assertEqual(matching_engine.depth(), ([], [(10, 15, 2)]))  # only the displayed slice shows
+
+        # the traded slice is replenished from the reserve behind the order that was queued after it
+        filled_orders = matching_engine.handle_limit_order(LimitOrder(3, 'S', 12, 10, OrderSide.BUY, time.time()))
+        self.assertEqual([(order.id, order.quantity) for order in filled_orders[0::2]], [(1, 10), (2, 2)])
+        self.assertEqual([(order.id, order.quantity) for order in matching_engine.ask_book], [(2, 3), (1, 10)])
+        self.assertEqual(matching_engine.ask_book[1].reserve, 5)
+
+        self.assertTrue(matching_engine.amend_quantity(1, 12))  # the amend takes the reserve first
+        self.assertEqual((matching_engine.ask_book[1].quantity, matching_engine.ask_book[1].reserve), (10, 2))
+        filled_orders = matching_engine.handle_order(FOKOrder(4, 'S', 15, 10, OrderSide.BUY, time.time()))
+        self.assertEqual([(order.id, order.quantity) for order in filled_orders[0::2]], [(2, 3), (1, 10), (1, 2)])
+        self.assertEqual(matching_engine.depth(), ([], []))
+
+    def test_stop_orders_cascade(self):
+        matching_engine = MatchingEngine()
+        for id, price in ((1, 101), (2, 102), (3, 103)):
+            matching_engine.handle_order(LimitOrder(id, 'S', 5, price, OrderSide.SELL, id))
+        matching_engine.handle_order(StopLimitOrder(11, 'S', 5, 102, 102, OrderSide.BUY, 11))
+        matching_engine.handle_order(StopOrder(10, 'S', 5, 101, OrderSide.BUY, 10))
+        matching_engine.handle_order(StopOrder(12, 'S', 1, 90, OrderSide.SELL, 12))
+        self.assertEqual([order.id for order in matching_engine.buy_stops], [10, 11])
+
+        # the trade at 101 triggers stop 10, whose trade at 102 triggers the stop limit 11, which rests at 102
+        filled_orders = matching_engine.handle_order(LimitOrder(4, 'S', 5, 101, OrderSide.BUY, 4))
+        self.assertEqual([(order.id, order.price) for order in filled_orders],
+                         [(1, 101), (4, 101), (2, 102), (10, 102)])
+        self.assertEqual((matching_engine.bid_book[0].id, matching_engine.bid_book[0].price), (11, 102))
+        self.assertEqual((len(matching_engine.buy_stops), len(matching_engine.sell_stops)), (0, 1))
+        self.assertTrue(matching_engine.cancel_order(12))
+        self.assertEqual(len(matching_engine.sell_stops), 0)
+
+        # a cascade longer than the recursion limit, every stop's trade triggers the next one
+        matching_engine = MatchingEngine()
+        for id in range(1, 3001):
+            matching_engine.handle_order(LimitOrder(id, 'S', 1, 100 + id, OrderSide.SELL, id))
+            matching_engine.handle_order(StopOrder(10000 + id, 'S', 1, 100 + id, OrderSide.BUY, id))
+        filled_orders = matching_engine.handle_order(MarketOrder(0, 'S', 1, OrderSide.BUY, 0))
+        self.assertEqual(len(filled_orders), 2 * 3000)
+        self.assertEqual((len(matching_engine.ask_book), len(matching_engine.buy_stops)), (0, 0))
+
+        # a sweep prints at every level it takes, the sell stop at 10 triggers though the last trade is at 12
+        matching_engine = MatchingEngine()
+        matching_engine.handle_order(LimitOrder(1, 'S', 5, 10, OrderSide.SELL, 1))
+        matching_engine.handle_order(LimitOrder(2, 'S', 5, 12, OrderSide.SELL, 2))
+        matching_engine.handle_order(LimitOrder(3, 'S', 5, 9, OrderSide.BUY, 3))
+        matching_engine.handle_order(StopOrder(4, 'S', 2, 10, OrderSide.SELL, 4))
+        filled_orders = matching_engine.handle_order(LimitOrder(5, 'S', 10, 12, OrderSide.BUY, 5))
+        self.assertEqual([(order.id, order.quantity, order.price) for order in filled_orders[0::2]],
+                         [(1, 5, 10), (2, 5, 12), (3, 2, 9)])
+        self.assertEqual(len(matching_engine.sell_stops), 0)
+
+        # two market orders trade without a price, the stops keep the last priced trade
+        matching_engine = MatchingEngine()
+        matching_engine.handle_order(LimitOrder(1, 'S', 5, 100, OrderSide.SELL, 1))
+        matching_engine.handle_order(LimitOrder(2, 'S', 5, 100, OrderSide.BUY, 2))
+        matching_engine.handle_order(MarketOrder(3, 'S', 5, OrderSide.SELL, 3))
+        filled_orders = matching_engine.handle_order(MarketOrder(4, 'S', 5, OrderSide.BUY, 4))
+        self.assertEqual([order.price for order in filled_orders], [0, 0])
+        self.assertEqual(matching_engine.last_price, 100)
+        matching_engine.handle_order(StopOrder(5, 'S', 5, 50, OrderSide.SELL, 5))
+        self.assertEqual([order.id for order in matching_engine.sell_stops], [5])
+
+    def test_depth_follows_book(self):
+        matching_engine = MatchingEngine()
+        updates = []
+        matching_engine.subscribe(lambda side, price, quantity, count: updates.append((side, price, quantity, count)))
+        matching_engine.handle_limit_order(LimitOrder(1, 'S', 5, 10, OrderSide.BUY, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(2, 'S', 3, 10, OrderSide.BUY, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(3, 'S', 4, 9, OrderSide.BUY, time.time()))
+        matching_engine.handle_limit_order(LimitOrder(4, 'S', 6, 12, OrderSide.SELL, time.time()))
+
+        self.assertEqual(matching_engine.best_bid(), 10)
+        self.assertEqual(matching_engine.best_ask(), 12)
+        self.assertEqual(matching_engine.spread(), 2)
+        self.assertEqual(matching_engine.depth(1), ([(10, 8, 2)], [(12, 6, 1)]))
+
+        matching_engine.handle_limit_order(LimitOrder(5, 'S', 6, 10, OrderSide.SELL, time.time()))  # fills 1 and 1 of 2
+        matching_engine.amend_quantity(3, 1)
+        matching_engine.cancel_order(4)
+        self.assertEqual(matching_engine.depth(), ([(10, 2, 1), (9, 1, 1)], []))
+        self.assertIsNone(matching_engine.spread())
+        self.assertEqual(updates[-4:], [(OrderSide.BUY, 10, 3, 1), (OrderSide.BUY, 10, 2, 1),
+                                        (OrderSide.BUY, 9, 1, 1), (OrderSide.SELL, 12, 0, 0)])
+
+    def test_instrumented_stats(self):
+        matching_engine = MatchingEngine()
+        self.assertNotIn('latency_ns', matching_engine.stats())
+        matching_engine.instrument()
+        matching_engine.handle_order(LimitOrder(1, 'S', 5, 10, OrderSide.SELL, time.time()))
+        matching_engine.handle_order(LimitOrder(2, 'S', 5, 11, OrderSide.SELL, time.time()))
+        matching_engine.handle_order(LimitOrder(3, 'S', 5, 11, OrderSide.SELL, time.time()))
+        matching_engine.handle_order(MarketOrder(4, 'S', 8, OrderSide.BUY, time.time()))
+        matching_engine.cancel_order(3)
+
+        stats = matching_engine.stats()
+        self.assertEqual((stats['orders'], stats['fills'], stats['resting_orders_touched'], stats['levels_crossed']),
+                         (4, 4, 2, 2))
+        self.assertEqual((stats['asks'], stats['ask_levels'], stats['cancels']), (1, 1, 1))
+        self.assertEqual(stats['latency_ns']['LIMIT']['count'], 3)
+        self.assertEqual(stats['latency_ns']['MARKET']['count'], 1)
+        matching_engine.uninstrument()
+        self.assertNotIn('handle_order', vars(matching_engine))
+
+        # a triggered stop is counted once, as part of the order that triggered it
+        matching_engine = MatchingEngine()
+        matching_engine.instrument()
+        matching_engine.handle_order(LimitOrder(1, 'S', 5, 10, OrderSide.SELL, 1))
+        matching_engine.handle_order(LimitOrder(2, 'S', 5, 11, OrderSide.SELL, 2))
+        matching_engine.handle_order(StopOrder(3, 'S', 5, 10, OrderSide.BUY, 3))
+        matching_engine.handle_order(LimitOrder(4, 'S', 5, 10, OrderSide.BUY, 4))
+        stats = matching_engine.stats()
+        self.assertEqual((stats['orders'], stats['fills']), (4, 4))
+        self.assertEqual(stats['latency_ns']['LIMIT']['count'], 3)
+        self.assertNotIn('MARKET', stats['latency_ns'])
+
+    def test_latency_histogram_buckets(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 1001):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(0.5) // 16, 500 // 16)  # within 1/16 of the value
+        self.assertEqual(histogram.percentile(1.0), 1000)
+        self.assertEqual((histogram.count, histogram.min, histogram.max), (1000, 1, 1000))
+
+    def test_order_store(self):
+        for use_numpy in (False, True):
+            store = OrderStore("S", tick_size=0.01, capacity=2, use_numpy=use_numpy)
+            handles = [store.add(id, 10.25, 5, OrderSide.SELL, OrderType.LIMIT, id) for id in range(1, 4)]
+            self.assertEqual(store.capacity, 4)
+            self.assertEqual(handles[2].price_ticks, 1025)
+            self.assertEqual(handles[2].side, OrderSide.SELL)
+
+            handles[1].quantity = 3
+            self.assertEqual(handles[1].quantity, 3)
+            store.remove(handles[0])
+            self.assertEqual(len(store), 2)
+
+            # the freed row goes to the next order, the removed order's handle no longer reads it
+            handle = store.add(4, 10.5, 7, OrderSide.BUY, OrderType.LIMIT, 4)
+            self.assertEqual((handle.row, handle.id, handle.quantity), (handles[0].row, 4, 7))
+            with self.assertRaises(StaleOrderHandle):
+                handles[0].quantity
+            with self.assertRaises(StaleOrderHandle):
+                store.remove(handles[0])
+            self.assertEqual(len(store), 3)
+
     # A few example unittests are provided below
 
     def test_insert_limit_order(self):
@@ -542,17 +393,584 @@ class TestOrderBook(unittest.TestCase):
         self.assertEqual(matching_engine.bid_book[0].id, 2)
 
 
-import io
-import __main__
-
-suite = unittest.TestLoader().loadTestsFromModule(__main__)
-buf = io.StringIO()
-unittest.TextTestRunner(stream=buf, verbosity=2).run(suite)
-buf = buf.getvalue().split("\n")
-sum = 0
-for test in buf:
-    if test.startswith("test"):
-        sum += 1
-
-print("You have %d unit tests" % (sum))
 
+class TestExchange(unittest.TestCase):
+
+    def test_fill_settles_ledger(self):
+        exchange = Exchange(traders=2)
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 10, 100.5, OrderSide.SELL, 0)))
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 4, 101, OrderSide.BUY, 0)))
+
+        self.assertEqual(exchange.ledger.balance(1), 1000000 * 100 - 4 * 10050)
+        self.assertEqual(exchange.ledger.position(0), {"AAPL": -4})
+        self.assertEqual(replies[1][0], (OrderActions.Ack, Ack(1, 2, "AAPL")))
+        self.assertEqual(replies[1][1][1].price, 100.5)
+        self.assertEqual(replies[0][1][1].order_id, 1)
+        self.assertEqual(exchange.depth("AAPL"), ([], [(100.5, 6, 1)]))
+
+    def test_snapshot_restore(self):
+        exchange = Exchange(traders=2)
+        exchange.reply = [lambda response: None] * 2
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 10, 99, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "MSFT", 5, 250, OrderSide.SELL, 0)))
+        exchange.handle_request((OrderType.MARKET, 0, MarketOrder(0, "MSFT", 2, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.STOP_LIMIT, 1, StopLimitOrder(1, "MSFT", 3, 260, 261, OrderSide.BUY, 0)))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "exchange.snap")
+            exchange.snapshot(path)
+            restored = Exchange(traders=2)
+            restored.restore(path)
+        self.assertEqual((restored.pending_books, restored.snapshot_columns), ({}, None))  # built before it returns
+
+        for trader in (0, 1):
+            self.assertEqual(restored.ledger.balance(trader), exchange.ledger.balance(trader))
+            self.assertEqual(restored.ledger.position(trader), exchange.ledger.position(trader))
+        self.assertEqual(restored.ledger.equity().tolist(), exchange.ledger.equity().tolist())  # marked as before
+        for symbol in ("AAPL", "MSFT"):
+            self.assertEqual(restored.depth(symbol), exchange.depth(symbol))
+        stop, = restored.engine_for("MSFT").buy_stops
+        self.assertEqual((stop.order_id, stop.stop_price, stop.price, restored.engine_for("MSFT").last_price),
+                         (4, 26000, 26100, 25000))
+
+        # restored lazily, with risk checks and good-till-time orders the books still wait, the aggregates come
+        # off the columns
+        exchange = Exchange(traders=2, risk=RiskLimits())
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, 10, OrderSide.BUY, 0, TimeInForce.GTT,
+                                                                3)))
+        exchange.handle_request((OrderType.LIMIT, 1, IcebergOrder(1, "MSFT", 9, 20, 3, OrderSide.SELL, 0)))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "exchange.snap")
+            exchange.snapshot(path)
+            restored = Exchange(traders=2, risk=RiskLimits())
+            restored.restore(path, lazy=True)
+        self.assertEqual(set(restored.pending_books), {"AAPL", "MSFT"})
+        self.assertEqual((restored.risk.resting, restored.risk.open_notional), (exchange.risk.resting,
+                                                                                 exchange.risk.open_notional))
+        restored.reply = [responses.append for responses in replies]
+        restored.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "GOOG", 1, 30, OrderSide.SELL, 0)))
+        self.assertEqual(replies[0][-1], (OrderActions.Cancel, Ack(0, 1, "AAPL")))  # built when it expired
+        self.assertEqual((list(restored.pending_books), restored.risk.open_buy_notional[0]), (["MSFT"], 0))
+
+        exchange = Exchange(traders=2, shards=2)
+        exchange.start_workers()
+        try:
+            with self.assertRaises(ValueError):
+                exchange.snapshot(os.devnull)
+        finally:
+            exchange.stop_workers()
+
+    def test_ledger_accounting(self):
+        ledger = Ledger(2, 1000, symbols=["AAPL", "MSFT"])
+        ledger.record(0, 0, -300, 3, 100)  # trader 0 buys 3 AAPL at 100 from trader 1
+        ledger.record(1, 0, 300, -3, 100)
+        ledger.record(1, 1, -50, 1, 50)
+        ledger.record(0, 1, 50, -1, 50)
+        ledger.record(2, 1, 0, 0, 60)  # a new trader grows the ledger
+
+        self.assertEqual(ledger.marks().tolist(), [100, 60])
+        self.assertEqual(ledger.traders, 3)
+        self.assertEqual(ledger.equity().tolist(), [1000 - 300 + 50 + 300 - 60, 1000 + 300 - 50 - 300 + 60, 1000])
+        gross, net = ledger.exposure([110, 50])
+        self.assertEqual((gross.tolist(), net.tolist()), ([380, 380, 0], [280, -280, 0]))
+        self.assertTrue(ledger.conserved())
+
+
+    def test_risk_checks(self):
+        exchange = Exchange(traders=2, risk=RiskLimits(max_order_quantity=100, max_open_notional=50, max_position=50))
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+
+        def place(trader, quantity, price, side):
+            exchange.handle_request((OrderType.LIMIT, trader, LimitOrder(trader, "AAPL", quantity, price, side, 0)))
+
+
+        place(0, 150, 1, OrderSide.BUY)
+        place(0, 40, 1, OrderSide.BUY)
+        place(0, 20, 0.5, OrderSide.BUY)
+        place(0, 20, 1, OrderSide.BUY)
+        self.assertEqual([response[1].reason for response in replies[0] if response[0] == OrderActions.Reject],
+                         ["Order Quantity Exceeds The Limit!", "Position Exceeds The Limit!",
+                          "Open Notional Exceeds The Limit!"])
+        self.assertEqual(exchange.risk.open_notional[0], 4000)
+
+        place(1, 10, 1, OrderSide.SELL)  # trades with the resting buy
+        self.assertEqual(exchange.risk.open_notional[0], 3000)
+        exchange.handle_request((OrderActions.Amend, 0, 25, "AAPL"))
+        self.assertEqual(exchange.risk.open_buy_notional[0], 2500)
+        self.assertEqual(exchange.handle_request((OrderActions.Amend, 0, 0, "AAPL")), (OrderActions.Amend, False))
+        self.assertEqual(exchange.risk.open_buy_notional[0], 2500)
+        exchange.handle_request((OrderActions.Cancel, 0, "AAPL"))
+        self.assertEqual(exchange.risk.open_notional[0], 0)
+
+        exchange = Exchange(traders=1, risk=RiskLimits())
+        exchange.reply = [replies[0].append]
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 1000, 2000, OrderSide.BUY, 0)))
+        self.assertEqual(replies[0][-1], (OrderActions.Reject, Reject(0, 1, "AAPL", "Insufficient Buying Power!")))
+
+    def test_order_ids_and_cancel_all(self):
+        exchange = Exchange(traders=2)
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        for price in (10, 11, 12):
+            exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, price, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "MSFT", 5, 20, OrderSide.SELL, 0)))
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 5, 9, OrderSide.BUY, 0)))
+        self.assertEqual([response[1].order_id for response in replies[0]], [1, 2, 3, 4])
+
+        # another trader's order id is not cancelled, the trader's own is wherever it rests
+        self.assertEqual(exchange.handle_request((OrderActions.Cancel, 1, "AAPL", 2)), (OrderActions.Cancel, False))
+        self.assertEqual(exchange.handle_request((OrderActions.Cancel, 0, "AAPL", 2)), (OrderActions.Cancel, True))
+        self.assertEqual(exchange.depth("AAPL")[0], [(12, 5, 1), (10, 5, 1), (9, 5, 1)])
+
+        self.assertEqual(exchange.handle_request((OrderActions.Cancel_All, 0, "AAPL", OrderSide.SELL)),
+                         (OrderActions.Cancel_All, 0))
+        self.assertEqual(exchange.handle_request((OrderActions.Cancel_All, 0, "AAPL")), (OrderActions.Cancel_All, 2))
+        self.assertEqual(exchange.depth("AAPL")[0], [(9, 5, 1)])
+        self.assertEqual(exchange.handle_request((OrderActions.Disconnect, 0)), (OrderActions.Disconnect, 1))
+        self.assertEqual(exchange.depth("MSFT"), ([], []))
+        self.assertEqual(exchange.engine_for("AAPL").open_orders, {1: {5: exchange.engine_for("AAPL").bid_book[0]}})
+        self.assertEqual(dict(exchange.trader_symbols), {0: set(), 1: {"AAPL"}})
+
+        # the books of a lazily restored exchange are built when a mass cancel reaches them
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "exchange.snap")
+            exchange.snapshot(path)
+            restored = Exchange(traders=2)
+            restored.restore(path, lazy=True)
+        self.assertEqual(restored.handle_request((OrderActions.Disconnect, 0)), (OrderActions.Disconnect, 0))
+        self.assertIn("AAPL", restored.pending_books)
+        self.assertEqual(restored.handle_request((OrderActions.Disconnect, 1)), (OrderActions.Disconnect, 1))
+        self.assertEqual(restored.depth("AAPL"), ([], []))
+
+    def test_orders_expire(self):
+        exchange = Exchange(traders=2)
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        # the exchange clock numbers the orders, the good-till-time order expires when the third one arrives
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, 10, OrderSide.BUY, 0, TimeInForce.GTT, 3)))
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "MSFT", 5, 20, OrderSide.SELL, 0, TimeInForce.DAY)))
+        self.assertEqual((exchange.book_expiry, exchange.next_expiry), ({"AAPL": 3}, 3))
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 5, 9, OrderSide.SELL, 0)))
+        self.assertEqual(replies[0][-1], (OrderActions.Cancel, Ack(0, 1, "AAPL")))
+        self.assertEqual(exchange.depth("AAPL"), ([], [(9, 5, 1)]))
+        self.assertEqual((exchange.book_expiry, exchange.expiry_heap, exchange.next_expiry), ({}, [], float('inf')))
+
+        exchange.handle_request((OrderActions.End_Of_Day,))
+        self.assertEqual(replies[0][-1], (OrderActions.Cancel, Ack(0, 2, "MSFT")))
+        self.assertEqual(exchange.depth("MSFT"), ([], []))
+        self.assertEqual(replies[1], [(OrderActions.Ack, Ack(1, 3, "AAPL"))])
+
+    def test_wall_clock_stamps(self):
+        # the wall stamps only time the orders, priority is the exchange clock's, the order they arrived in
+        exchange = Exchange(traders=3, wall_clock=count(1000, 7).__next__)
+        replies = [[], [], []]
+        exchange.reply = [responses.append for responses in replies]
+        orders = [LimitOrder(id, "AAPL", 5, 100, OrderSide.SELL, 0) for id in (2, 0, 1)]
+        for order in orders:
+            exchange.handle_request((OrderType.LIMIT, order.id, order))
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 8, 100, OrderSide.BUY, 0)))
+
+        self.assertEqual([order.time for order in orders], [1, 2, 3])
+        self.assertEqual([order.wall for order in orders], [1000, 1014, 1028])
+        # the buy takes the first seller's 5 and 3 of the second's, the third is not reached
+        self.assertEqual(replies[2][-1], (OrderActions.Place, Fill(2, "AAPL", 5, 100.0, OrderSide.SELL, 1, True, 1)))
+        self.assertEqual(replies[1], [(OrderActions.Ack, Ack(1, 3, "AAPL"))])
+        self.assertEqual(exchange.depth("AAPL"), ([], [(100.0, 7, 2)]))
+        latency = exchange.stats()['total']['latency_ns']['order']
+        self.assertEqual((latency['count'], latency['min'], latency['max']), (4, 7, 7))
+
+    def test_batch_applies_cancels_first(self):
+        exchange = Exchange(traders=2, batch_size=10)
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        exchange.reply_batch = [responses.extend for responses in replies]
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 10, 100, OrderSide.SELL, 0)))
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 10, 101, OrderSide.SELL, 0)))
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "MSFT", 10, 50, OrderSide.SELL, 0)))
+        del replies[1][:]
+
+        # the cancel and the amend arrive after the orders that would trade with the old quantities, but a batch
+        # applies them first
+        trader_to_exchange.extend([(OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 20, 101, OrderSide.BUY, 0)),
+                                   (OrderType.LIMIT, 0, LimitOrder(0, "MSFT", 5, 50, OrderSide.BUY, 0)),
+                                   (OrderActions.Cancel, 1, "AAPL", 1),
+                                   (OrderActions.Amend, 1, 4, "AAPL", 2),
+                                   (OrderActions.Return_Balance_And_Position, 1)])
+        exchange.run_batch()
+        exchange.flush()
+        self.assertEqual(exchange.depth("AAPL"), ([(101, 16, 1)], []))
+        self.assertEqual(exchange.depth("MSFT"), ([], [(50, 5, 1)]))
+        self.assertEqual(replies[1], [(OrderActions.Cancel, True), (OrderActions.Amend, True),
+                                      (OrderActions.Place, Fill(1, "AAPL", 4, 101.0, OrderSide.SELL, 2, True, 2)),
+                                      (OrderActions.Place, Fill(1, "MSFT", 5, 50.0, OrderSide.SELL, 3, True, 3)),
+                                      (OrderActions.Return_Balance_And_Position,
+                                       (1000654.0, {"AAPL": -4, "MSFT": -5}))])
+        self.assertEqual([response[0] for response in replies[0]],
+                         [OrderActions.Ack, OrderActions.Place, OrderActions.Ack, OrderActions.Place])
+
+    def test_sharded_matches_in_process(self):
+        def flow(seed):
+            # seeded order flow of every order type and action, in two symbols around a price of 100
+            rng = random.Random(seed)
+            requests = []
+            for _ in range(2000):
+                trader, symbol = rng.randrange(4), rng.choice(("AAPL", "MSFT"))
+                side = rng.choice((OrderSide.BUY, OrderSide.SELL))
+                price = round(100 + rng.uniform(-0.5, 0.5), 2)
+                quantity = rng.randrange(1, 20)
+                kind = rng.random()
+                if kind < 0.4:
+                    order = LimitOrder(trader, symbol, quantity, price, side, 0)
+                elif kind < 0.5:
+                    time_in_force = rng.choice((TimeInForce.DAY, TimeInForce.GTT))
+                    order = LimitOrder(trader, symbol, quantity, price, side, 0, time_in_force,
+                                       len(requests) + rng.randrange(1, 200) if time_in_force is TimeInForce.GTT
+                                       else None)
+                elif kind < 0.55:
+                    order = IcebergOrder(trader, symbol, quantity * 5, price, quantity, side, 0)
+                elif kind < 0.6:
+                    order = StopOrder(trader, symbol, quantity, price, side, 0)
+                elif kind < 0.65:
+                    order = StopLimitOrder(trader, symbol, quantity, price, price, side, 0)
+                elif kind < 0.7:
+                    order = FOKOrder(trader, symbol, quantity * 3, price, side, 0)
+                elif kind < 0.75:
+                    order = IOCOrder(trader, symbol, quantity * 3, price, side, 0)
+                elif kind < 0.78:
+                    order = MarketOrder(trader, symbol, quantity, side, 0)
+                elif kind < 0.88:
+                    requests.append((OrderActions.Cancel, trader, symbol, rng.randrange(len(requests) + 1) + 1))
+                    continue
+                elif kind < 0.96:
+                    requests.append((OrderActions.Amend, trader, 1, symbol))
+                    continue
+                elif kind < 0.99:
+                    requests.append((OrderActions.Cancel_All, trader, rng.choice((None, symbol)),
+                                     rng.choice((None, side))))
+                    continue
+                else:
+                    requests.append((OrderActions.End_Of_Day,))
+                    continue
+                requests.append((order.type, trader, order))
+            return requests
+
+        def run(exchange):
+            replies = [[] for _ in range(4)]
+            exchange.reply = [responses.append for responses in replies]
+            trader_to_exchange.extend(flow(7))
+            exchange.run_infinite_loop()
+            return replies
+
+        in_process = Exchange(traders=4, shards=2)
+        expected = run(in_process)
+        sharded = Exchange(traders=4, shards=2)
+        sharded.start_workers()
+        try:
+            replies = run(sharded)
+        finally:
+            sharded.stop_workers()
+
+        # the shard workers answer in their own order, but every response is the same
+        for trader in range(4):
+            self.assertEqual(Counter(replies[trader]), Counter(expected[trader]))
+            self.assertEqual(sharded.ledger.balance(trader), in_process.ledger.balance(trader))
+            self.assertEqual(sharded.ledger.position(trader), in_process.ledger.position(trader))
+        self.assertTrue(any(response[0] is OrderActions.Cancel and isinstance(response[1], Ack)
+                            for responses in expected for response in responses))  # orders expired
+
+    def test_invalid_requests_rejected(self):
+        exchange = Exchange(traders=2, tick_size=0.05, lot_size=10)
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 10, 10.02, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 15, 10, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 20, 10, OrderSide.BUY, 0)))
+        # a refused order takes no order id
+        self.assertEqual([(response[0], response[1].order_id) for response in replies[0]],
+                         [(OrderActions.Reject, 0), (OrderActions.Reject, 0), (OrderActions.Ack, 1)])
+        self.assertEqual([response[1].reason for response in replies[0][:2]],
+                         ["Price Must Be A Multiple Of The Tick Size!", "Quantity Must Be A Multiple Of The Lot Size!"])
+        self.assertEqual(exchange.handle_request((OrderActions.Amend, 0, 5, "AAPL", 1)),
+                         (OrderActions.Reject, Reject(0, 1, "AAPL", "Quantity Must Be A Multiple Of The Lot Size!")))
+
+        # batch mode answers them and goes on with the rest of the batch
+        exchange.batch_size = 10
+        exchange.reply_batch = [responses.extend for responses in replies]
+        del replies[0][:]
+        trader_to_exchange.extend([(OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 10, 9.99, OrderSide.SELL, 0)),
+                                   (OrderActions.Amend, 0, 15, "AAPL", 1),
+                                   (OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 10, 10, OrderSide.SELL, 0))])
+        exchange.run_batch()
+        exchange.flush()
+        self.assertEqual([response[0] for response in replies[1]],
+                         [OrderActions.Reject, OrderActions.Ack, OrderActions.Place])
+        self.assertEqual([response[0] for response in replies[0]], [OrderActions.Reject, OrderActions.Place])
+        self.assertEqual(exchange.depth("AAPL"), ([(10, 10, 1)], []))
+
+    def test_reply_tables_follow_traders(self):
+        exchange = Exchange(traders=150, batch_size=10)
+        trader_to_exchange.append((OrderType.LIMIT, 149, LimitOrder(149, "AAPL", 5, 10, OrderSide.BUY, 0)))
+        exchange.run_batch()
+        exchange.flush()
+        self.assertEqual(exchange_to_trader[149].popleft(), (OrderActions.Ack, Ack(149, 1, "AAPL")))
+        exchange.handle_request((OrderActions.Cancel, 149, "AAPL"))
+        self.assertEqual(exchange.depth("AAPL"), ([], []))
+
+        # a trader id past the tables grows them, as it grows the ledger
+        trader_to_exchange.append((OrderType.LIMIT, 160, LimitOrder(160, "AAPL", 5, 10, OrderSide.SELL, 0)))
+        exchange.run_batch()
+        exchange.flush()
+        exchange.handle_request((OrderType.LIMIT, 170, LimitOrder(170, "AAPL", 5, 10, OrderSide.BUY, 0)))
+        self.assertEqual(exchange_to_trader[160].popleft(), (OrderActions.Ack, Ack(160, 2, "AAPL")))
+        self.assertEqual(exchange_to_trader[160].popleft()[1].quantity, 5)
+        self.assertEqual(exchange_to_trader[170].popleft(), (OrderActions.Ack, Ack(170, 3, "AAPL")))
+        self.assertEqual(exchange_to_trader[170].popleft()[1].quantity, 5)
+        self.assertEqual(exchange.handle_request((OrderActions.Return_Balance_And_Position, 170)),
+                         (OrderActions.Return_Balance_And_Position, (999950.0, {"AAPL": 5})))
+        self.assertEqual((len(exchange.reply), len(exchange.outbox), exchange.ledger.traders), (171, 171, 171))
+
+    def test_unfilled_ioc_and_fok_cancelled(self):
+        exchange = Exchange(traders=2)
+        replies = [[], []]
+        exchange.reply = [responses.append for responses in replies]
+        exchange.handle_request((OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 5, 10, OrderSide.SELL, 0)))
+        exchange.handle_request((OrderType.FOK, 0, FOKOrder(0, "AAPL", 8, 10, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.IOC, 0, IOCOrder(0, "AAPL", 8, 10, OrderSide.BUY, 0)))
+        exchange.handle_request((OrderType.IOC, 0, IOCOrder(0, "AAPL", 8, 10, OrderSide.SELL, 0)))
+        self.assertEqual([(response[0], response[1].order_id) for response in replies[0]],
+                         [(OrderActions.Ack, 2), (OrderActions.Cancel, 2), (OrderActions.Ack, 3),
+                          (OrderActions.Place, 3), (OrderActions.Cancel, 3), (OrderActions.Ack, 4),
+                          (OrderActions.Cancel, 4)])
+        self.assertEqual(exchange.depth("AAPL"), ([], []))
+
+    def test_journal_replay(self):
+        requests = [(OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 10, 100, OrderSide.BUY, 0)),
+                    (OrderType.LIMIT, 1, LimitOrder(1, "AAPL", 5, 101, OrderSide.SELL, 0, TimeInForce.GTT, 11)),
+                    (OrderType.STOP, 0, StopOrder(0, "AAPL", 2, 101, OrderSide.BUY, 0)),
+                    (OrderType.STOP_LIMIT, 1, StopLimitOrder(1, "AAPL", 2, 99, 98, OrderSide.SELL, 0)),
+                    (OrderType.FOK, 1, FOKOrder(1, "AAPL", 3, 100, OrderSide.SELL, 0)),
+                    (OrderType.LIMIT, 1, IcebergOrder(1, "MSFT", 30, 50, 10, OrderSide.SELL, 0)),
+                    (OrderType.LIMIT, 0, LimitOrder(0, "MSFT", 15, 50, OrderSide.BUY, 0)),
+                    (OrderType.IOC, 0, IOCOrder(0, "AAPL", 1, 101, OrderSide.BUY, 0)),
+                    (OrderActions.Amend, 0, 4, "AAPL", 1),
+                    (OrderActions.Cancel, 1, "MSFT"),
+                    (OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, 90, OrderSide.BUY, 0, TimeInForce.DAY)),
+                    (OrderType.LIMIT, 1, LimitOrder(1, "MSFT", 5, 51, OrderSide.SELL, 0)),
+                    (OrderActions.Cancel_All, 0, "AAPL", OrderSide.BUY),
+                    (OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, 95, OrderSide.BUY, 0)),
+                    (OrderActions.Return_Balance_And_Position, 1)]
+
+        def run(exchange, path=None):
+            replies = [[], []]
+            exchange.reply = [responses.append for responses in replies]
+            if path is None:
+                for request in requests:
+                    exchange.deliver(request, exchange.handle_request(request))
+            else:
+                self.assertEqual(exchange.replay(path), len(requests))
+            return replies
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "exchange.journal")
+            exchange = Exchange(traders=2, journal=Journal(path))
+            replies = run(exchange)
+            exchange.journal.close()
+            replayed = Exchange(traders=2)
+            self.assertEqual(run(replayed, path), replies)
+
+        self.assertIn((OrderActions.Cancel, Ack(1, 2, "AAPL")), replies[1])  # the good-till-time order expired
+        for symbol in ("AAPL", "MSFT"):
+            self.assertEqual(replayed.depth(symbol), exchange.depth(symbol))
+            self.assertEqual([(order.order_id, order.quantity, order.reserve) for order in
+                              replayed.engine_for(symbol).order_index.values()],
+                             [(order.order_id, order.quantity, order.reserve) for order in
+                              exchange.engine_for(symbol).order_index.values()])
+        for trader in (0, 1):
+            self.assertEqual(replayed.ledger.balance(trader), exchange.ledger.balance(trader))
+            self.assertEqual(replayed.ledger.position(trader), exchange.ledger.position(trader))
+
+    def test_batch_journal_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "exchange.journal")
+            exchange = Exchange(traders=2, batch_size=10, journal=Journal(path))
+            replies = [[], []]
+            exchange.reply_batch = [responses.extend for responses in replies]
+            # one batch over two symbols, the new orders are matched by symbol but keep their arrival order ids
+            trader_to_exchange.extend([(OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, 10, OrderSide.BUY, 0)),
+                                       (OrderType.LIMIT, 0, LimitOrder(0, "MSFT", 5, 20, OrderSide.BUY, 0)),
+                                       (OrderType.LIMIT, 0, LimitOrder(0, "AAPL", 5, 11, OrderSide.BUY, 0)),
+                                       (OrderType.LIMIT, 1, LimitOrder(1, "MSFT", 2, 20, OrderSide.SELL, 0))])
+            exchange.run_batch()
+            trader_to_exchange.extend([(OrderActions.Cancel, 0, "AAPL", 3), (OrderActions.Amend, 0, 1, "MSFT", 2)])
+            exchange.run_batch()
+            exchange.flush()
+            exchange.journal.close()
+            self.assertIn((OrderActions.Cancel, True), replies[0])
+            self.assertIn((OrderActions.Amend, True), replies[0])
+
+            replayed = Exchange(traders=2)
+            replayed_replies = [[], []]
+            replayed.reply = [responses.append for responses in replayed_replies]
+            self.assertEqual(replayed.replay(path), 6)
+        for trader in (0, 1):
+            self.assertEqual(Counter(replayed_replies[trader]), Counter(replies[trader]))
+        for symbol in ("AAPL", "MSFT"):
+            self.assertEqual(replayed.depth(symbol), exchange.depth(symbol))
+        self.assertEqual(exchange.depth("AAPL"), ([(10, 5, 1)], []))
+
+    def test_journal_torn_tail(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "exchange.journal")
+            journal = Journal(path)
+            for quantity in (1, 2, 3):
+                journal.append(1, 1, 1, 1, 0, "AAPL", 100, quantity, 0)
+            journal.close()
+            with open(path, 'ab') as file:
+                file.write(b"\x00" * 20)  # a crash in the middle of the fourth record
+
+            # the torn record is cut, the next one continues the sequence
+            journal = Journal(path)
+            journal.append(1, 1, 1, 1, 0, "AAPL", 100, 4, 0)
+            journal.close()
+            self.assertEqual([(record[0], record[9]) for record in read_journal(path)],
+                             [(1, 1), (2, 2), (3, 3), (4, 4)])
+
+            # a file without the journal header of this version is refused
+            with open(path, 'r+b') as file:
+                file.write(b"EXJRNL00")
+            with self.assertRaises(ValueError):
+                Journal(path)
+            with self.assertRaises(ValueError):
+                list(read_journal(path))
+
+    def test_run_session(self):
+        random.seed(3)
+        exchange = Exchange(traders=3)
+        traders = [Trader(id) for id in range(3)]
+        requests = Counter()
+        processed = [[] for _ in traders]
+
+        def counted(request):
+            requests[request[1]] += 1
+            return Exchange.handle_request(exchange, request)
+
+        def recorded(trader):
+            process = trader.process_response
+
+            def record(response):
+                processed[trader.id].append(response)
+                process(response)
+            return record
+
+        exchange.handle_request = counted
+        for trader in traders:
+            trader.process_response = recorded(trader)
+
+        async def session():
+            inboxes = await asyncio.wait_for(run_session(exchange, traders, actions=40), 10)
+            return inboxes, asyncio.all_tasks() - {asyncio.current_task()}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            inboxes, tasks = asyncio.run(session())
+        self.assertEqual(tasks, set())  # the None sentinel ended the exchange task
+
+        acks = 0
+        for trader in traders:
+            inbox = inboxes[trader.id]
+            replies = processed[trader.id] + [inbox.get_nowait() for _ in range(inbox.qsize())]
+            self.assertEqual(replies[-1][0], OrderActions.Disconnect)  # the last request, answered last
+            # one reply per request, an Ack for a new order, with the fills on top
+            fills = [fill for action, fill in replies if action == OrderActions.Place]
+            self.assertEqual(len(replies) - len(fills), requests[trader.id])
+            self.assertEqual(sum(fill.quantity if fill.side == OrderSide.BUY else -fill.quantity for fill in fills),
+                             exchange.ledger.position(trader.id).get("AAPL", 0))
+            acks += sum(action == OrderActions.Ack for action, response in replies)
+        self.assertEqual(acks, next(exchange.order_ids) - 1)
+        self.assertEqual(exchange.depth("AAPL"), ([], []))  # the disconnects cancelled every resting order
+
+    def test_flow_generator(self):
+        mix = {'limit': 0.5, 'market': 0.1, 'ioc': 0.1, 'cancel': 0.2, 'amend': 0.1}
+
+        def generator(seed):
+            return FlowGenerator(traders=7, symbols=("AAPL", "MSFT"), mix=mix, mid=5000, spread=3.0, quantity=4,
+                                 lot_size=5, tick_size=0.05, seed=seed, chunk_size=1000)
+
+        def fields(request):
+            # a request with its order as plain values, orders do not compare
+            if isinstance(request[2], (LimitOrder, MarketOrder, IOCOrder)):
+                order = request[2]
+                return request[:2] + (order.symbol, order.quantity, getattr(order, 'price', None), order.side)
+            return request
+
+        flow = generator(11)
+        chunks = list(flow.chunks(2500))
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 500])
+        requests = [request for chunk in chunks for request in flow.requests(chunk)]
+        self.assertEqual([fields(request) for request in requests],
+                         [fields(request) for request in generator(11).stream(2500)])  # the same seed, the same flow
+        self.assertNotEqual([fields(request) for request in requests],
+                            [fields(request) for request in generator(12).stream(2500)])
+        times = [time for chunk in chunks for time in chunk['time'].tolist()]
+        self.assertEqual(times, sorted(times))
+
+        actions = Counter(request[0] for request in requests)
+        for action, kind in ((OrderType.LIMIT, 'limit'), (OrderType.MARKET, 'market'), (OrderType.IOC, 'ioc'),
+                             (OrderActions.Cancel, 'cancel'), (OrderActions.Amend, 'amend')):
+            self.assertAlmostEqual(actions[action] / len(requests), mix[kind], delta=0.05)
+
+        exchange = Exchange(tick_size=0.05, lot_size=5)
+        for request in requests:
+            self.assertIn(request[1], range(7))
+            if request[0] == OrderActions.Cancel:
+                self.assertIn(request[2], ("AAPL", "MSFT"))
+                continue
+            # on the tick and in lots, the exchange takes every order and amendment
+            self.assertIsNone(exchange.refuse(request))
+            if request[0] == OrderActions.Amend:
+                self.assertGreater(request[2], 0)
+                continue
+            order = request[2]
+            self.assertIn(order.symbol, ("AAPL", "MSFT"))
+            self.assertGreater(order.quantity, 0)
+            if request[0] != OrderType.MARKET:
+                self.assertLess(abs(order.price / 0.05 - 5000), 50)  # within a few spreads of the mid
+
+        # a cancel or amend names its trader's latest limit order in the symbol by the id the exchange gave it
+        replies = [[] for _ in range(7)]
+        exchange.reply = [responses.append for responses in replies]
+        latest = {}
+        for request in requests:
+            if request[0] == OrderActions.Cancel:
+                self.assertEqual(request[3], latest.get((request[1], request[2])))
+            elif request[0] == OrderActions.Amend:
+                self.assertEqual(request[4], latest.get((request[1], request[3])))
+            answered = len(replies[request[1]])
+            exchange.handle_request(request)
+            if request[0] == OrderType.LIMIT:
+                action, ack = replies[request[1]][answered]
+                latest[request[1], ack.symbol] = ack.order_id
+        self.assertGreater(len(latest), 10)
+
+        self.assertEqual({request[0] for request in FlowGenerator(mix={'cancel': 1.0}, seed=1).stream(100)},
+                         {OrderActions.Cancel})
+        with self.assertRaises(ValueError):
+            FlowGenerator(mix={'stop': 1.0})
+
+if __name__ == "__main__":
+    import __main__
+
+    suite = unittest.TestLoader().loadTestsFromModule(__main__)
+    buf = io.StringIO()
+    unittest.TextTestRunner(stream=buf, verbosity=2).run(suite)
+    buf = buf.getvalue().split("\n")
+    sum = 0
+    for test in buf:
+        if test.startswith("test"):
+            sum += 1
+
+    print("You have %d unit tests" % (sum))
@@ -0,0 +1,73 @@
+# Requests per second of Exchange.run_infinite_loop, one request at a time against batch mode
+#
+# A seeded request stream over a few symbols and 100 traders: 40% limit orders around a mid price,
+# 30% cancels, 25% amends and 5% balance requests, fed in `--chunk` requests per loop call.
+# The response deques are emptied after every loop call, as the traders would. The "loop" row is the
+# one request at a time path; batch size 1 runs batch mode with one request per cycle.
+#
+# Usage: python benchmarks/bench_batching.py [--requests 200000] [--batch-sizes 1,16,256,1024]
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_arena
+
+
+def request_flow(arena, requests, seed):
+    rng = random.Random(seed)
+    symbols = ['AAPL', 'MSFT', 'AMZN', 'GOOG']
+    flow = []
+    for i in range(requests):
+        trader = rng.randrange(100)
+        symbol = rng.choice(symbols)
+        kind = rng.random()
+        if kind < 0.40:
+            side = arena.OrderSide.BUY if rng.random() < 0.5 else arena.OrderSide.SELL
+            order = arena.LimitOrder(trader, symbol, rng.randint(2, 20), 100 + rng.randint(-10, 10) * 0.01, side,
+                                     float(i))
+            flow.append((arena.OrderType.LIMIT, trader, order))
+        elif kind < 0.70:
+            flow.append((arena.OrderActions.Cancel, trader, symbol))
+        elif kind < 0.95:
+            flow.append((arena.OrderActions.Amend, trader, 1, symbol))
+        else:
+            flow.append((arena.OrderActions.Return_Balance_And_Position, trader))
+    return flow
+
+
+def run(arena, flow, batch_size, chunk):
+    gc.collect()
+    exchange = arena.Exchange(batch_size=batch_size)  # None is the one request at a time loop
+    start = time.perf_counter()
+    for i in range(0, len(flow), chunk):
+        arena.trader_to_exchange.extend(flow[i:i + chunk])
+        exchange.run_infinite_loop()
+        for responses in arena.exchange_to_trader:  # the traders consume their responses
+            responses.clear()
+    return len(flow) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--batch-sizes', default='1,16,256,1024')
+    parser.add_argument('--chunk', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many runs is reported')
+    args = parser.parse_args()
+
+    arena = load_arena()
+    print("%-12s %16s" % ("batch size", "requests/sec"))
+    for batch_size in [None] + [int(b) for b in args.batch_sizes.split(',')]:
+        rates = [run(arena, request_flow(arena, args.requests, args.seed), batch_size, args.chunk)
+                 for _ in range(args.repeat)]  # the flow is rebuilt every run, matching mutates the orders
+        print("%-12s %16.0f" % ("loop" if batch_size is None else batch_size, max(rates)))
+
+
+if __name__ == "__main__":
+    main()
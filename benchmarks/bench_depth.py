@@ -0,0 +1,63 @@
+# Per-order cost of aggressive orders as a function of book depth
+#
+# The ask book is filled with `depth` resting limit orders (10 per price level, quantity 1000 each),
+# then market and marketable limit buys of quantity 1 are sent against it. Every aggressive order
+# partially fills the best ask, so the depth stays the same for the whole run.
+#
+# Usage: python benchmarks/bench_depth.py [--engine path/to/matching_machine.py]
+# Pointing --engine at an older copy of matching_machine.py (e.g. from `git show`) gives the "before" numbers.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_engine
+
+
+def build_book(engine_module, depth):
+    matching_engine = engine_module.MatchingEngine()
+    asks = [engine_module.LimitOrder(i, 'S', 1000, 100 + i // 10, engine_module.OrderSide.SELL, i)
+            for i in range(depth)]
+    try:
+        matching_engine.ask_book = asks  # list based books can be assigned in sorted order directly
+    except AttributeError:
+        for order in asks:
+            matching_engine.insert_limit_order(order)
+    return matching_engine
+
+
+def per_order_cost(engine_module, depth, orders):
+    matching_engine = build_book(engine_module, depth)
+    best_price = 100
+    incoming = []
+    for i in range(orders):
+        if i % 2:
+            incoming.append(engine_module.MarketOrder(depth + i, 'S', 1, engine_module.OrderSide.BUY, depth + i))
+        else:
+            incoming.append(engine_module.LimitOrder(depth + i, 'S', 1, best_price, engine_module.OrderSide.BUY,
+                                                     depth + i))
+    handle_order = matching_engine.handle_order
+    start = time.perf_counter()
+    for order in incoming:
+        handle_order(order)
+    return (time.perf_counter() - start) / orders
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', default=os.path.join(os.path.dirname(__file__), '..', 'matching_machine.py'))
+    parser.add_argument('--depths', default='10,100,1000,10000,100000')
+    parser.add_argument('--orders', type=int, default=500)
+    args = parser.parse_args()
+
+    engine_module = load_engine(args.engine)
+    print("%10s %16s" % ("depth", "us per order"))
+    for depth in [int(d) for d in args.depths.split(',')]:
+        cost = per_order_cost(engine_module, depth, args.orders)
+        print("%10d %16.2f" % (depth, cost * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# Matching engine benchmark suite: throughput, latency percentiles and peak memory of MatchingEngine
+#
+# Each scenario rests `depth` limit orders (both sides, spread over `dispersion` price levels around a mid
+# price) and then drives `--ops` synthetic operations through handle_order, cancel_order and
+# amend_quantity in the proportions of an order mix. Incoming limit and IOC prices are drawn within
+# `dispersion` ticks of the mid, so the dispersion also sets how often they cross.
+#
+# Three sweeps are run by default: book depth (balanced mix), order mix and price dispersion (depth 10000).
+# Every operation is timed on its own for the latency percentiles; the peak memory is the tracemalloc
+# peak of a second, untimed pass of the same scenario (--no-memory skips it).
+#
+# Usage: python benchmarks/bench_engine.py [--sweeps depth,mix,dispersion] [--output results.json]
+#                                          [--compare previous.json] [--engine path/to/matching_machine.py]
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_engine
+
+# operation -> share of the flow
+MIXES = {
+    'passive': {'limit': 0.80, 'cancel': 0.15, 'amend': 0.05},
+    'balanced': {'limit': 0.50, 'market': 0.10, 'ioc': 0.10, 'cancel': 0.20, 'amend': 0.10},
+    'aggressive': {'limit': 0.30, 'market': 0.30, 'ioc': 0.20, 'cancel': 0.10, 'amend': 0.10},
+    'cancel-heavy': {'limit': 0.45, 'cancel': 0.50, 'amend': 0.05},
+}
+MID = 10000
+
+
+def scenarios(sweeps, depths):
+    for sweep in sweeps:
+        if sweep == 'depth':
+            for depth in depths:
+                yield {'sweep': sweep, 'depth': depth, 'mix': 'balanced', 'dispersion': 10}
+        elif sweep == 'mix':
+            for mix in MIXES:
+                yield {'sweep': sweep, 'depth': 10000, 'mix': mix, 'dispersion': 10}
+        elif sweep == 'dispersion':
+            for dispersion in (1, 10, 100, 1000):
+                yield {'sweep': sweep, 'depth': 10000, 'mix': 'balanced', 'dispersion': dispersion}
+        else:
+            raise ValueError("Unknown sweep %r" % sweep)
+
+
+def build_book(engine_module, depth, dispersion):
+    matching_engine = engine_module.MatchingEngine()
+    side = engine_module.OrderSide
+    for id in range(depth):
+        if id % 2:
+            order = engine_module.LimitOrder(id, 'S', 100, MID + 1 + id // 2 % dispersion, side.SELL, id)
+        else:
+            order = engine_module.LimitOrder(id, 'S', 100, MID - 1 - id // 2 % dispersion, side.BUY, id)
+        matching_engine.handle_order(order)
+    return matching_engine
+
+
+def operation_flow(engine_module, scenario, ops, seed):
+    # (kind, argument) pairs, the orders are built up front so only the engine is timed
+    rng = random.Random(seed)
+    depth, dispersion = scenario['depth'], scenario['dispersion']
+    kinds, weights = zip(*MIXES[scenario['mix']].items())
+    side = engine_module.OrderSide
+    flow = []
+    for i, kind in enumerate(rng.choices(kinds, weights, k=ops)):
+        id = depth + i
+        order_side = side.BUY if rng.random() < 0.5 else side.SELL
+        price = MID + rng.randint(-dispersion, dispersion)
+        if kind == 'limit':
+            flow.append((kind, engine_module.LimitOrder(id, 'S', rng.randint(1, 100), max(price, 1), order_side, id)))
+        elif kind == 'market':
+            flow.append((kind, engine_module.MarketOrder(id, 'S', rng.randint(1, 100), order_side, id)))
+        elif kind == 'ioc':
+            flow.append((kind, engine_module.IOCOrder(id, 'S', rng.randint(1, 100), max(price, 1), order_side, id)))
+        else:  # cancel / amend an order that may or may not still rest
+            flow.append((kind, rng.randrange(id)))
+    return flow
+
+
+def drive(engine_module, matching_engine, flow, latencies=None):
+    handle_order = matching_engine.handle_order
+    cancel_order = matching_engine.cancel_order
+    amend_quantity = matching_engine.amend_quantity
+    NewQuantityNotSmaller = engine_module.NewQuantityNotSmaller
+    clock = time.perf_counter_ns
+    append = latencies.append if latencies is not None else None
+    start = clock()
+    for kind, argument in flow:
+        before = clock()
+        if kind == 'cancel':
+            cancel_order(argument)
+        elif kind == 'amend':
+            try:
+                amend_quantity(argument, 1)
+            except NewQuantityNotSmaller:
+                pass
+        else:
+            handle_order(argument)
+        if append is not None:
+            append(clock() - before)
+    return clock() - start
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(engine_module, scenario, ops, seed, memory):
+    flow = operation_flow(engine_module, scenario, ops, seed)
+    matching_engine = build_book(engine_module, scenario['depth'], scenario['dispersion'])
+    latencies = []
+    gc.collect()
+    gc.disable()  # collections triggered by the order objects would land on random operations
+    try:
+        elapsed = drive(engine_module, matching_engine, flow, latencies)
+    finally:
+        gc.enable()
+    latencies.sort()
+    result = dict(scenario)
+    result.update({
+        'ops': ops,
+        'ops_per_sec': ops / (elapsed / 1e9),
+        'p50_us': percentile(latencies, 0.50) / 1e3,
+        'p99_us': percentile(latencies, 0.99) / 1e3,
+        'p999_us': percentile(latencies, 0.999) / 1e3,
+        'peak_mb': None,
+    })
+    del matching_engine, flow, latencies
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        flow = operation_flow(engine_module, scenario, ops, seed)
+        matching_engine = build_book(engine_module, scenario['depth'], scenario['dispersion'])
+        drive(engine_module, matching_engine, flow)
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def key_of(result):
+    return result['sweep'], result['depth'], result['mix'], result['dispersion']
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', default=os.path.join(os.path.dirname(__file__), '..', 'matching_machine.py'))
+    parser.add_argument('--sweeps', default='depth,mix,dispersion')
+    parser.add_argument('--depths', default='10,1000,100000,1000000')
+    parser.add_argument('--ops', type=int, default=100000, help='operations per scenario')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the peak memory pass')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run, its ops/sec is shown next to this run')
+    args = parser.parse_args()
+
+    engine_module = load_engine(args.engine)
+    previous = {}
+    if args.compare:
+        with open(args.compare) as file:
+            previous = {key_of(result): result for result in json.load(file)['results']}
+
+    print("%-10s %8s %-13s %5s %12s %9s %9s %9s %9s %8s" % ("sweep", "depth", "mix", "disp", "ops/sec", "p50 us",
+                                                            "p99 us", "p99.9 us", "peak MB", "vs prev"))
+    results = []
+    for scenario in scenarios(args.sweeps.split(','), [int(d) for d in args.depths.split(',')]):
+        result = run_scenario(engine_module, scenario, args.ops, args.seed, args.memory)
+        results.append(result)
+        before = previous.get(key_of(result))
+        print("%-10s %8d %-13s %5d %12.0f %9.2f %9.2f %9.2f %9s %8s" % (
+            result['sweep'], result['depth'], result['mix'], result['dispersion'], result['ops_per_sec'],
+            result['p50_us'], result['p99_us'], result['p999_us'],
+            '-' if result['peak_mb'] is None else '%.1f' % result['peak_mb'],
+            '%.2fx' % (result['ops_per_sec'] / before['ops_per_sec']) if before else '-'))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'engine': os.path.abspath(args.engine), 'commit': git_commit(),
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'date': datetime.datetime.now().isoformat(timespec='seconds'), 'ops': args.ops,
+                       'seed': args.seed, 'results': results}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
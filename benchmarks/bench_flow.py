@@ -0,0 +1,54 @@
+# Speed of the generated order flow (FlowGenerator, needs NumPy)
+#
+# Reports requests per second for drawing the structured array chunks alone, for materializing them as
+# request tuples, and the traced peak memory of streaming all of them, which is bounded by one chunk.
+#
+# Usage: python benchmarks/bench_flow.py [--requests 5000000] [--chunk-size 65536] [--symbols 100]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_arena
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000000)
+    parser.add_argument('--chunk-size', type=int, default=1 << 16)
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    arena = load_arena()
+    symbols = ['S%04d' % i for i in range(args.symbols)]
+
+    def generator():
+        return arena.FlowGenerator(symbols=symbols, seed=args.seed, chunk_size=args.chunk_size)
+
+    start = time.perf_counter()
+    for chunk in generator().chunks(args.requests):
+        pass
+    arrays = args.requests / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for request in generator().stream(args.requests):
+        pass
+    tuples = args.requests / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    for request in generator().stream(min(args.requests, 20 * args.chunk_size)):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%-28s %16.0f" % ("arrays (requests/sec)", arrays))
+    print("%-28s %16.0f" % ("request tuples (requests/sec)", tuples))
+    print("%-28s %16.1f" % ("streaming peak (MB)", peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
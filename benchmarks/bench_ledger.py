@@ -0,0 +1,106 @@
+# Fill settlement and end-of-run accounting of the NumPy Ledger against the list / dict ledger it replaced
+#
+# `--fills` random fills over `--traders` traders and `--symbols` symbols are settled one at a time into
+# per-trader lists and dicts, as Exchange.apply_fill used to, and recorded into a Ledger that applies them
+# with one scatter-add. The accounting rows compute the cash total, the conservation check and the
+# equity, gross and net exposure of every trader at the last prices.
+#
+# Usage: python benchmarks/bench_ledger.py [--traders 1000000] [--symbols 16] [--fills 1000000]
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_arena
+
+
+def fill_flow(traders, symbols, fills, seed):
+    rng = random.Random(seed)
+    return [(rng.randrange(traders), rng.randrange(symbols), rng.randint(1, 100), rng.randint(9900, 10100))
+            for _ in range(fills)]
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--traders', type=int, default=1000000)
+    parser.add_argument('--symbols', type=int, default=16)
+    parser.add_argument('--fills', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    arena = load_arena()
+    names = ['S%03d' % i for i in range(args.symbols)]
+    flow = fill_flow(args.traders, args.symbols, args.fills, args.seed)
+    initial = 1000000 * 100
+
+    balance = [initial] * args.traders
+    position = [defaultdict(int) for _ in range(args.traders)]
+    last = {}
+
+    def settle_lists():
+        # a buyer and a seller per fill, trader t trades with trader t + 1
+        for trader, symbol, quantity, price in flow:
+            money = quantity * price
+            other = (trader + 1) % args.traders
+            balance[trader] -= money
+            position[trader][names[symbol]] += quantity
+            balance[other] += money
+            position[other][names[symbol]] -= quantity
+            last[names[symbol]] = price
+
+    ledger = arena.Ledger(args.traders, initial, 1, names)
+
+    def settle_ledger():
+        record = ledger.record
+        for trader, symbol, quantity, price in flow:
+            money = quantity * price
+            record(trader, symbol, -money, quantity, price)
+            record((trader + 1) % args.traders, symbol, money, -quantity, price)
+        ledger.settle()
+
+    def accounting_lists():
+        cash = sum(balance)
+        shares = defaultdict(int)
+        equity, gross, net = [], [], []
+        for trader_balance, trader_position in zip(balance, position):
+            value = exposure = 0
+            for symbol, held in trader_position.items():
+                shares[symbol] += held
+                value += held * last.get(symbol, 0)
+                exposure += abs(held) * last.get(symbol, 0)
+            equity.append(trader_balance + value)
+            gross.append(exposure)
+            net.append(value)
+        return cash == initial * args.traders and not any(shares.values())
+
+    def accounting_ledger():
+        conserved = ledger.conserved()
+        ledger.equity()
+        ledger.exposure()
+        return conserved
+
+    lists, lists_settle = timed(settle_lists)
+    _, ledger_settle = timed(settle_ledger)
+    lists_conserved, lists_accounting = timed(accounting_lists)
+    ledger_conserved, ledger_accounting = timed(accounting_ledger)
+
+    print("%d traders, %d symbols, %d fills (two ledger entries each)" % (args.traders, args.symbols, args.fills))
+    print("%-28s %12s %12s" % ("", "lists/dicts", "Ledger"))
+    print("%-28s %12.0f %12.0f" % ("settle, ns per fill", lists_settle / args.fills * 1e9,
+                                   ledger_settle / args.fills * 1e9))
+    print("%-28s %12.3f %12.3f" % ("end-of-run accounting, s", lists_accounting, ledger_accounting))
+    print("%-28s %12s %12s" % ("conserved", lists_conserved, ledger_conserved))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Bytes per resting order for a deep book
+#
+# Rests `orders` limit orders (1000 price levels) and reports the traced allocation per order for the
+# object book and, when the engine has it, for the column based OrderStore.
+#
+# Usage: python benchmarks/bench_memory.py [--engine path/to/matching_machine.py] [--orders 1000000]
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_engine
+
+
+def traced(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def object_book(engine_module, orders):
+    matching_engine = engine_module.MatchingEngine()
+    asks = [engine_module.LimitOrder(i, 'S', 100, 100 + i % 1000, engine_module.OrderSide.SELL, float(i))
+            for i in range(orders)]
+    if isinstance(matching_engine.ask_book, list):
+        # list based books re-sort on every insert, so the sorted list is assigned directly
+        matching_engine.ask_book = sorted(asks, key=lambda x: (x.price, -x.time))
+    else:
+        for order in asks:
+            matching_engine.insert_limit_order(order)
+    return matching_engine
+
+
+def store_book(engine_module, orders, use_numpy):
+    store = engine_module.OrderStore('S', tick_size=0.01, use_numpy=use_numpy)
+    side, type = engine_module.OrderSide.SELL, engine_module.OrderType.LIMIT
+    for i in range(orders):
+        store.add(i, 100 + i % 1000, 100, side, type, float(i))
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', default=os.path.join(os.path.dirname(__file__), '..', 'matching_machine.py'))
+    parser.add_argument('--orders', type=int, default=1000000)
+    args = parser.parse_args()
+
+    engine_module = load_engine(args.engine)
+    runs = [("object book", lambda: object_book(engine_module, args.orders))]
+    if hasattr(engine_module, 'OrderStore'):
+        runs.append(("OrderStore (array)", lambda: store_book(engine_module, args.orders, False)))
+        try:
+            import numpy
+            runs.append(("OrderStore (numpy)", lambda: store_book(engine_module, args.orders, True)))
+        except ImportError:
+            pass
+
+    print("%-20s %16s" % ("layout", "bytes per order"))
+    for name, build in runs:
+        result, size = traced(build)
+        print("%-20s %16.1f" % (name, size / args.orders))
+        del result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Journal write overhead and replay speed
+#
+# A seeded request stream (the mix of bench_batching.py) is run through Exchange.run_infinite_loop
+# without and with a journal, then the journal is replayed into a fresh exchange with Exchange.replay().
+# The replayed ledger is checked against the recorded one.
+#
+# Usage: python benchmarks/bench_replay.py [--requests 200000] [--journal path]
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_batching import request_flow
+from loaders import load_arena
+
+
+def run(arena, flow, chunk, journal=None):
+    gc.collect()
+    exchange = arena.Exchange(journal=journal)
+    start = time.perf_counter()
+    for i in range(0, len(flow), chunk):
+        arena.trader_to_exchange.extend(flow[i:i + chunk])
+        exchange.run_infinite_loop()
+        for responses in arena.exchange_to_trader:
+            responses.clear()
+    if journal is not None:
+        journal.close()
+    return exchange, len(flow) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--chunk', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--journal', help='journal file to write, a temporary file by default')
+    args = parser.parse_args()
+
+    arena = load_arena()
+    path = args.journal or os.path.join(tempfile.mkdtemp(), 'session.journal')
+    if os.path.exists(path):
+        os.remove(path)
+
+    exchange, plain = run(arena, request_flow(arena, args.requests, args.seed), args.chunk)
+    recorded, journaled = run(arena, request_flow(arena, args.requests, args.seed), args.chunk, arena.Journal(path))
+    replayed = arena.Exchange()
+    gc.collect()
+    start = time.perf_counter()
+    count = replayed.replay(path)
+    replay = count / (time.perf_counter() - start)
+    for responses in arena.exchange_to_trader:
+        responses.clear()
+
+    print("journal: %s, %d bytes" % (path, os.path.getsize(path)))
+    print("%-24s %16s" % ("run", "requests/sec"))
+    print("%-24s %16.0f" % ("no journal", plain))
+    print("%-24s %16.0f" % ("journal", journaled))
+    print("%-24s %16.0f" % ("replay", replay))
+    same = (recorded.ledger.cash() == replayed.ledger.cash() and
+            (recorded.ledger.equity() == replayed.ledger.equity()).all() and
+            (recorded.ledger.holdings() == replayed.ledger.holdings()).all())
+    print("replayed ledger matches: %s" % same)
+
+
+if __name__ == "__main__":
+    main()
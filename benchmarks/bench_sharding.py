@@ -0,0 +1,68 @@
+# Orders per second of the exchange with its symbol shards in 1, 2, 4 and 8 worker processes
+#
+# A seeded stream of limit orders over many symbols (prices a few ticks around 100, so roughly half of
+# them trade) is fed through the exchange's request queue, `--batch` requests at a time. The in-process
+# row runs the same stream through the ordinary single process loop.
+#
+# Usage: python benchmarks/bench_sharding.py [--orders 200000] [--symbols 256] [--workers 1,2,4,8]
+# The speedup is bounded by the number of cores of the machine, see os.cpu_count().
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_arena
+
+
+def order_flow(arena, orders, symbols, seed):
+    rng = random.Random(seed)
+    names = ['S%04d' % i for i in range(symbols)]
+    requests = []
+    for i in range(orders):
+        trader = rng.randrange(100)
+        side = arena.OrderSide.BUY if rng.random() < 0.5 else arena.OrderSide.SELL
+        order = arena.LimitOrder(trader, rng.choice(names), rng.randint(1, 10), 100 + rng.randint(-5, 5) * 0.01,
+                                 side, float(i))
+        requests.append((arena.OrderType.LIMIT, trader, order))
+    return requests
+
+
+def run(arena, requests, batch, workers):
+    exchange = arena.Exchange(shards=max(workers, 1))
+    if workers:
+        exchange.start_workers()
+    start = time.perf_counter()
+    for i in range(0, len(requests), batch):
+        arena.trader_to_exchange.extend(requests[i:i + batch])
+        exchange.run_infinite_loop()
+    elapsed = time.perf_counter() - start
+    if workers:
+        exchange.stop_workers()
+    for responses in arena.exchange_to_trader:
+        responses.clear()
+    return len(requests) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--symbols', type=int, default=256)
+    parser.add_argument('--batch', type=int, default=20000)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    arena = load_arena()
+    print("cpu count: %d" % os.cpu_count())
+    print("%-12s %14s" % ("workers", "orders/sec"))
+    for workers in [0] + [int(w) for w in args.workers.split(',')]:
+        requests = order_flow(arena, args.orders, args.symbols, args.seed)  # the engines mutate the orders
+        rate = run(arena, requests, args.batch, workers)
+        print("%-12s %14.0f" % (workers if workers else "in-process", rate))
+
+
+if __name__ == "__main__":
+    main()
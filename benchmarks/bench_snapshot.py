@@ -0,0 +1,61 @@
+# Exchange.snapshot() / restore() timings for a deep book
+#
+# Rests `--orders` limit orders of one symbol (500 price levels a side), writes a snapshot, and times
+# restore(), which rebuilds the book before it returns, and the first use of the restored book. With --lazy
+# the book is rebuilt on its first use instead, see Exchange.restore().
+#
+# Usage: python benchmarks/bench_snapshot.py [--orders 2000000] [--path snapshot file] [--lazy]
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+from loaders import load_arena
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=2000000)
+    parser.add_argument('--path', help='snapshot file to write, a temporary file by default')
+    parser.add_argument('--lazy', action='store_true', help='rebuild the book on its first use')
+    args = parser.parse_args()
+
+    arena = load_arena()
+    path = args.path or os.path.join(tempfile.mkdtemp(), 'exchange.snap')
+    exchange = arena.Exchange()
+    engine = exchange.engine_for('AAPL')
+    for i in range(args.orders):
+        if i % 2:
+            order = arena.LimitOrder(i % 100, 'AAPL', 10, 9999 - i % 500, arena.OrderSide.BUY, i)
+            engine.rest_order(engine.bid_book, order)
+        else:
+            order = arena.LimitOrder(i % 100, 'AAPL', 10, 10001 + i % 500, arena.OrderSide.SELL, i)
+            engine.rest_order(engine.ask_book, order)
+
+    start = time.perf_counter()
+    exchange.snapshot(path)
+    written = time.perf_counter() - start
+    del exchange, engine
+    gc.collect()
+
+    restored = arena.Exchange()
+    start = time.perf_counter()
+    restored.restore(path, lazy=args.lazy)
+    mapped = time.perf_counter() - start
+    start = time.perf_counter()
+    restored.engine_for('AAPL')
+    used = time.perf_counter() - start
+
+    print("snapshot: %s, %d bytes" % (path, os.path.getsize(path)))
+    print("%-28s %10.3f s %8.2f us/order" % ("snapshot()", written, written / args.orders * 1e6))
+    print("%-28s %10.3f s %8.2f us/order" % ("restore()", mapped, mapped / args.orders * 1e6))
+    print("%-28s %10.3f s %8.2f us/order" % ("first use", used, used / args.orders * 1e6))
+    print("%-28s %10.3f s" % ("restore() and first use", mapped + used))
+
+
+if __name__ == "__main__":
+    main()
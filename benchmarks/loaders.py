@@ -0,0 +1,21 @@
+# The loaders the benchmarks share: the trading_system package of this checkout, or the MatchingEngine of a
+# matching_machine.py file, so an older copy of it (e.g. from `git show`) can be measured against this one.
+
+import importlib.util
+import os
+import sys
+
+
+def load_arena():
+    # the trading_system package of this checkout
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import trading_system
+    return trading_system
+
+
+def load_engine(path):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))  # matching_machine.py imports trading_system next to it
+    spec = importlib.util.spec_from_file_location("bench_engine", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
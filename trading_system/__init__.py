@@ -0,0 +1,37 @@
+# The simulated trading system as a package. Nothing runs on import: the names below resolve to their
+# submodule on first use, so a shard worker process that only needs the engine does not pay for the
+# exchange, the traders or asyncio. "Trading Arena.py" is the command line entry point.
+# NumPy is imported inside the constructors that need it, never at module level: the Ledger every Exchange
+# keeps, FlowGenerator and OrderStore(use_numpy=True). MatchingEngine and the order classes run without it.
+
+_EXPORTS = {
+    'orders': ('OrderType', 'OrderSide', 'OrderActions', 'Order', 'LimitOrder', 'MarketOrder', 'IOCOrder', 'FOKOrder',
+               'IcebergOrder', 'FilledOrder', 'Fill', 'Reject', 'Ack', 'DEFAULT_SYMBOL', 'NonPositiveQuantity',
+               'NonPositivePrice', 'InvalidSide', 'UndefinedOrderType', 'UndefinedOrderSide', 'NewQuantityNotSmaller',
+               'UndefinedTraderAction', 'UndefinedResponse', 'PriceNotOnTick', 'QuantityNotInLots', 'MissingParams',
+               'RiskLimitExceeded', 'StaleOrderHandle', 'StopOrder', 'StopLimitOrder', 'TimeInForce'),
+    'engine': ('MatchingEngine', 'BookSide', 'PriceLevel', 'StopBook', 'LatencyHistogram', 'OrderStore',
+               'OrderHandle'),
+    'shards': ('ShardPool', 'shard_of'),
+    'journal': ('Journal', 'read_journal'),
+    'ledger': ('Ledger',),
+    'risk': ('RiskLimits', 'RiskEngine'),
+    'exchange': ('Exchange', 'MyThread', 'run_session', 'trader_to_exchange', 'exchange_to_trader'),
+    'trader': ('Trader', 'FlowGenerator'),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    from importlib import import_module
+    value = getattr(import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,922 @@
+# The matching engine: price levels, book sides, latency histograms and the column based OrderStore
+
+import bisect
+import heapq
+import time
+from array import array
+from collections import deque
+from itertools import islice
+
+from .orders import Fill, LimitOrder, MarketOrder, NewQuantityNotSmaller, NonPositiveQuantity, OrderSide, \
+    OrderType, StaleOrderHandle, TimeInForce, UndefinedOrderSide, UndefinedOrderType
+
+
+class OrderStore():
+    # Struct-of-arrays storage for very deep books: every field is a typed column and an order is a
+    # row number, so a resting order costs a few dozen bytes instead of a Python object per order.
+    # Prices are kept in integer ticks, side and type as their enum values. The columns are stdlib
+    # arrays, or NumPy arrays with use_numpy=True. OrderHandle gives an Order-like view of one row.
+    # The store is an opt-in alternative to Order objects for memory bound books, measured against them
+    # by benchmarks/bench_memory.py: MatchingEngine and the exchange keep Order objects and do not use it.
+    # A row's generation counts the orders removed from it, see OrderHandle.
+
+    COLUMNS = (('id', 'q'), ('price', 'q'), ('quantity', 'q'), ('side', 'b'), ('type', 'b'), ('time', 'd'),
+               ('generation', 'q'))
+
+    def __init__(self, symbol, tick_size=0.01, capacity=1024, use_numpy=False):
+        self.symbol = symbol
+        self.tick_size = tick_size
+        self.capacity = capacity
+        self.rows = 0  # rows handed out so far, freed rows are reused first
+        self.free_rows = []
+        if use_numpy:
+            import numpy
+            self.numpy = numpy
+            self.columns = {name: numpy.zeros(capacity, dtype=code) for name, code in OrderStore.COLUMNS}
+        else:
+            self.numpy = None
+            self.columns = {name: array(code, bytes(capacity * array(code).itemsize))
+                            for name, code in OrderStore.COLUMNS}
+        for name, column in self.columns.items():
+            setattr(self, name, column)
+
+    def grow(self):
+        for name, column in self.columns.items():
+            if self.numpy is None:
+                column.frombytes(bytes(self.capacity * column.itemsize))
+            else:
+                column = self.numpy.concatenate((column, self.numpy.zeros_like(column)))
+                self.columns[name] = column
+                setattr(self, name, column)
+        self.capacity *= 2
+
+    def add(self, id, price, quantity, side, type, time):
+        if quantity <= 0:
+            raise NonPositiveQuantity("Quantity Must Be Positive!")
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            if self.rows == self.capacity:
+                self.grow()
+            row = self.rows
+            self.rows += 1
+        self.id[row] = id
+        self.price[row] = round(price / self.tick_size)
+        self.quantity[row] = quantity
+        self.side[row] = side.value
+        self.type[row] = type.value
+        self.time[row] = time
+        return OrderHandle(self, row)
+
+    def remove(self, handle):
+        row = handle.live_row()
+        self.quantity[row] = 0
+        self.generation[row] += 1
+        self.free_rows.append(row)
+
+    def nbytes(self):
+        return sum(column.itemsize * self.capacity for column in self.columns.values())
+
+    def __len__(self):
+        return self.rows - len(self.free_rows)
+
+
+class OrderHandle():
+    # A lightweight Order-like view of one OrderStore row, only the store, the row number and the row's
+    # generation are kept. Removing the order frees the row for the next one added and bumps its generation,
+    # so a handle kept after its order was removed raises StaleOrderHandle instead of reading another order.
+    __slots__ = ('store', 'row', 'generation')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+        self.generation = store.generation[row]
+
+    def live_row(self):
+        if self.store.generation[self.row] != self.generation:
+            raise StaleOrderHandle("The Order Was Removed From The Store!")
+        return self.row
+
+    @property
+    def id(self):
+        return int(self.store.id[self.live_row()])
+
+    @property
+    def symbol(self):
+        return self.store.symbol
+
+    @property
+    def price_ticks(self):
+        return int(self.store.price[self.live_row()])
+
+    @property
+    def price(self):
+        return self.price_ticks * self.store.tick_size
+
+    @property
+    def quantity(self):
+        return int(self.store.quantity[self.live_row()])
+
+    @quantity.setter
+    def quantity(self, quantity):
+        self.store.quantity[self.live_row()] = quantity
+
+    @property
+    def side(self):
+        return OrderSide(int(self.store.side[self.live_row()]))
+
+    @property
+    def type(self):
+        return OrderType(int(self.store.type[self.live_row()]))
+
+    @property
+    def time(self):
+        return float(self.store.time[self.live_row()])
+
+
+class PriceLevel():
+    # A FIFO queue of the resting orders at one price, kept as an intrusive doubly linked list:
+    # each order carries its own prev_order / next_order links and a back reference to its level,
+    # so an order anywhere in the queue can be unlinked in O(1). The level keeps the total quantity and
+    # number of its orders up to date, that is the level's depth.
+
+    def __init__(self, price):
+        self.price = price
+        self.head = None  # the oldest order, traded first
+        self.tail = None
+        self.count = 0
+        self.quantity = 0
+        self.hidden = 0  # the hidden reserves of the iceberg orders at this price, not part of the depth
+
+    def append(self, order):
+        order.level = self
+        order.prev_order = self.tail
+        order.next_order = None
+        if self.tail is None:
+            self.head = order
+        else:
+            self.tail.next_order = order
+        self.tail = order
+        self.count += 1
+        self.quantity += order.quantity
+
+    def unlink(self, order):
+        if order.prev_order is None:
+            self.head = order.next_order
+        else:
+            order.prev_order.next_order = order.next_order
+        if order.next_order is None:
+            self.tail = order.prev_order
+        else:
+            order.next_order.prev_order = order.prev_order
+        order.level = order.prev_order = order.next_order = None
+        self.count -= 1
+        self.quantity -= order.quantity
+
+    def __iter__(self):
+        order = self.head
+        while order is not None:
+            next_order = order.next_order  # read before yielding, the caller may unlink the order
+            yield order
+            order = next_order
+
+
+class BookSide():
+    # One side of the order book: a sorted index of price keys, each mapping to a FIFO PriceLevel
+    # The keys are kept in ascending order with the best price at the end, so the bid side uses the
+    # price itself and the ask side uses the negated price. A resting market order takes any price,
+    # so it sits on a level of its own in front of every limit price.
+    # Every change of a priced level is published to the listeners as (side, price, quantity, count),
+    # quantity 0 once the level is gone. The market order level has no price and is not published.
+
+    MARKET_KEY = float('inf')
+
+    def __init__(self, side, listeners=None):
+        self.side = side
+        self.keys = []
+        self.levels = {}
+        self.size = 0
+        self.listeners = listeners if listeners is not None else []
+
+    def key_of(self, order):
+        if order.type == OrderType.MARKET:
+            return BookSide.MARKET_KEY
+        return order.price if self.side == OrderSide.BUY else -order.price
+
+    def add(self, order):
+        key = self.key_of(order)
+        level = self.levels.get(key)
+        if level is None:
+            level = PriceLevel(key if self.side == OrderSide.BUY else -key)
+            self.levels[key] = level
+            bisect.insort(self.keys, key)  # O(log L) search, only paid when a new price level opens
+        level.append(order)
+        self.size += 1
+        if self.listeners:
+            self.publish(key, level)
+
+    def best_level(self):
+        if self.keys:
+            return self.levels[self.keys[-1]]
+        return None
+
+    def pop_front(self):
+        # remove and return the first order in price-time priority
+        key = self.keys[-1]
+        level = self.levels[key]
+        order = level.head
+        level.unlink(order)
+        self.size -= 1
+        if level.head is None:
+            del self.levels[self.keys.pop()]
+        if self.listeners:
+            self.publish(key, level)
+        return order
+
+    def remove(self, order):
+        level = order.level
+        level.unlink(order)
+        self.size -= 1
+        key = self.key_of(order)
+        if level.head is None:
+            del self.levels[key]
+            if key == self.keys[-1]:
+                self.keys.pop()
+            else:
+                del self.keys[bisect.bisect_left(self.keys, key)]
+        if self.listeners:
+            self.publish(key, level)
+
+    def reduce(self, order, quantity):
+        # take quantity off a resting order that stays on the book (a partial fill or an amend down)
+        order.quantity -= quantity
+        order.level.quantity -= quantity
+        if self.listeners:
+            self.publish(self.key_of(order), order.level)
+
+    def replenish(self, order, quantity):
+        # show `quantity` more of an iceberg order whose displayed slice traded away: it takes its place at the
+        # back of its level's queue, O(1) as the level is a linked list and no key changes
+        level = order.level
+        level.unlink(order)
+        order.quantity = quantity
+        level.append(order)
+        level.hidden -= quantity
+        if self.listeners:
+            self.publish(self.key_of(order), level)
+
+    def publish(self, key, level):
+        if key != BookSide.MARKET_KEY:
+            for listener in self.listeners:
+                listener(self.side, level.price, level.quantity, level.count)
+
+    def best_price(self):
+        # the best limit price, or None. At most the market order level is skipped.
+        for key in reversed(self.keys):
+            if key != BookSide.MARKET_KEY:
+                return self.levels[key].price
+        return None
+
+    def depth(self, levels):
+        # (price, quantity, count) of the best `levels` priced levels, O(levels)
+        result = []
+        for key in reversed(self.keys):
+            if len(result) == levels:
+                break
+            if key != BookSide.MARKET_KEY:
+                level = self.levels[key]
+                result.append((level.price, level.quantity, level.count))
+        return result
+
+    # The sequence interface below lets callers keep iterating bid_book / ask_book in price-time
+    # priority and indexing them as if they were the sorted lists. It only reads the book, but the
+    # BookSide itself stays mutable, see MatchingEngine.bid_book.
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for key in reversed(self.keys):
+            yield from self.levels[key]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index == 0 and self.keys:
+            return self.levels[self.keys[-1]].head
+        if index < 0:
+            index += self.size
+        if 0 <= index < self.size:
+            return next(islice(self, index, None))
+        raise IndexError("Order Book Index Out Of Range!")
+
+
+class StopBook():
+    # The pending stop orders of one side, held off the order book until a trade crosses their stop price:
+    # a buy stop triggers on a trade at or above its stop, a sell stop at or below. As in BookSide the keys
+    # are kept sorted with the next stop to trigger at the end (the negated stop price for buys), each key
+    # holding its stops in arrival order, so a trade pops just the crossed stops in O(log n + triggered).
+
+    def __init__(self, side):
+        self.side = side
+        self.keys = []
+        self.levels = {}  # key -> {stop order: None}, an insertion ordered set
+        self.size = 0
+
+    def key_of(self, stop_price):
+        return -stop_price if self.side == OrderSide.BUY else stop_price
+
+    def crossed(self, order, price):
+        # True if a trade at `price` triggers the stop order
+        return self.key_of(order.stop_price) >= self.key_of(price)
+
+    def add(self, order):
+        key = self.key_of(order.stop_price)
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = {}
+            bisect.insort(self.keys, key)
+        level[order] = None
+        self.size += 1
+
+    def remove(self, order):
+        key = self.key_of(order.stop_price)
+        level = self.levels[key]
+        del level[order]
+        self.size -= 1
+        if not level:
+            del self.levels[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def pop_triggered(self, price):
+        # remove and return the stops a trade at `price` triggers, the nearest stop price first and the stops
+        # of one price in arrival order
+        keys = self.keys
+        limit = self.key_of(price)
+        triggered = []
+        while keys and keys[-1] >= limit:
+            triggered.extend(self.levels.pop(keys.pop()))
+        self.size -= len(triggered)
+        return triggered
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        # the stops in trigger order
+        for key in reversed(self.keys):
+            yield from self.levels[key]
+
+
+class LatencyHistogram():
+    # A log-bucketed (HDR style) histogram of integer latencies: values below 32 have a bucket each, above
+    # that every power of two is split into 16 buckets, so a recorded value is known to within 1/16 while
+    # the whole 64 bit range takes 1024 counters
+
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.counts = [0] * 1024
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        if value < 32:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - 5
+            index = (shift << 4) + (value >> shift)  # 32 + (shift - 1) * 16 + (top 5 bits - 16)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @staticmethod
+    def highest_value(index):
+        # the largest value that lands in bucket `index`
+        if index < 32:
+            return index
+        shift = (index >> 4) - 1
+        return ((index - (shift << 4) + 1) << shift) - 1
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * fraction // 1))  # ceil, the 1-based rank of the value
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(LatencyHistogram.highest_value(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        return {'count': self.count, 'min': self.min, 'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9), 'p99': self.percentile(0.99),
+                'p99.9': self.percentile(0.999), 'max': self.max}
+
+
+class MatchingEngine():
+
+    def __init__(self):
+        self.depth_listeners = []  # callables taking (side, price, quantity, count), see subscribe()
+        self._bids = BookSide(OrderSide.BUY, self.depth_listeners)  # price from high to low / buy, then sorted by the time
+        self._asks = BookSide(OrderSide.SELL, self.depth_listeners)  # price from low to high / sell, then sorted by the time
+        # These are the order books you are given and expected to use for matching the orders below
+        self.order_index = {}  # order id -> resting order, the order links to its side, price level and queue neighbours
+        # trader id (Order.id) -> {order id: resting order}, its orders without a book scan, in the order they came
+        # in (a triggered stop from when it went in), so the last is the trader's newest
+        self.open_orders = {}
+        # Stop orders wait in their own books, pending stops are open orders in both indexes above as well
+        self._buy_stops = StopBook(OrderSide.BUY)
+        self._sell_stops = StopBook(OrderSide.SELL)
+        self.last_price = None  # the price of the last trade, what a new stop order is checked against
+        self.triggering = False  # set while trigger_stops() runs the triggered stops
+        self.activated = []  # the orders the stops triggered by the last trigger_stops() went in as
+        # Resting good-till-time orders in a min-heap of (expire time, order time, sequence, order), resting day
+        # orders in a list, see track_expiry()
+        self.expiries = []
+        self.expiry_sequence = 0  # breaks the remaining ties, orders do not compare
+        self.day_orders = []
+        self.histograms = None  # operation or order type name -> LatencyHistogram, while instrumented
+        self.counters = None
+
+    # bid_book / ask_book / buy_stops / sell_stops are the engine's own live books, not copies or read-only
+    # views: changing one directly (add, remove, pop_front, reduce) skips order_index, open_orders and the
+    # expiry tracking, so orders go through handle_order / cancel_order / amend_quantity or rest_order.
+
+    @property
+    def bid_book(self):
+        return self._bids
+
+    @property
+    def ask_book(self):
+        return self._asks
+
+    @property
+    def buy_stops(self):
+        return self._buy_stops
+
+    @property
+    def sell_stops(self):
+        return self._sell_stops
+
+    # Market data, kept up to date by the books on every insert, fill, cancel and amend
+
+    def best_bid(self):
+        return self._bids.best_price()
+
+    def best_ask(self):
+        return self._asks.best_price()
+
+    def spread(self):
+        bid, ask = self._bids.best_price(), self._asks.best_price()
+        if bid is None or ask is None:
+            return None
+        return ask - bid
+
+    def depth(self, levels=5):
+        # the top `levels` price levels of each side as (bids, asks), lists of (price, quantity, count)
+        return self._bids.depth(levels), self._asks.depth(levels)
+
+    def subscribe(self, listener):
+        # listener(side, price, quantity, count) is called for every change of a price level
+        self.depth_listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.depth_listeners.remove(listener)
+
+    # Instrumentation. instrument() shadows handle_order, cancel_order and amend_quantity with timed
+    # wrappers set on the instance, so an engine that is not instrumented runs the plain methods and pays
+    # nothing. The matching work is counted from the returned fills, which come in (resting, incoming)
+    # pairs: every pair touched one resting order and every distinct resting price is a level crossed.
+
+    def instrument(self, clock=time.perf_counter_ns):
+        if self.histograms is not None:
+            return
+        histograms = self.histograms = {name: LatencyHistogram() for name in
+                                        ('LIMIT', 'MARKET', 'IOC', 'FOK', 'STOP', 'STOP_LIMIT', 'cancel_order',
+                                         'amend_quantity')}
+        counters = self.counters = {'orders': 0, 'fills': 0, 'levels_crossed': 0, 'resting_orders_touched': 0,
+                                    'cancels': 0, 'amends': 0}
+        handle_order = self.handle_order
+        cancel_order = self.cancel_order
+        amend_quantity = self.amend_quantity
+        cancel_histogram = histograms['cancel_order']
+        amend_histogram = histograms['amend_quantity']
+
+        def timed_handle_order(order):
+            start = clock()
+            filled = handle_order(order)
+            histograms[order.type.name].record(clock() - start)
+            counters['orders'] += 1
+            if filled:
+                resting = filled[0::2]
+                counters['fills'] += len(filled)
+                counters['resting_orders_touched'] += len(resting)
+                counters['levels_crossed'] += len({filled_order.price for filled_order in resting})
+            return filled
+
+        def timed_cancel_order(id):
+            start = clock()
+            result = cancel_order(id)
+            cancel_histogram.record(clock() - start)
+            counters['cancels'] += 1
+            return result
+
+        def timed_amend_quantity(id, quantity):
+            start = clock()
+            try:
+                return amend_quantity(id, quantity)
+            finally:
+                amend_histogram.record(clock() - start)
+                counters['amends'] += 1
+
+        self.handle_order = timed_handle_order
+        self.cancel_order = timed_cancel_order
+        self.amend_quantity = timed_amend_quantity
+
+    def uninstrument(self):
+        if self.histograms is None:
+            return
+        del self.handle_order, self.cancel_order, self.amend_quantity
+        self.histograms = self.counters = None
+
+    def stats(self):
+        # A snapshot of the book sizes, plus the counters and latency summaries (ns) while instrumented
+        snapshot = {'bids': len(self._bids), 'asks': len(self._asks), 'bid_levels': len(self._bids.keys),
+                    'ask_levels': len(self._asks.keys), 'stops': len(self._buy_stops) + len(self._sell_stops)}
+        if self.counters is not None:
+            snapshot.update(self.counters)
+            snapshot['latency_ns'] = {name: histogram.summary() for name, histogram in self.histograms.items()
+                                      if histogram.count}
+        return snapshot
+
+    def rest_order(self, book, order):
+        book.add(order)
+        self.order_index[order.order_id] = order  # index_order() inlined, this runs for every resting order
+        orders = self.open_orders.get(order.id)
+        if orders is None:
+            orders = self.open_orders[order.id] = {}
+        orders[order.order_id] = order
+
+    def index_order(self, order):
+        # order ids are expected to be unique among the resting orders, a reused one points at the newest
+        self.order_index[order.order_id] = order
+        orders = self.open_orders.get(order.id)
+        if orders is None:
+            orders = self.open_orders[order.id] = {}
+        orders[order.order_id] = order
+
+    def unindex_order(self, order):
+        if self.order_index.get(order.order_id) is order:
+            del self.order_index[order.order_id]
+        orders = self.open_orders.get(order.id)
+        if orders is not None and orders.get(order.order_id) is order:
+            del orders[order.order_id]
+            if not orders:
+                del self.open_orders[order.id]
+
+    def remove_front(self, book):
+        # drop the fully traded order at the front of the book
+        self.unindex_order(book.pop_front())
+
+    # Note: As you implement the following functions keep in mind that these enums are available:
+    #     class OrderType(Enum):
+    #         LIMIT = 1
+    #         MARKET = 2
+    #         IOC = 3
+    #     class OrderSide(Enum):
+    #         BUY = 1
+    #         SELL = 2
+
+    def handle_order(self, order):
+        # Implement this function
+        # In this function you need to call different functions from the matching engine
+        # depending on the type of order you are given
+        if order.type == OrderType.LIMIT:
+            filled_orders = self.handle_limit_order(order)
+        elif order.type == OrderType.MARKET:
+            filled_orders = self.handle_market_order(order)
+        elif order.type == OrderType.IOC:
+            filled_orders = self.handle_ioc_order(order)
+        elif order.type == OrderType.FOK:
+            filled_orders = self.handle_fok_order(order)
+        elif order.type == OrderType.STOP or order.type == OrderType.STOP_LIMIT:
+            return self.handle_stop_order(order)
+        else:
+            raise UndefinedOrderType("Undefined Order Type!")
+        if filled_orders:
+            for filled_order in reversed(filled_orders):
+                if filled_order.price:  # a market order trading with a resting market order has no price
+                    self.last_price = filled_order.price
+                    break
+            if (self._buy_stops.size or self._sell_stops.size) and not self.triggering:
+                self.trigger_stops(filled_orders)
+        return filled_orders
+
+    def handle_stop_order(self, order):
+        # a stop order waits in its stop book, or goes in at once if the last trade already crossed its stop
+        if order.side == OrderSide.BUY:
+            book = self._buy_stops
+        elif order.side == OrderSide.SELL:
+            book = self._sell_stops
+        else:
+            raise UndefinedOrderSide("Undefined Order Side!")
+        if self.last_price is not None and book.crossed(order, self.last_price):
+            activated = self.activate(order)
+            self.activated = []
+            # the class's handle_order, an instrumented engine times and counts the stop once, as a STOP
+            filled_orders = MatchingEngine.handle_order(self, activated)
+            self.activated.insert(0, activated)  # in front of the stops its own trades triggered
+            return filled_orders
+        book.add(order)
+        self.index_order(order)
+        return []
+
+    def activate(self, stop):
+        # the order a triggered stop goes in as, with the stop's ids and time priority
+        if stop.type == OrderType.STOP_LIMIT:
+            order = LimitOrder(stop.id, stop.symbol, stop.quantity, stop.price, stop.side, stop.time)
+        else:
+            order = MarketOrder(stop.id, stop.symbol, stop.quantity, stop.side, stop.time)
+        order.order_id = stop.order_id
+        order.wall = stop.wall
+        return order
+
+    def trigger_stops(self, filled_orders):
+        # Run the stops the trades in filled_orders triggered, appending their fills. A cascade, where the
+        # fills of a triggered stop trigger further stops, is a loop over a FIFO of triggered stops instead
+        # of a recursion, however long it gets. The buy stops a trade price triggers go in before the sell
+        # stops, each side nearest stop price first, and the stops crossed by a triggered order's trades
+        # queue behind the ones already triggered. The orders they went in as are kept in self.activated.
+        pending = deque()
+        activated = self.activated = []
+        self.triggering = True
+        try:
+            self.pop_triggered(filled_orders, pending)
+            while pending:
+                order = self.activate(pending.popleft())
+                activated.append(order)
+                filled = MatchingEngine.handle_order(self, order)  # counted with the order that triggered it
+                if filled:
+                    filled_orders.extend(filled)
+                    self.pop_triggered(filled, pending)
+        finally:
+            self.triggering = False
+
+    def pop_triggered(self, filled, pending):
+        # Queue the stops any trade in `filled` crossed. An order sweeping several levels prints several prices:
+        # the buy stops are checked against the highest, the sell stops against the lowest. Trades between two
+        # market orders have no price (0) and trigger nothing.
+        prices = [filled_order.price for filled_order in filled[0::2] if filled_order.price]
+        if not prices:
+            return
+        for book, price in ((self._buy_stops, max(prices)), (self._sell_stops, min(prices))):
+            for stop in book.pop_triggered(price):
+                self.unindex_order(stop)
+                pending.append(stop)
+
+    def handle_limit_order(self, order):
+        # The orders that are filled from the limit order are returned in the list below
+        if order.side == OrderSide.BUY:
+            filled_orders = self.match_order(order, self._asks, -order.price)
+        elif order.side == OrderSide.SELL:
+            filled_orders = self.match_order(order, self._bids, order.price)
+        else:
+            # You need to raise the following error if the side the order is for is ambiguous
+            raise UndefinedOrderSide("Undefined Order Side!")
+        # if the order still is not fully traded, then insert the remaining
+        if order.quantity > 0:
+            if order.peak and order.quantity > order.peak:  # an iceberg rests showing its peak only
+                order.reserve = order.quantity - order.peak
+                order.quantity = order.peak
+                self.insert_limit_order(order)
+                order.level.hidden += order.reserve
+            else:
+                self.insert_limit_order(order)
+            if order.time_in_force is not TimeInForce.GTC:
+                self.track_expiry(order)
+        return filled_orders
+
+    def handle_market_order(self, order):
+        # a market order takes whatever the price is, every level of the opposite book crosses
+        if order.side == OrderSide.BUY:
+            book, own_book = self._asks, self._bids
+        elif order.side == OrderSide.SELL:
+            book, own_book = self._bids, self._asks
+        else:
+            raise UndefinedOrderSide("Undefined Order Side!")
+        if not book:  # the opposite book is empty, the market order waits on its own side
+            self.rest_order(own_book, order)
+            return []
+        return self.match_order(order, book, -BookSide.MARKET_KEY)
+
+    def match_order(self, order, book, limit_key):
+        # Trade the incoming order against the front of the opposite book, in place: resting orders
+        # that are fully traded are popped from the best level, a partially traded one is decremented.
+        # limit_key is the incoming price in the opposite book's key space, a level crosses while its
+        # key is not below it. Each trade emits the resting order's fill followed by the incoming one's, as
+        # Fill tuples priced like the orders are (in ticks on an exchange) that callers pass on as they are.
+        filled_orders = []
+        append = filled_orders.append
+        limit, market = OrderType.LIMIT, OrderType.MARKET
+        incoming_price = 0 if order.type == market else order.price
+        incoming_limit = order.type == limit
+        keys = book.keys
+        while order.quantity > 0 and keys and keys[-1] >= limit_key:
+            level = book.levels[keys[-1]]
+            resting_order = level.head
+            # trade at the resting price, a resting market order trades at the incoming price
+            price = incoming_price if resting_order.type == market else level.price
+            if resting_order.quantity <= order.quantity:
+                quantity = resting_order.quantity
+                if resting_order.reserve:
+                    self.replenish(book, resting_order)
+                else:
+                    self.remove_front(book)
+            else:
+                quantity = order.quantity
+                book.reduce(resting_order, quantity)
+            order.quantity -= quantity
+            append(Fill(resting_order.id, resting_order.symbol, quantity, price, resting_order.side,
+                        resting_order.time, resting_order.type == limit, resting_order.order_id))
+            append(Fill(order.id, order.symbol, quantity, price, order.side, order.time, incoming_limit,
+                        order.order_id))
+        return filled_orders
+
+    def replenish(self, book, order):
+        # the displayed slice of a resting iceberg order traded away, the next one comes out of its reserve
+        quantity = min(order.peak, order.reserve)
+        order.reserve -= quantity
+        book.replenish(order, quantity)
+
+    def handle_ioc_order(self, order):
+        # An IOC sweeps every level crossing its price like a limit order, trading at the resting prices.
+        # Whatever is left of it is cancelled instead of resting.
+        if order.side == OrderSide.BUY:
+            return self.match_order(order, self._asks, -order.price)
+        elif order.side == OrderSide.SELL:
+            return self.match_order(order, self._bids, order.price)
+        else:
+            raise UndefinedOrderSide("Undefined Order Side!")
+
+    def handle_fok_order(self, order):
+        # A fill or kill order trades all of its quantity or nothing. Whether it can is read off the levels'
+        # cached quantities before the book is touched, so a killed order changes nothing and needs no rollback.
+        if order.side == OrderSide.BUY:
+            book, limit_key = self._asks, -order.price
+        elif order.side == OrderSide.SELL:
+            book, limit_key = self._bids, order.price
+        else:
+            raise UndefinedOrderSide("Undefined Order Side!")
+        if not self.fillable(book, limit_key, order.quantity):
+            return []
+        return self.match_order(order, book, limit_key)
+
+    @staticmethod
+    def fillable(book, limit_key, quantity):
+        # True if the levels of `book` crossing limit_key (see match_order) hold `quantity` shares, summing the
+        # level quantities, hidden iceberg reserves included, from the best level on until there are enough or a
+        # level no longer crosses: O(levels checked), the orders themselves are not visited
+        levels = book.levels
+        for key in reversed(book.keys):
+            if key < limit_key:
+                return False
+            level = levels[key]
+            quantity -= level.quantity + level.hidden
+            if quantity <= 0:
+                return True
+        return False
+
+    def insert_limit_order(self, order):
+        assert order.type == OrderType.LIMIT
+
+        if order.side == OrderSide.BUY:  # BUY Order
+            self.rest_order(self._bids, order)
+        elif order.side == OrderSide.SELL:
+            self.rest_order(self._asks, order)
+        else:
+            raise UndefinedOrderSide("Undefined Order Side!")
+
+    # amend_quantity and cancel_order take the order id. The quantity of an amend is the order's new total,
+    # an iceberg's hidden reserve included, and is taken off the reserve first.
+
+    def amend_quantity(self, id, quantity):
+        order = self.order_index.get(id)
+        if order is None:
+            return False
+        if quantity <= 0:
+            raise NonPositiveQuantity("Amendment Must Leave A Positive Quantity!")
+        if order.quantity + order.reserve > quantity:
+            # amend down keeps the queue position, no other order is touched
+            if order.type == OrderType.STOP or order.type == OrderType.STOP_LIMIT:
+                order.quantity = quantity  # a pending stop is not on the book yet
+                return True
+            if order.reserve:
+                reserve = max(quantity - order.quantity, 0)
+                order.level.hidden -= order.reserve - reserve
+                order.reserve = reserve
+                if reserve:
+                    return True
+            book = self._bids if order.side == OrderSide.BUY else self._asks
+            book.reduce(order, order.quantity - quantity)
+            return True
+        else:
+            raise NewQuantityNotSmaller("Amendment Must Reduce Quantity!")
+
+    def cancel_order(self, id):
+        order = self.order_index.get(id)
+        if order is None:
+            return False
+        self.remove_order(order)
+        return True
+
+    def remove_order(self, order):
+        # take a resting order off its book, or a pending stop off its stop book
+        if order.type == OrderType.STOP or order.type == OrderType.STOP_LIMIT:
+            (self._buy_stops if order.side == OrderSide.BUY else self._sell_stops).remove(order)
+        else:
+            if order.reserve:
+                order.level.hidden -= order.reserve
+            if order.side == OrderSide.BUY:
+                self._bids.remove(order)
+            else:
+                self._asks.remove(order)
+        self.unindex_order(order)
+
+    # Expiry. A good-till-time order is pushed on the expiry heap when it rests and a day order appended to the
+    # day order list. Neither is touched when the order fills, is cancelled or amended: an entry whose order left
+    # the book is dropped when it comes up (lazy deletion), and both are compacted once they hold more entries
+    # than twice the resting orders. Expiring the orders due at a clock value then costs O(log n) per expired
+    # or stale entry, nothing for the orders that are not due.
+
+    def track_expiry(self, order):
+        if order.time_in_force is TimeInForce.GTT:
+            self.expiry_sequence += 1
+            heapq.heappush(self.expiries, (order.expire_time, order.time, self.expiry_sequence, order))
+            if len(self.expiries) > 2 * (self._bids.size + self._asks.size) + 64:
+                self.expiries = [entry for entry in self.expiries if entry[3].level is not None]
+                heapq.heapify(self.expiries)
+        else:
+            self.day_orders.append(order)
+            if len(self.day_orders) > 2 * (self._bids.size + self._asks.size) + 64:
+                self.day_orders = [day_order for day_order in self.day_orders if day_order.level is not None]
+
+    def next_expiry(self):
+        # the earliest expire time on the heap, or None. It may belong to an order that already left the book.
+        return self.expiries[0][0] if self.expiries else None
+
+    def expire_orders(self, now):
+        # cancel the good-till-time orders whose expire time is at or before clock value `now` and return them,
+        # earliest expire time first
+        expired = []
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= now:
+            order = heapq.heappop(expiries)[3]
+            if order.level is not None:  # still resting, a PriceLevel unlinks the orders that leave it
+                self.remove_order(order)
+                expired.append(order)
+        return expired
+
+    def end_day(self):
+        # cancel every resting day order and return them, in the order they rested
+        day_orders, self.day_orders = self.day_orders, []
+        expired = [order for order in day_orders if order.level is not None]
+        for order in expired:
+            self.remove_order(order)
+        return expired
+
+    def trader_order(self, id, order_id=None):
+        # the resting order `order_id` if trader `id` owns it, without an order id the trader's newest one, O(1)
+        if order_id is None:
+            orders = self.open_orders.get(id)
+            return next(reversed(orders.values())) if orders else None
+        order = self.order_index.get(order_id)
+        return order if order is not None and order.id == id else None
+
+    def cancel_all(self, id, side=None):
+        # Cancel every resting order of trader `id`, or those on one side, and return them. Only the trader's
+        # k orders are visited, each unlinked from its level in O(1).
+        orders = self.open_orders.get(id)
+        if not orders:
+            return []
+        cancelled = [order for order in orders.values() if side is None or order.side == side]
+        for order in cancelled:
+            self.remove_order(order)
+        return cancelled
@@ -0,0 +1,1128 @@
+# The exchange: request handling, the trader ledger, the journal and snapshots
+
+import gc
+import heapq
+import mmap
+import struct
+import time
+from array import array
+from collections import defaultdict, deque
+from decimal import Decimal
+from itertools import count
+
+from .engine import BookSide, LatencyHistogram, MatchingEngine, PriceLevel
+from .journal import JOURNAL_FILL, JOURNAL_REQUEST, read_journal
+from .ledger import LEDGER_SETTLE_EVERY, Ledger
+from .risk import RiskEngine
+from .orders import DEFAULT_SYMBOL, Ack, Fill, FOKOrder, IcebergOrder, IOCOrder, LimitOrder, MarketOrder, \
+    NewQuantityNotSmaller, NonPositiveQuantity, OrderActions, OrderSide, OrderType, PriceNotOnTick, QuantityNotInLots, \
+    Reject, RiskLimitExceeded, StopLimitOrder, StopOrder, TimeInForce, UndefinedTraderAction
+from .shards import RECORD, ShardPool, shard_of
+
+
+trader_to_exchange = deque()
+exchange_to_trader = [deque() for _ in range(100)]
+
+
+# Above you are given two deques where the orders submitted to the exchange and back to the trader
+# are expected to be populated by the trading exchange simulator
+# The first is trader_to_exchange, a deque of orders to be populated for the exchange to execute
+# The second is a list of 100 deques exchange_to_trader, which are acknowledgements from the exchange
+# to each of the 100 traders for trades executed on their behalf
+
+# Below you have an implementation of a simulated thread to be used where each trader is a separate thread
+
+class MyThread:
+    list_of_threads = []
+
+    def __init__(self, id='NoID'):
+        MyThread.list_of_threads.append(self)
+        self.is_started = False
+        self.id = id
+
+    def start(self):
+        self.is_started = True
+
+    def join(self):
+        print('Trader ' + str(self.id) + ' will be waited')
+
+
+
+# Snapshots: Exchange.snapshot() writes the resting orders of every book and the ledger as packed columns
+# to one file, Exchange.restore() maps it back in. Layout, every part padded to 8 bytes:
+#   header, symbol table (name, resting orders) per symbol, order columns, balances, position columns
+# The orders of a symbol are contiguous, bids then asks, each side in price-time priority, then its pending
+# buy and sell stops in trigger order. A symbol's last trade price (0 for none) is what new stops are checked against,
+# its ledger mark (the price of its last settled fill, 0 for none) what mark-to-market values its positions at.
+# Limit orders keep their time in force, and good-till-time orders their expire time (0 for none). An iceberg
+# order's quantity is the displayed one, its hidden reserve and peak have columns of their own (0 for others).
+
+# magic, traders, symbols, orders, positions, tick size, lot size, cash scale, next clock value,
+# next order id, journal sequence
+SNAPSHOT_HEADER = struct.Struct('<8sqqqqdqqqqq')
+SNAPSHOT_MAGIC = b'EXSNAP06'
+SNAPSHOT_SYMBOL = struct.Struct('<16sqqq')  # name, orders, last trade price, ledger mark
+SNAPSHOT_ORDER_COLUMNS = (('id', 'q'), ('order_id', 'q'), ('price', 'q'), ('stop_price', 'q'), ('quantity', 'q'),
+                          ('priority', 'd'), ('expire_time', 'd'), ('reserve', 'q'), ('peak', 'q'), ('side', 'b'),
+                          ('type', 'b'), ('time_in_force', 'b'))
+SNAPSHOT_POSITION_COLUMNS = (('trader', 'q'), ('symbol', 'q'), ('shares', 'q'))
+
+
+class Exchange(MyThread):
+    def __init__(self, tick_size=0.01, lot_size=1, cash_scale=100, shards=1, traders=100, batch_size=None,
+                 flush_interval=0.0, journal=None, clock=None, wall_clock=None, instrument=False, risk=None,
+                 cancel_on_disconnect=True):
+        super().__init__()
+        # Inside the exchange prices are integer ticks of tick_size and cash is integer minor units
+        # (1 / cash_scale of a currency unit), so the ledger is exact however long the session runs.
+        # Prices and cash are converted back to floats only when they are reported to the traders.
+        self.tick_size = tick_size
+        self.lot_size = lot_size
+        self.cash_scale = cash_scale
+        self.tick_value = round(tick_size * cash_scale)  # minor units paid per share per tick
+        if self.tick_value <= 0 or abs(self.tick_value - tick_size * cash_scale) > 1e-9:
+            raise ValueError("A Tick Must Be A Whole Number Of Cash Minor Units!")
+        self.price_decimals = max(0, -Decimal(str(tick_size)).normalize().as_tuple().exponent)
+        # trader id -> callable delivering a response, the exchange_to_trader deques unless run_session() swaps in
+        # queues. The tables are sized from `traders`, the global list gets a deque for every trader it is missing.
+        # A request from a trader id past them grows them, as the ledger grows its rows, see add_traders().
+        self.traders = traders
+        exchange_to_trader.extend(deque() for _ in range(traders - len(exchange_to_trader)))
+        self.reply = [responses.append for responses in exchange_to_trader[:traders]]
+        # Batch mode (batch_size set): run_infinite_loop takes up to batch_size requests per cycle and
+        # collects the responses per trader; they are published at most every flush_interval seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.reply_batch = [responses.extend for responses in exchange_to_trader[:traders]]
+        self.outbox = [[] for _ in range(traders)]  # trader id -> responses waiting for the next flush
+        self.reply_outbox = [responses.append for responses in self.outbox]
+        self.last_flush = time.perf_counter()
+        # One matching engine per symbol, created on the symbol's first order. The symbol -> engine map
+        # is split into shards by shard_of(), so independent shards can be handed to separate processes.
+        self.shards = shards
+        self.engines = [{} for _ in range(shards)]
+        self.pool = None  # a ShardPool once start_workers() moves the shards to worker processes
+        self.symbols = []  # symbol index -> symbol, the index is what crosses the process boundary
+        self.symbol_ids = {}
+        # cash and positions of every trader, its position columns are the symbol indices
+        self.ledger = Ledger(traders, 1000000 * cash_scale, self.tick_value, self.symbols)
+        self.journal = journal  # a Journal recording the requests and fills, or None
+        # Time priority comes from the exchange: clock() numbers the orders in arrival order (a monotonic
+        # integer sequence unless another callable is given). wall_clock, an integer nanosecond clock such as
+        # time.perf_counter_ns, optionally stamps their arrival too; the time from that stamp until the order's
+        # fills are sent goes into order_latency, which stats() reports as the 'order' latency. It never
+        # decides priority.
+        self.sequence = count(1) if clock is None else None  # the default clock's counter
+        self.clock = clock if clock is not None else self.sequence.__next__
+        self.wall_clock = wall_clock
+        self.order_latency = LatencyHistogram() if wall_clock is not None else None
+        # Every new order gets the next order id, acknowledged to its trader, unique however many orders the
+        # trader has open. Amend and cancel requests name it; each engine indexes the open orders per trader.
+        self.order_ids = count(1)
+        # trader id -> the symbols it may have open orders in. Every new order adds its symbol and a mass cancel
+        # drops those the trader has no orders left in, so each entry costs one mass cancel at most.
+        self.trader_symbols = defaultdict(set)
+        self.cancel_on_disconnect = cancel_on_disconnect
+        # The earliest expire time of the good-till-time orders on the books (it may be one that already left
+        # them), an order stamped at or after it makes the exchange expire the due orders first. The books with
+        # good-till-time orders are kept on a heap of (earliest expire time, symbol), so only the due books are
+        # visited; book_expiry holds each book's live entry, the other entries of a book are skipped.
+        self.next_expiry = float('inf')
+        self.expiry_heap = []
+        self.book_expiry = {}  # symbol -> expire time of its entry on expiry_heap
+        self.instrumented = instrument  # every engine is instrumented, see MatchingEngine.instrument()
+        self.pending_books = {}  # symbol -> (first row, rows, last trade price) of a restored book not rebuilt yet, see restore()
+        self.snapshot_columns = None
+        # Pre-trade risk checks of the RiskLimits given as `risk`, None sends every order straight to the engine
+        self.risk = RiskEngine(risk, self.tick_value, cash_scale) if risk is not None else None
+        # The exchange keeps track of the traders' balances
+
+    def add_traders(self, traders):
+        # grow the reply tables to `traders` rows, the new traders answered through exchange_to_trader deques
+        exchange_to_trader.extend(deque() for _ in range(traders - len(exchange_to_trader)))
+        self.reply.extend(responses.append for responses in exchange_to_trader[len(self.reply):traders])
+        self.reply_batch.extend(responses.extend for responses in exchange_to_trader[len(self.reply_batch):traders])
+        self.outbox.extend([] for _ in range(traders - len(self.outbox)))
+        self.reply_outbox.extend(responses.append for responses in self.outbox[len(self.reply_outbox):])
+        self.traders = max(self.traders, traders)
+
+    def engine_for(self, symbol, create=True):
+        engines = self.engines[shard_of(symbol, self.shards)]
+        engine = engines.get(symbol)
+        if engine is None:
+            if self.pending_books and symbol in self.pending_books:
+                engine = engines[symbol] = self.restore_book(symbol)
+            elif create:
+                engine = engines[symbol] = MatchingEngine()
+                if self.instrumented:
+                    engine.instrument()
+        return engine
+
+    def instrument(self):
+        self.instrumented = True
+        for engines in self.engines:
+            for engine in engines.values():
+                engine.instrument()
+
+    def stats(self):
+        # Per symbol engine stats and their total, the latency histograms of all symbols merged with the
+        # exchange's own order latency (with a wall_clock).
+        # The engines of shard worker processes are not seen.
+        self.restore_books()
+        symbols = {}
+        total = {}
+        histograms = {}
+        for engines in self.engines:
+            for symbol, engine in engines.items():
+                symbols[symbol] = engine.stats()
+                for name, value in symbols[symbol].items():
+                    if name != 'latency_ns':
+                        total[name] = total.get(name, 0) + value
+                for name, histogram in (engine.histograms or {}).items():
+                    histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+        if self.order_latency is not None:
+            histograms['order'] = self.order_latency
+        if histograms:
+            total['latency_ns'] = {name: histogram.summary() for name, histogram in histograms.items()
+                                   if histogram.count}
+        return {'total': total, 'symbols': symbols}
+
+    def depth(self, symbol, levels=5):
+        # Top of the symbol's book as (bids, asks), lists of (price, quantity, order count) with prices in
+        # currency units. Only the in-process engines are seen, not the ones in shard worker processes.
+        engine = self.engine_for(symbol, create=False)
+        if engine is None:
+            return [], []
+        bids, asks = engine.depth(levels)
+        return ([(self.to_price(price), quantity, count) for price, quantity, count in bids],
+                [(self.to_price(price), quantity, count) for price, quantity, count in asks])
+
+    def subscribe(self, symbol, listener):
+        # listener(side, price ticks, quantity, order count) is called for every change of a price level of the symbol
+        self.engine_for(symbol).subscribe(listener)
+
+    def stamp(self, order):
+        order.time = self.clock()
+        order.order_id = next(self.order_ids)
+        if self.wall_clock is not None:
+            order.wall = self.wall_clock()
+
+    def to_ticks(self, price):
+        ticks = round(price / self.tick_size)
+        if abs(ticks * self.tick_size - price) > 1e-9 * max(1, abs(price)):
+            raise PriceNotOnTick("Price Must Be A Multiple Of The Tick Size!")
+        return ticks
+
+    def order_ticks(self, order):
+        # (price, stop price) of an order in ticks without touching it, 0 where the order type has none
+        price = 0 if order.type == OrderType.MARKET or order.type == OrderType.STOP else self.to_ticks(order.price)
+        if order.type == OrderType.STOP or order.type == OrderType.STOP_LIMIT:
+            return price, self.to_ticks(order.stop_price)
+        return price, 0
+
+    def to_price(self, ticks):
+        return round(ticks * self.tick_size, self.price_decimals)
+
+    def to_cash(self, minor_units):
+        return minor_units / self.cash_scale
+
+    def check_lots(self, quantity):
+        if quantity % self.lot_size != 0:
+            raise QuantityNotInLots("Quantity Must Be A Multiple Of The Lot Size!")
+
+    def refuse(self, request):
+        # (OrderActions.Reject, Reject) for a new order with a price off the tick or a quantity (or peak) not in
+        # lots, or an amendment to a quantity not in lots, None for a request the exchange can take. A refused
+        # request is neither stamped nor journaled, a refused order gets order id 0.
+        try:
+            if request[0] is OrderActions.Amend:
+                self.check_lots(request[2])
+            else:
+                order = request[2]
+                self.check_lots(order.quantity)
+                if order.peak:
+                    self.check_lots(order.peak)
+                self.order_ticks(order)
+        except (PriceNotOnTick, QuantityNotInLots) as error:
+            if request[0] is OrderActions.Amend:
+                return (OrderActions.Reject, Reject(request[1], (request[4] if len(request) > 4 else None) or 0,
+                                                    request[3], str(error)))
+            return (OrderActions.Reject, Reject(order.id, 0, order.symbol, str(error)))
+        return None
+
+    def place_new_order(self, order, engine=None, reply=None):
+        # The exchange must use the matching engine to handle orders given
+        # The order is acknowledged with (OrderActions.Ack, Ack), then every fill is settled and sent straight
+        # to its trader as (OrderActions.Place, Fill) through reply (self.reply unless given), so nothing is
+        # returned. An order failing the risk checks is answered with (OrderActions.Reject, Reject) instead
+        # and never reaches the engine.
+        self.check_lots(order.quantity)
+        if order.peak:
+            self.check_lots(order.peak)
+        if order.type != OrderType.MARKET and order.type != OrderType.STOP:
+            order.price = self.to_ticks(order.price)  # the order is priced in ticks from here on
+        if order.type == OrderType.STOP or order.type == OrderType.STOP_LIMIT:
+            order.stop_price = self.to_ticks(order.stop_price)
+        if engine is None:
+            engine = self.engine_for(order.symbol)
+        if reply is None:
+            reply = self.reply
+        symbol_id = self.symbol_id(order.symbol)
+        risk = self.risk
+        if risk is not None:
+            price = self.reference_price(order, engine, symbol_id)
+            try:
+                risk.check(order, symbol_id, price, self.ledger.balance(order.id),
+                           self.ledger.shares(order.id, symbol_id))
+            except RiskLimitExceeded as error:
+                reply[order.id]((OrderActions.Reject, Reject(order.id, order.order_id, order.symbol, str(error))))
+                return
+        reply[order.id]((OrderActions.Ack, Ack(order.id, order.order_id, order.symbol)))
+        self.trader_symbols[order.id].add(order.symbol)
+        filled = engine.handle_order(order)
+        if engine.expiries and engine.expiries[0][0] < self.book_expiry.get(order.symbol, float('inf')):
+            self.track_expiry(order.symbol, engine)
+        if risk is not None:
+            placed, fresh = (order,), ()
+            if engine.activated:
+                # Stops went in as new orders. Those may have rested and been traded against within this call, so
+                # their fills as resting orders are not released and only what is left of them rests below.
+                placed = [order] + engine.activated
+                fresh = {placed_order.order_id for placed_order in placed}
+                engine.activated = []
+            for f in filled[0::2]:  # the resting order's fill of every (resting, incoming) pair
+                if f.order_id not in fresh:
+                    risk.release(f.id, symbol_id, f.side, f.quantity, f.price if f.limit else None)
+            for placed_order in placed:
+                # a pending stop is checked when it arrives but not counted as resting until it triggers
+                if placed_order.quantity > 0 and placed_order.type != OrderType.STOP and \
+                        placed_order.type != OrderType.STOP_LIMIT and \
+                        engine.order_index.get(placed_order.order_id) is placed_order:
+                    risk.rest(placed_order, symbol_id, price if placed_order is order else
+                              self.reference_price(placed_order, engine, symbol_id))
+        if filled:
+            apply_fill = self.apply_fill
+            journal = self.journal
+            for id, symbol, quantity, price, side, fill_time, limit, order_id in filled:
+                if journal is not None:
+                    journal.append(JOURNAL_FILL, OrderActions.Place.value, limit, side.value, id, symbol, price,
+                                   quantity, fill_time)
+                reply[id]((OrderActions.Place, apply_fill(id, symbol, symbol_id, quantity, price, side, fill_time,
+                                                          limit, order_id)))
+        if order.quantity and (order.type == OrderType.IOC or order.type == OrderType.FOK):
+            # what an IOC could not trade, or a killed FOK, is cancelled and acknowledged like an expired order
+            reply[order.id]((OrderActions.Cancel, Ack(order.id, order.order_id, order.symbol)))
+        if self.wall_clock is not None:
+            self.order_latency.record(self.wall_clock() - order.wall)
+
+    def reference_price(self, order, engine, symbol_id):
+        # the price in ticks the risk checks value an order at: its limit price, a stop order its stop price,
+        # for a market order the best opposite price (it may sweep further) or else the symbol's last fill
+        if order.type == OrderType.STOP:
+            return order.stop_price
+        if order.type != OrderType.MARKET:
+            return order.price
+        price = engine.best_ask() if order.side == OrderSide.BUY else engine.best_bid()
+        if price is None:
+            marks = self.ledger.marks()
+            price = int(marks[symbol_id]) if symbol_id < len(marks) else 0
+        return price
+
+    def apply_fill(self, id, symbol, symbol_id, quantity, price, side, time, limit, order_id):
+        # record one fill priced in ticks on the ledger and return it as a Fill priced in currency units,
+        # Ledger.record inlined as this runs for every fill
+        money_changed = quantity * price * self.tick_value
+        fills = self.ledger.fills
+        if side == OrderSide.BUY:
+            fills.extend((id, symbol_id, -money_changed, quantity, price))
+        else:
+            fills.extend((id, symbol_id, money_changed, -quantity, price))
+        if len(fills) >= 5 * LEDGER_SETTLE_EVERY:
+            self.ledger.settle()
+        return Fill(id, symbol, quantity, self.to_price(price), side, time, limit, order_id)
+
+    def amend_quantity(self, id, quantity, symbol=DEFAULT_SYMBOL, order_id=None):
+
+        self.check_lots(quantity)
+        engine = self.engine_for(symbol, create=False)
+        try:
+            result = self.amend_resting(engine, id, quantity, symbol, order_id) if engine else False
+        except (NewQuantityNotSmaller, NonPositiveQuantity):
+            result = False
+        return (OrderActions.Amend, result)
+        # The matching engine must be able to process the 'amend' action based on the given parameters
+        # Keep in mind of any exceptions that may be thrown by the matching engine while handling orders
+        # The return must be in the form (action type enum, logical based on if order processed)
+
+    def cancel_order(self, id, symbol=DEFAULT_SYMBOL, order_id=None):
+
+        engine = self.engine_for(symbol, create=False)
+        result = self.cancel_resting(engine, id, symbol, order_id) if engine else False
+        return (OrderActions.Cancel,result)
+
+    def amend_resting(self, engine, id, quantity, symbol, order_id=None):
+        # amend trader id's order on the engine (its newest one in the symbol without an order id), releasing
+        # the amended away shares from the risk aggregates
+        order = engine.trader_order(id, order_id)
+        if order is None:
+            return False
+        if self.risk is None:
+            return engine.amend_quantity(order.order_id, quantity)
+        before = order.quantity + order.reserve
+        result = engine.amend_quantity(order.order_id, quantity)
+        if result:
+            self.risk.release_order(order, self.symbol_id(symbol), before - quantity)
+        return result
+
+    def cancel_resting(self, engine, id, symbol, order_id=None):
+        order = engine.trader_order(id, order_id)
+        if order is None:
+            return False
+        result = engine.cancel_order(order.order_id)
+        if result and self.risk is not None:
+            self.risk.release_order(order, self.symbol_id(symbol))
+        return result
+
+    def cancel_all(self, id, symbol=None, side=None):
+        # Cancel every open order of trader `id`, or those of one symbol and / or side. Only the books in
+        # trader_symbols are visited and each finds the trader's orders in its per-trader index, so k open
+        # orders cost O(k) however many symbols trade. The return is (OrderActions.Cancel_All, number of
+        # orders cancelled).
+        symbols = self.trader_symbols.get(id)
+        if not symbols:
+            return (OrderActions.Cancel_All, 0)
+        cancelled = 0
+        for symbol in ([symbol] if symbol is not None else list(symbols)):
+            engine = self.engine_for(symbol, create=False)
+            if engine is None:
+                continue
+            orders = engine.cancel_all(id, side)
+            if self.risk is not None:
+                symbol_id = self.symbol_id(symbol)
+                for order in orders:
+                    self.risk.release_order(order, symbol_id)
+            cancelled += len(orders)
+            if id not in engine.open_orders:
+                symbols.discard(symbol)
+        return (OrderActions.Cancel_All, cancelled)
+
+    def disconnect(self, id):
+        # the trader went away, its open orders go with it unless cancel_on_disconnect is off
+        if not self.cancel_on_disconnect:
+            return (OrderActions.Disconnect, 0)
+        return (OrderActions.Disconnect, self.cancel_all(id)[1])
+
+    def expire_orders(self, now, reply=None):
+        # Cancel the good-till-time orders of every book due at clock value `now`, each acknowledged to its
+        # trader as (OrderActions.Cancel, Ack). Every book pops just its due orders off its expiry heap.
+        if reply is None:
+            reply = self.reply
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expire_time, symbol = heapq.heappop(heap)
+            if self.book_expiry.get(symbol) != expire_time:
+                continue  # the book was put on the heap again with an earlier time
+            del self.book_expiry[symbol]
+            engine = self.engine_for(symbol, create=False)
+            self.expire_book(symbol, engine, now, reply)
+            if engine.expiries:
+                self.track_expiry(symbol, engine)
+        self.next_expiry = heap[0][0] if heap else float('inf')
+
+    def expire_book(self, symbol, engine, now, reply):
+        self.cancel_expired(symbol, engine.expire_orders(now), reply)
+
+    def track_expiry(self, symbol, engine):
+        # put the book on the expiry heap by its earliest expire time, earlier than its entry there if it has one
+        expire_time = self.book_expiry[symbol] = engine.expiries[0][0]
+        heapq.heappush(self.expiry_heap, (expire_time, symbol))
+        if expire_time < self.next_expiry:
+            self.next_expiry = expire_time
+
+    def end_of_day(self, reply=None):
+        # the trading day is over: cancel every resting day order, acknowledged like an expired order
+        self.restore_books()
+        if reply is None:
+            reply = self.reply
+        for engines in self.engines:
+            for symbol, engine in engines.items():
+                self.cancel_expired(symbol, engine.end_day(), reply)
+
+    def cancel_expired(self, symbol, orders, reply):
+        if orders and self.risk is not None:
+            symbol_id = self.symbol_id(symbol)
+            for order in orders:
+                self.risk.release_order(order, symbol_id)
+        for order in orders:
+            reply[order.id]((OrderActions.Cancel, Ack(order.id, order.order_id, symbol)))
+
+    def balance_and_position(self, id):
+
+        return (OrderActions.Return_Balance_And_Position,(self.to_cash(self.ledger.balance(id)), self.ledger.position(id)))
+        # The matching engine must be able to process the 'balance' action based on the given parameters
+        # The return must be in the form (action type enum, (trader balance, trader positions))
+
+    def handle_request(self, request):
+        # The exchange must be able to process different types of requests based on the action
+        # type given using the functions implemented above
+        # The fills of a new order are sent by place_new_order itself, so it returns None
+        if len(request) > 1 and request[1] >= self.traders:
+            self.add_traders(request[1] + 1)
+        if isinstance(request[0], OrderType):
+            refused = self.refuse(request)
+            if refused is not None:
+                self.reply[request[1]](refused)
+                return None
+            self.stamp(request[2])
+            if request[2].time >= self.next_expiry:
+                self.expire_orders(request[2].time)
+        elif request[0] is OrderActions.Amend:
+            refused = self.refuse(request)
+            if refused is not None:
+                return refused
+        if self.journal is not None:
+            self.journal_request(request)
+        if isinstance(request[0], OrderType):
+            return self.place_new_order(request[2])
+        elif request[0] == OrderActions.Amend:
+            return self.amend_quantity(request[1],request[2],request[3], request[4] if len(request) > 4 else None)
+        elif request[0] == OrderActions.Cancel:
+            return self.cancel_order(request[1],request[2], request[3] if len(request) > 3 else None)
+        elif request[0] == OrderActions.Return_Balance_And_Position:
+            return self.balance_and_position(request[1])
+        elif request[0] == OrderActions.Cancel_All:
+            return self.cancel_all(*request[1:])
+        elif request[0] == OrderActions.Disconnect:
+            return self.disconnect(request[1])
+        elif request[0] == OrderActions.End_Of_Day:
+            return self.end_of_day()
+        else:
+            raise UndefinedTraderAction("Undefined Trader Action!")
+
+    def journal_request(self, request):
+        # an amend or cancel keeps its order id in the price field, 0 for none; a mass cancel keeps its
+        # side in the side field, 0 for both, and '' for every symbol. A stop order keeps its stop price in
+        # ticks in the order time field, the exchange stamps the order again when it is replayed. A limit order
+        # keeps its time in force in the high bits of the order type field and a good-till-time order its
+        # expire time in the order time field.
+        action = request[0]
+        if action is OrderActions.Amend:
+            order_id = request[4] if len(request) > 4 else None
+            self.journal.append(JOURNAL_REQUEST, action.value, 0, 0, request[1], request[3], order_id or 0, request[2],
+                                0.0)
+        elif action is OrderActions.Cancel:
+            order_id = request[3] if len(request) > 3 else None
+            self.journal.append(JOURNAL_REQUEST, action.value, 0, 0, request[1], request[2], order_id or 0, 0, 0.0)
+        elif action is OrderActions.Return_Balance_And_Position or action is OrderActions.Disconnect:
+            self.journal.append(JOURNAL_REQUEST, action.value, 0, 0, request[1], '', 0, 0, 0.0)
+        elif action is OrderActions.End_Of_Day:
+            self.journal.append(JOURNAL_REQUEST, action.value, 0, 0, 0, '', 0, 0, 0.0)
+        elif action is OrderActions.Cancel_All:
+            symbol = request[2] if len(request) > 2 else None
+            side = request[3] if len(request) > 3 else None
+            self.journal.append(JOURNAL_REQUEST, action.value, 0, side.value if side else 0, request[1], symbol or '',
+                                0, 0, 0.0)
+        elif isinstance(action, OrderType):
+            order = request[2]
+            price, stop = self.order_ticks(order)
+            if order.type == OrderType.LIMIT:
+                self.journal.append(JOURNAL_REQUEST, OrderActions.Place.value,
+                                    order.type.value | order.time_in_force.value << 4, order.side.value, order.id,
+                                    order.symbol, price, order.quantity, order.expire_time or order.time, order.peak)
+            else:
+                self.journal.append(JOURNAL_REQUEST, OrderActions.Place.value, order.type.value, order.side.value,
+                                    order.id, order.symbol, price, order.quantity, stop or order.time)
+
+    def request_from_journal(self, action, type, side, id, symbol, price, quantity, stamp, peak=0):
+        # the request tuple a journaled request record was made from
+        if action == OrderActions.Amend.value:
+            return (OrderActions.Amend, id, quantity, symbol, price or None)
+        if action == OrderActions.Cancel.value:
+            return (OrderActions.Cancel, id, symbol, price or None)
+        if action == OrderActions.Return_Balance_And_Position.value:
+            return (OrderActions.Return_Balance_And_Position, id)
+        if action == OrderActions.Cancel_All.value:
+            return (OrderActions.Cancel_All, id, symbol or None, OrderSide(side) if side else None)
+        if action == OrderActions.Disconnect.value:
+            return (OrderActions.Disconnect, id)
+        if action == OrderActions.End_Of_Day.value:
+            return (OrderActions.End_Of_Day,)
+        if type == OrderType.MARKET.value:
+            order = MarketOrder(id, symbol, quantity, OrderSide(side), stamp)
+        elif type & 15 == OrderType.LIMIT.value:
+            time_in_force = TimeInForce(type >> 4)
+            expire_time = stamp if time_in_force is TimeInForce.GTT else None
+            if peak:
+                order = IcebergOrder(id, symbol, quantity, self.to_price(price), peak, OrderSide(side), stamp,
+                                     time_in_force, expire_time)
+            else:
+                order = LimitOrder(id, symbol, quantity, self.to_price(price), OrderSide(side), stamp, time_in_force,
+                                   expire_time)
+        elif type == OrderType.STOP.value:
+            order = StopOrder(id, symbol, quantity, self.to_price(int(stamp)), OrderSide(side), 0)
+        elif type == OrderType.STOP_LIMIT.value:
+            order = StopLimitOrder(id, symbol, quantity, self.to_price(int(stamp)), self.to_price(price),
+                                   OrderSide(side), 0)
+        elif type == OrderType.FOK.value:
+            order = FOKOrder(id, symbol, quantity, self.to_price(price), OrderSide(side), stamp)
+        else:
+            order = IOCOrder(id, symbol, quantity, self.to_price(price), OrderSide(side), stamp)
+        return (order.type, id, order)
+
+    def replay(self, path, after=0):
+        # Feed the requests of a journal through handle_request, e.g. into a fresh exchange after a crash.
+        # The journaled fills are skipped, matching the requests again produces them. Records up to
+        # sequence number `after` are skipped too, restore() returns it for the journal tail after a snapshot.
+        # Returns the number of requests replayed.
+        symbols = {}  # encoded symbol -> symbol
+        count = 0
+        for record in read_journal(path):
+            if record[2] != JOURNAL_REQUEST or record[0] <= after:
+                continue
+            encoded = record[7]
+            symbol = symbols.get(encoded)
+            if symbol is None:
+                symbol = symbols[encoded] = encoded.rstrip(b'\0').decode()
+            request = self.request_from_journal(record[3], record[4], record[5], record[6], symbol, record[8],
+                                                record[9], record[10], record[11])
+            self.deliver(request, self.handle_request(request))
+            count += 1
+        return count
+
+    def snapshot(self, path):
+        # Write the resting orders of every in-process book and the ledger to `path`, see SNAPSHOT_HEADER
+        if self.pool is not None:
+            raise ValueError("The Books Are In The Shard Workers, Stop Them Before Taking A Snapshot!")
+        self.restore_books()
+        symbols = []
+        columns = {name: array(code) for name, code in SNAPSHOT_ORDER_COLUMNS}
+        (ids, order_ids, prices, stop_prices, quantities, priorities, expire_times, reserves, peaks, sides, types,
+         times_in_force) = (columns[name] for name, code in SNAPSHOT_ORDER_COLUMNS)
+        # A book is written a column at a time, each one a comprehension over its orders. Market and stop orders
+        # have no price, only stops have a stop price and only limit orders a time in force and expire time
+        # (a stop limit order's are GTC and None), the class defaults of Order cover reserve and peak. The enum
+        # values are read as _value_, a plain attribute, where .value is a property several times as slow.
+        gtc = TimeInForce.GTC
+        for engines in self.engines:
+            for symbol, engine in engines.items():
+                orders = [order for book in (engine.bid_book, engine.ask_book, engine.buy_stops, engine.sell_stops)
+                          for order in book]
+                ids.extend([order.id for order in orders])
+                order_ids.extend([order.order_id for order in orders])
+                prices.extend([getattr(order, 'price', 0) for order in orders])
+                stop_prices.extend([getattr(order, 'stop_price', 0) for order in orders])
+                quantities.extend([order.quantity for order in orders])
+                priorities.extend([order.time for order in orders])
+                expire_times.extend([getattr(order, 'expire_time', None) or 0 for order in orders])
+                reserves.extend([order.reserve for order in orders])
+                peaks.extend([order.peak for order in orders])
+                sides.extend([order.side._value_ for order in orders])
+                types.extend([order.type._value_ for order in orders])
+                times_in_force.extend([getattr(order, 'time_in_force', gtc)._value_ for order in orders])
+                symbols.append((symbol, len(orders), engine.last_price or 0))
+        symbol_ids = {symbol: i for i, (symbol, rows, last_price) in enumerate(symbols)}
+        ledger = self.ledger
+        numpy = ledger.numpy
+        holdings = ledger.holdings()
+        marks = ledger.marks()
+        held_traders, held_columns = numpy.nonzero(holdings)
+        snapshot_ids = numpy.zeros(len(self.symbols), dtype='i8')  # ledger column -> snapshot symbol index
+        for column in numpy.union1d(held_columns, numpy.flatnonzero(marks)).tolist():
+            symbol = self.symbols[column]
+            if symbol not in symbol_ids:
+                symbol_ids[symbol] = len(symbols)
+                symbols.append((symbol, 0, 0))
+            snapshot_ids[column] = symbol_ids[symbol]
+        positions = {'trader': held_traders, 'symbol': snapshot_ids[held_columns],
+                     'shares': holdings[held_traders, held_columns]}
+
+        next_clock = 0
+        if self.sequence is not None:
+            next_clock = next(self.sequence)  # peeking consumes the value, the counter restarts from it
+            self.sequence = count(next_clock)
+            self.clock = self.sequence.__next__
+        next_order_id = next(self.order_ids)
+        self.order_ids = count(next_order_id)
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, ledger.traders, len(symbols), len(ids),
+                                      len(positions['trader']), self.tick_size, self.lot_size, self.cash_scale,
+                                      next_clock, next_order_id,
+                                      self.journal.sequence if self.journal is not None else 0)]
+        for symbol, rows, last_price in symbols:
+            encoded = symbol.encode()
+            if len(encoded) > 16:
+                raise ValueError("Symbols Longer Than 16 Bytes Can Not Be Saved!")
+            column = self.symbol_ids.get(symbol)
+            mark = int(marks[column]) if column is not None else 0
+            parts.append(SNAPSHOT_SYMBOL.pack(encoded, rows, last_price, mark))
+        parts.extend(column.tobytes() for column in columns.values())
+        parts.append(ledger.balances[:ledger.traders].astype('<i8').tobytes())
+        parts.extend(positions[name].astype('<' + code).tobytes() for name, code in SNAPSHOT_POSITION_COLUMNS)
+        with open(path, 'wb') as file:
+            for part in parts:
+                file.write(part)
+                file.write(bytes(-len(part) % 8))
+
+    def restore(self, path, lazy=False):
+        # Replace the books and the ledger with a snapshot() file. The file is memory mapped and the columns
+        # are read in place. Every book is rebuilt before restore() returns, so the first requests after a warm
+        # restart do not pay for it; with lazy=True each symbol's book is rebuilt when it is first used instead
+        # (engine_for), so a restart that only trades a few of many books skips the others. Returns the journal
+        # sequence number the snapshot was taken at, the journal tail to replay() comes after it.
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        (magic, traders, symbol_count, orders, position_count, tick_size, lot_size, cash_scale, next_clock,
+         next_order_id, journal_sequence) = SNAPSHOT_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not An Exchange Snapshot!")
+        if (tick_size, lot_size, cash_scale) != (self.tick_size, self.lot_size, self.cash_scale):
+            raise ValueError("The Snapshot Was Taken With A Different Exchange Configuration!")
+
+        offset = SNAPSHOT_HEADER.size + -SNAPSHOT_HEADER.size % 8
+        symbols = []
+        marks = []
+        self.pending_books = {}
+        first_row = 0
+        for i in range(symbol_count):
+            encoded, rows, last_price, mark = SNAPSHOT_SYMBOL.unpack_from(view, offset + i * SNAPSHOT_SYMBOL.size)
+            symbol = encoded.rstrip(b'\0').decode()
+            symbols.append(symbol)
+            marks.append(mark)
+            if rows or last_price:
+                self.pending_books[symbol] = (first_row, rows, last_price)
+            first_row += rows
+        offset += symbol_count * SNAPSHOT_SYMBOL.size
+
+        def column(code, length):
+            nonlocal offset
+            size = length * array(code).itemsize
+            values = view[offset:offset + size].cast(code)
+            offset += size + -size % 8
+            return values
+
+        self.snapshot_columns = {name: column(code, orders) for name, code in SNAPSHOT_ORDER_COLUMNS}
+        balances = column('q', traders)
+        position_traders, position_symbols, shares = (column(code, position_count)
+                                                      for name, code in SNAPSHOT_POSITION_COLUMNS)
+        ledger_ids = [self.symbol_id(symbol) for symbol in symbols]  # snapshot symbol index -> ledger column
+        self.ledger.load(balances, position_traders, [ledger_ids[symbol] for symbol in position_symbols], shares,
+                         dict(zip(ledger_ids, marks)))
+        self.engines = [{} for _ in range(self.shards)]
+        if self.sequence is not None and next_clock:
+            self.sequence = count(next_clock)
+            self.clock = self.sequence.__next__
+        self.order_ids = count(next_order_id)
+        self.next_expiry = float('inf')
+        self.expiry_heap = []
+        self.book_expiry = {}
+        self.trader_symbols = defaultdict(set)
+        if self.risk is not None:
+            self.risk.clear()
+        # What has to be known of a book before it is built is read off its columns, a pass over the rows
+        # without making orders: the traders with orders in it (so a mass cancel finds it), its earliest
+        # good-till-time expire time (so it is put on the expiry heap and built when that is due) and, with risk
+        # checks, its resting shares and notional. Day orders wait, end_of_day() builds every book.
+        columns = self.snapshot_columns
+        gtt = TimeInForce.GTT.value
+        stop_types = (OrderType.STOP.value, OrderType.STOP_LIMIT.value)
+        sides = {side.value: side for side in OrderSide}
+        for symbol, (first, rows, last_price) in self.pending_books.items():
+            end = first + rows
+            for trader in set(columns['id'][first:end]):
+                self.trader_symbols[trader].add(symbol)
+            if gtt in columns['time_in_force'][first:end].tobytes():
+                self.book_expiry[symbol] = expire_time = min(
+                    expire_time for expire_time, time_in_force in
+                    zip(columns['expire_time'][first:end], columns['time_in_force'][first:end])
+                    if time_in_force == gtt)
+                heapq.heappush(self.expiry_heap, (expire_time, symbol))
+                self.next_expiry = min(self.next_expiry, expire_time)
+            if self.risk is not None:
+                symbol_id = self.symbol_id(symbol)
+                for id, price, quantity, reserve, side, type in zip(
+                        *(columns[name][first:end] for name in ('id', 'price', 'quantity', 'reserve', 'side', 'type'))):
+                    if type not in stop_types:
+                        self.risk.rest_shares(id, symbol_id, sides[side], quantity + reserve, price)
+        if not lazy:
+            self.restore_books()
+        return journal_sequence
+
+    def restore_book(self, symbol):
+        # Rebuild one restored book from the mapped columns. The orders of each side arrive in priority order,
+        # best level first, so the levels are appended as they come and the key lists reversed at the end
+        # instead of inserting every order through BookSide.add. Pending stops go back into their stop books,
+        # good-till-time and day orders on the engine's expiry heap and day order list.
+        # This is the whole cost of a warm restart, so the resting orders are made without their constructors'
+        # checks (they passed them when they were placed) and linked into their levels and the engine's indexes
+        # in line, with the enum values looked up once rather than per row.
+        first, rows, last_price = self.pending_books.pop(symbol)
+        engine = MatchingEngine()
+        engine.last_price = last_price or None
+        columns = self.snapshot_columns
+        order_index, open_orders = engine.order_index, engine.open_orders
+        bids, asks = engine.bid_book, engine.ask_book
+        expiries, day_orders = engine.expiries, engine.day_orders
+        expiry_sequence = engine.expiry_sequence
+        buy, sell = OrderSide.BUY, OrderSide.SELL
+        buy_value = buy.value
+        limit_value, stop_value, stop_limit_value = (OrderType.LIMIT.value, OrderType.STOP.value,
+                                                     OrderType.STOP_LIMIT.value)
+        gtt_value = TimeInForce.GTT.value
+        times_in_force = {time_in_force.value: time_in_force for time_in_force in TimeInForce}
+        make = object.__new__
+        book = level = None
+        collecting = gc.isenabled()
+        gc.disable()  # the collector would rescan the growing book over and over, it holds no garbage
+        try:
+            for (id, order_id, price, stop_price, quantity, priority, expire_time, reserve, peak, side, type,
+                 time_in_force) in zip(*(columns[name][first:first + rows].tolist()
+                                         for name, code in SNAPSHOT_ORDER_COLUMNS)):
+                if side == buy_value:
+                    side, side_book = buy, bids
+                else:
+                    side, side_book = sell, asks
+                if type == stop_value or type == stop_limit_value:
+                    if type == stop_value:
+                        order = StopOrder(id, symbol, quantity, stop_price, side, priority)
+                    else:
+                        order = StopLimitOrder(id, symbol, quantity, stop_price, price, side, priority)
+                    order.order_id = order_id
+                    (engine.buy_stops if side is buy else engine.sell_stops).add(order)
+                    engine.index_order(order)
+                    continue
+                if type == limit_value:
+                    if peak:
+                        order = make(IcebergOrder)
+                        order.peak = peak
+                        order.reserve = reserve
+                    else:
+                        order = make(LimitOrder)
+                    order.price = price
+                    order.time_in_force = times_in_force[time_in_force]
+                    order.expire_time = expire_time if time_in_force == gtt_value else None
+                    key = price if side is buy else -price
+                else:
+                    order = make(MarketOrder)
+                    key = BookSide.MARKET_KEY
+                order.id = id
+                order.order_id = order_id
+                order.symbol = symbol
+                order.quantity = quantity
+                order.side = side
+                order.time = priority
+                order.wall = 0
+                if side_book is not book or key != book.keys[-1]:
+                    book = side_book
+                    level = book.levels[key] = PriceLevel(key if side is buy else -key)
+                    book.keys.append(key)
+                # PriceLevel.append
+                order.level = level
+                order.prev_order = tail = level.tail
+                order.next_order = None
+                if tail is None:
+                    level.head = order
+                else:
+                    tail.next_order = order
+                level.tail = order
+                level.count += 1
+                level.quantity += quantity
+                level.hidden += reserve
+                # MatchingEngine.index_order
+                order_index[order_id] = order
+                trader_orders = open_orders.get(id)
+                if trader_orders is None:
+                    trader_orders = open_orders[id] = {}
+                trader_orders[order_id] = order
+                # MatchingEngine.track_expiry, the heap is made once the book is built
+                if time_in_force == gtt_value:
+                    expiry_sequence += 1
+                    expiries.append((expire_time, priority, expiry_sequence, order))
+                elif time_in_force:
+                    day_orders.append(order)
+        finally:
+            if collecting:
+                gc.enable()
+        for book in (bids, asks):
+            book.keys.reverse()
+            book.size = sum(level.count for level in book.levels.values())
+        heapq.heapify(expiries)
+        engine.expiry_sequence = expiry_sequence
+        # the rows come in priority order, each trader's open orders go back in the order their ids were given
+        engine.open_orders = {id: dict(sorted(orders.items())) for id, orders in open_orders.items()}
+        day_orders.sort(key=lambda order: order.time)  # in the order they rested, as in end_day()
+        if engine.expiries and engine.expiries[0][0] < self.book_expiry.get(symbol, float('inf')):
+            self.track_expiry(symbol, engine)
+        if self.instrumented:
+            engine.instrument()
+        if not self.pending_books:
+            self.snapshot_columns = None  # the last book is built, the mapped file can go
+        return engine
+
+    def restore_books(self):
+        for symbol in list(self.pending_books):
+            self.engine_for(symbol)
+
+    def start_workers(self, capacity=4096):
+        if self.risk is not None:
+            raise ValueError("The Risk Checks Need The Books In Process, Not In Shard Workers!")
+        self.pool = ShardPool(self.shards, capacity)
+
+    def stop_workers(self):
+        self.pool.close()
+        self.pool = None
+
+    def symbol_id(self, symbol):
+        id = self.symbol_ids.get(symbol)
+        if id is None:
+            id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return id
+
+    def run_sharded(self):
+        # Drain the pending requests into the shard workers, then settle the returned fills on the ledger.
+        # Balance requests are answered once the batch is settled, mass cancels once every shard they went
+        # to has reported its count. The workers expire their good-till-time orders by the stamps of the
+        # orders they are sent, and report every expired order as a cancel result carrying its side.
+        balance_requests = []
+        mass_cancels = []  # [action, trader id, orders cancelled], the record's time field is the position here
+        walls = []  # arrival wall stamps of the new orders, their latency ends once the batch is settled
+        while trader_to_exchange:
+            request = trader_to_exchange.popleft()
+            if len(request) > 1 and request[1] >= self.traders:
+                self.add_traders(request[1] + 1)
+            if isinstance(request[0], OrderType) or request[0] is OrderActions.Amend:
+                refused = self.refuse(request)
+                if refused is not None:
+                    self.reply[request[1]](refused)
+                    continue
+            if isinstance(request[0], OrderType):
+                self.stamp(request[2])
+            if self.journal is not None:
+                self.journal_request(request)
+            if isinstance(request[0], OrderType):
+                order = request[2]
+                walls.append(order.wall)
+                price, stop = self.order_ticks(order)
+                if order.type == OrderType.LIMIT:
+                    record = RECORD.pack(OrderActions.Place.value, order.type.value | order.time_in_force.value << 4,
+                                         order.side.value, self.symbol_id(order.symbol), order.id, order.order_id,
+                                         order.quantity, price, order.peak, order.time, order.expire_time or 0)
+                else:
+                    record = RECORD.pack(OrderActions.Place.value, order.type.value, order.side.value,
+                                         self.symbol_id(order.symbol), order.id, order.order_id, order.quantity,
+                                         price, stop, order.time, 0)
+                symbol = order.symbol
+                self.reply[order.id]((OrderActions.Ack, Ack(order.id, order.order_id, symbol)))
+            elif request[0] == OrderActions.Amend:
+                record = RECORD.pack(OrderActions.Amend.value, 0, 0, self.symbol_id(request[3]), request[1],
+                                     (request[4] if len(request) > 4 else None) or 0, request[2], 0, 0, 0, 0)
+                symbol = request[3]
+            elif request[0] == OrderActions.Cancel:
+                record = RECORD.pack(OrderActions.Cancel.value, 0, 0, self.symbol_id(request[2]), request[1],
+                                     (request[3] if len(request) > 3 else None) or 0, 0, 0, 0, 0, 0)
+                symbol = request[2]
+            elif request[0] == OrderActions.Return_Balance_And_Position:
+                balance_requests.append(request[1])
+                continue
+            elif request[0] == OrderActions.Cancel_All or request[0] == OrderActions.Disconnect:
+                if request[0] == OrderActions.Disconnect and not self.cancel_on_disconnect:
+                    self.reply[request[1]]((OrderActions.Disconnect, 0))
+                    continue
+                symbol = request[2] if len(request) > 2 else None
+                side = request[3] if len(request) > 3 else None
+                record = RECORD.pack(request[0].value, 0, side.value if side else 0,
+                                     -1 if symbol is None else self.symbol_id(symbol), request[1], 0, 0, 0, 0,
+                                     len(mass_cancels), 0)
+                mass_cancels.append([request[0], request[1], 0])
+                if symbol is None:
+                    for shard in range(self.shards):
+                        self.pool.submit(shard, record)
+                    continue
+            elif request[0] == OrderActions.End_Of_Day:
+                record = RECORD.pack(OrderActions.End_Of_Day.value, 0, 0, -1, 0, 0, 0, 0, 0, 0, 0)
+                for shard in range(self.shards):
+                    self.pool.submit(shard, record)
+                continue
+            else:
+                raise UndefinedTraderAction("Undefined Trader Action!")
+            self.pool.submit(shard_of(symbol, self.shards), record)
+
+        for results in self.pool.flush():
+            for action, flag, side, symbol, id, order_id, quantity, price, stop, stamp, expire in results:
+                if action == OrderActions.Place.value:
+                    if self.journal is not None:
+                        self.journal.append(JOURNAL_FILL, action, flag, side, id, self.symbols[symbol], price,
+                                            quantity, stamp)
+                    fill = self.apply_fill(id, self.symbols[symbol], symbol, quantity, price, OrderSide(side), stamp,
+                                           bool(flag), order_id)
+                    self.reply[id]((OrderActions.Place, fill))
+                elif action == OrderActions.Cancel_All.value or action == OrderActions.Disconnect.value:
+                    mass_cancels[int(stamp)][2] += quantity
+                elif action == OrderActions.Cancel.value and side:
+                    self.reply[id]((OrderActions.Cancel, Ack(id, order_id, self.symbols[symbol])))
+                else:
+                    self.reply[id]((OrderActions(action), bool(flag)))
+        if self.wall_clock is not None:
+            now = self.wall_clock()
+            for wall in walls:
+                self.order_latency.record(now - wall)
+        for action, id, cancelled in mass_cancels:
+            self.reply[id]((action, cancelled))
+        for id in balance_requests:
+            self.reply[id](self.balance_and_position(id))
+
+    def run_batch(self):
+        # One cycle of batch mode. Requests are grouped by action type and symbol: cancels and amends
+        # are applied in bulk first, then mass cancels and disconnects, then the new orders of each symbol
+        # are matched in arrival order (books of different symbols are independent), and balance requests
+        # are answered last. A book expires its due good-till-time orders before each of its new orders, the
+        # other books at the end of the batch, so every book sees its expiries in the order of its own flow.
+        # Each symbol's engine is looked up once per batch. The journal gets the requests in the order
+        # they are applied, except that the new orders go in all together in the order they were stamped: a
+        # replay one request at a time gives them the same clock values and order ids, so the later requests
+        # naming those ids find the same orders, and every book the same fills and expiries.
+        amends = defaultdict(list)  # symbol -> cancel / amend requests
+        orders = defaultdict(list)  # symbol -> new order requests
+        mass_cancels = []  # mass cancels, disconnects and the end of day
+        new_orders = []  # the new order requests in the order they were stamped
+        balance_requests = []
+        now = None  # the stamp of the batch's last new order
+        popleft = trader_to_exchange.popleft
+        for _ in range(min(self.batch_size, len(trader_to_exchange))):
+            request = popleft()
+            action = request[0]
+            if len(request) > 1 and request[1] >= self.traders:
+                self.add_traders(request[1] + 1)
+            if action is OrderActions.Cancel:
+                amends[request[2]].append(request)
+            elif action is OrderActions.Amend:
+                refused = self.refuse(request)
+                if refused is not None:
+                    self.reply_outbox[request[1]](refused)
+                    continue
+                amends[request[3]].append(request)
+            elif action is OrderActions.Return_Balance_And_Position:
+                balance_requests.append(request[1])
+            elif action is OrderActions.Cancel_All or action is OrderActions.Disconnect or \
+                    action is OrderActions.End_Of_Day:
+                mass_cancels.append(request)
+            elif isinstance(action, OrderType):
+                refused = self.refuse(request)
+                if refused is not None:
+                    self.reply_outbox[request[1]](refused)
+                    continue
+                self.stamp(request[2])
+                now = request[2].time
+                orders[request[2].symbol].append(request)
+                new_orders.append(request)
+            else:
+                raise UndefinedTraderAction("Undefined Trader Action!")
+
+        reply = self.reply_outbox
+        journal = self.journal
+        for symbol, requests in amends.items():
+            engine = self.engine_for(symbol, create=False)
+            for request in requests:
+                if journal is not None:
+                    self.journal_request(request)
+                result = False
+                if engine is None:
+                    pass
+                elif request[0] is OrderActions.Cancel:
+                    result = self.cancel_resting(engine, request[1], symbol, request[3] if len(request) > 3 else None)
+                else:
+                    try:
+                        result = self.amend_resting(engine, request[1], request[2], symbol,
+                                                    request[4] if len(request) > 4 else None)
+                    except (NewQuantityNotSmaller, NonPositiveQuantity):
+                        pass
+                reply[request[1]]((request[0], result))
+        for request in mass_cancels:
+            if journal is not None:
+                self.journal_request(request)
+            if request[0] is OrderActions.Cancel_All:
+                reply[request[1]](self.cancel_all(*request[1:]))
+            elif request[0] is OrderActions.Disconnect:
+                reply[request[1]](self.disconnect(request[1]))
+            else:
+                self.end_of_day(reply)
+        if journal is not None:
+            for request in new_orders:
+                self.journal_request(request)
+        for symbol, requests in orders.items():
+            engine = self.engine_for(symbol)
+            for request in requests:
+                order = request[2]
+                if engine.expiries and engine.expiries[0][0] <= order.time:
+                    self.expire_book(symbol, engine, order.time, reply)
+                self.place_new_order(order, engine, reply)
+        if now is not None and now >= self.next_expiry:
+            self.expire_orders(now, reply)
+        for id in balance_requests:
+            if journal is not None:
+                self.journal_request((OrderActions.Return_Balance_And_Position, id))
+            reply[id](self.balance_and_position(id))
+
+        if time.perf_counter() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # publish the collected responses, one extend per trader
+        for trader, responses in enumerate(self.outbox):
+            if responses:
+                self.reply_batch[trader](responses)
+                responses.clear()
+        self.last_flush = time.perf_counter()
+
+    def run_infinite_loop(self):
+        if self.pool is not None:
+            self.run_sharded()
+            return
+        if self.batch_size is not None:
+            while trader_to_exchange:
+                self.run_batch()
+            self.flush()
+            return
+        while trader_to_exchange:
+            request = trader_to_exchange.popleft()
+            self.deliver(request, self.handle_request(request))
+
+    def deliver(self, request, response):
+        # answer the requesting trader, new orders have already been answered with their fills
+        if response is not None:
+            self.reply[request[1]](response)
+
+    async def run_async(self, requests):
+        # Drain the request queue as requests arrive, until the None sentinel from run_session()
+        while True:
+            request = await requests.get()
+            while request is not None:
+                self.deliver(request, self.handle_request(request))
+                if requests.empty():
+                    break
+                request = requests.get_nowait()
+            if request is None:
+                return
+# The exchange must continue handling orders as orders are issued by the traders
+# A way to do this is check if there are any orders waiting to be processed in the deque
+
+# If there are, handle the request using the functions built above and using the
+# corresponding trader's deque, return an acknowledgement based on the response
+
+
+async def run_session(exchange, traders, actions=10000):
+    import asyncio
+
+    # The asyncio runtime: the exchange and every trader are coroutines talking over asyncio.Queues
+    # instead of the global deques, so only the traders that still have something to do get scheduled.
+    # Returns the traders' inboxes, holding the replies that came after a trader's last look (its disconnect's)
+    requests = asyncio.Queue()
+    inboxes = [asyncio.Queue() for _ in traders]
+    exchange.reply = [inbox.put_nowait for inbox in inboxes]
+    for t in traders:
+        t.send = requests.put_nowait
+    exchange_task = asyncio.create_task(exchange.run_async(requests))
+    await asyncio.gather(*(t.run_async(inboxes[t.id], actions) for t in traders))
+    requests.put_nowait(None)
+    await exchange_task
+    return inboxes
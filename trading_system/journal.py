@@ -0,0 +1,85 @@
+import mmap
+import os
+import struct
+import time
+
+
+# The journal: every request the exchange takes off trader_to_exchange and every fill it produces, appended
+# to a file as fixed-width binary records. read_journal() maps the file back in and Exchange.replay() feeds
+# the requests through handle_request again, for crash recovery or to re-run a recorded session.
+# The file starts with JOURNAL_MAGIC, whose last two digits are the record format version: a journal written in
+# another format is refused rather than misread.
+
+# sequence, wall time, kind, action, order type (or fill limit flag), side, trader id, symbol, price ticks,
+# quantity, order time, peak (the displayed quantity of an iceberg order, 0 otherwise)
+JOURNAL_RECORD = struct.Struct('<qdbbbbi16sqqdq')
+JOURNAL_MAGIC = b'EXJRNL01'
+JOURNAL_REQUEST = 1
+JOURNAL_FILL = 2
+
+
+class Journal():
+
+    def __init__(self, path, sync_every=65536, buffer_size=1 << 20):
+        # writes are buffered, the file is fsync'ed every sync_every records and on close()
+        self.file = open(path, 'ab', buffering=buffer_size)
+        self.write = self.file.write
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.sequence = 0
+        size = self.file.tell()  # an existing journal is continued after its last sequence number
+        if not size:
+            self.write(JOURNAL_MAGIC)
+        else:
+            check_magic(path)
+            end = size - (size - len(JOURNAL_MAGIC)) % JOURNAL_RECORD.size
+            if end != size:
+                self.file.truncate(end)  # cut a torn last record, or every record appended after it is misaligned
+            if end > len(JOURNAL_MAGIC):
+                with open(path, 'rb') as file:
+                    file.seek(end - JOURNAL_RECORD.size)
+                    self.sequence = JOURNAL_RECORD.unpack(file.read(JOURNAL_RECORD.size))[0]
+        self.symbols = {}  # symbol -> encoded symbol
+
+    def append(self, kind, action, type, side, id, symbol, price, quantity, stamp, peak=0):
+        encoded = self.symbols.get(symbol)
+        if encoded is None:
+            encoded = symbol.encode()
+            if len(encoded) > 16:
+                raise ValueError("Symbols Longer Than 16 Bytes Can Not Be Journaled!")
+            self.symbols[symbol] = encoded
+        self.sequence += 1
+        self.write(JOURNAL_RECORD.pack(self.sequence, time.time(), kind, action, type, side, id, encoded, price,
+                                       quantity, stamp, peak))
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def check_magic(path):
+    with open(path, 'rb') as file:
+        if file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError("Not An Exchange Journal Of This Version!")
+
+
+def read_journal(path):
+    # the journal's records as tuples, read through a memory map. A torn last record (a crash in the
+    # middle of a write) is left out.
+    check_magic(path)
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < len(JOURNAL_MAGIC) + JOURNAL_RECORD.size:
+            return
+        end = size - (size - len(JOURNAL_MAGIC)) % JOURNAL_RECORD.size
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer, memoryview(buffer) as view, \
+                view[len(JOURNAL_MAGIC):end] as records:
+            yield from JOURNAL_RECORD.iter_unpack(records)
@@ -0,0 +1,135 @@
+# The traders' ledger: cash balances and share positions in NumPy arrays, a row per trader and a position
+# column per symbol, both growing as traders and symbols appear. Fills are recorded as they happen and
+# applied together by settle() as one scatter-add; every read settles first. Cash is in integer minor units
+# and prices in integer ticks, as inside the Exchange, so the ledger stays exact.
+
+LEDGER_SETTLE_EVERY = 1 << 16  # recorded fills that trigger a settle, bounding the pending buffer
+LEDGER_SMALL_SETTLE = 32  # below this many fills a plain loop is cheaper than the NumPy call overhead
+
+
+class Ledger():
+
+    def __init__(self, traders, initial_balance, tick_value=1, symbols=None):
+        import numpy
+        self.numpy = numpy
+        self.initial_balance = initial_balance
+        self.tick_value = tick_value  # minor units per share per tick
+        self.symbols = symbols if symbols is not None else []  # column -> symbol, the Exchange shares its list
+        self.traders = traders
+        self.balances = numpy.full(traders, initial_balance, dtype='i8')
+        self.positions = numpy.zeros((traders, max(len(self.symbols), 4)), dtype='i8')
+        self.last_prices = numpy.zeros(self.positions.shape[1], dtype='i8')  # ticks of each symbol's last fill
+        self.fills = []  # trader, symbol column, cash, shares, price ticks of every fill not settled yet, flat
+
+    def record(self, trader, symbol, cash, shares, price):
+        # cash and shares are signed, what the trader receives
+        fills = self.fills
+        fills.extend((trader, symbol, cash, shares, price))
+        if len(fills) >= 5 * LEDGER_SETTLE_EVERY:
+            self.settle()
+
+    def grow(self, traders, symbols):
+        # make room for `traders` rows and `symbols` columns, doubling the capacity so growth is amortised
+        numpy = self.numpy
+        rows, columns = self.positions.shape
+        if traders > rows or symbols > columns:
+            new_rows = max(traders, 2 * rows) if traders > rows else rows
+            new_columns = max(symbols, 2 * columns) if symbols > columns else columns
+            balances = numpy.full(new_rows, self.initial_balance, dtype='i8')
+            balances[:rows] = self.balances
+            positions = numpy.zeros((new_rows, new_columns), dtype='i8')
+            positions[:rows, :columns] = self.positions
+            last_prices = numpy.zeros(new_columns, dtype='i8')
+            last_prices[:columns] = self.last_prices
+            self.balances, self.positions, self.last_prices = balances, positions, last_prices
+        self.traders = max(self.traders, traders)
+
+    def settle(self):
+        if not self.fills:
+            return
+        numpy = self.numpy
+        fills, self.fills = self.fills, []
+        count = len(fills) // 5
+        if count < LEDGER_SMALL_SETTLE:
+            self.grow(max(fills[0::5]) + 1, max(fills[1::5]) + 1)
+            balances, positions, last_prices = self.balances, self.positions, self.last_prices
+            it = iter(fills)
+            for trader, symbol, cash, shares, price in zip(it, it, it, it, it):
+                balances[trader] += cash
+                positions[trader, symbol] += shares
+                last_prices[symbol] = price
+            return
+        traders, symbols, cash, shares, prices = numpy.array(fills, dtype='i8').reshape(count, 5).T
+        self.grow(int(traders.max()) + 1, int(symbols.max()) + 1)
+        numpy.add.at(self.balances, traders, cash)
+        numpy.add.at(self.positions, (traders, symbols), shares)
+        last = count - 1 - numpy.unique(symbols[::-1], return_index=True)[1]  # each symbol's last fill
+        self.last_prices[symbols[last]] = prices[last]
+
+    def load(self, balances, traders, symbols, shares, marks=None):
+        # Replace the ledger with restored columns: the balance of every trader, the nonzero positions
+        # as (trader, symbol column, shares) and marks, symbol column -> price ticks of its last fill
+        # (the columns left out start at 0).
+        numpy = self.numpy
+        self.fills = []
+        self.traders = 0
+        self.balances = numpy.zeros(0, dtype='i8')
+        self.positions = numpy.zeros((0, 0), dtype='i8')
+        self.last_prices = numpy.zeros(0, dtype='i8')
+        self.grow(len(balances), max(len(self.symbols), 4))
+        self.balances[:len(balances)] = balances
+        self.positions[numpy.asarray(traders, dtype='i8'), numpy.asarray(symbols, dtype='i8')] = shares
+        for symbol, price in (marks or {}).items():
+            self.last_prices[symbol] = price
+
+    def balance(self, trader):
+        self.settle()
+        return int(self.balances[trader]) if trader < self.traders else self.initial_balance
+
+    def position(self, trader):
+        # symbol -> shares of one trader, the symbols it holds or owes
+        self.settle()
+        if trader >= self.traders:
+            return {}
+        return {symbol: shares for symbol, shares in zip(self.symbols, self.positions[trader].tolist()) if shares}
+
+    def shares(self, trader, symbol):
+        # one trader's shares of one symbol column
+        self.settle()
+        rows, columns = self.positions.shape
+        return int(self.positions[trader, symbol]) if trader < rows and symbol < columns else 0
+
+    def cash(self):
+        # all traders' cash together
+        self.settle()
+        return int(self.balances[:self.traders].sum())
+
+    def holdings(self):
+        # the settled (traders x symbols) position matrix
+        self.settle()
+        return self.positions[:self.traders, :len(self.symbols)]
+
+    def marks(self):
+        # price ticks of every symbol's last fill, the default marks of the methods below
+        self.settle()
+        return self.last_prices[:len(self.symbols)]
+
+    def mark_to_market(self, marks=None):
+        # value of every trader's positions in minor units, marks are price ticks per symbol column
+        holdings = self.holdings()
+        return holdings @ (self.marks() if marks is None else self.numpy.asarray(marks, dtype='i8')) * self.tick_value
+
+    def equity(self, marks=None):
+        # cash plus marked positions of every trader, in minor units
+        return self.balances[:self.traders] + self.mark_to_market(marks)
+
+    def exposure(self, marks=None):
+        # (gross, net) marked exposure of every trader in minor units
+        holdings = self.holdings()
+        values = (self.marks() if marks is None else self.numpy.asarray(marks, dtype='i8')) * self.tick_value
+        return self.numpy.abs(holdings) @ values, holdings @ values
+
+    def conserved(self):
+        # every fill moves cash and shares between two traders, so the cash total stays what the traders
+        # started with and the shares of every symbol net out to zero
+        return self.cash() == self.initial_balance * self.traders and not self.holdings().sum(axis=0).any()
@@ -0,0 +1,251 @@
+# Order types, the order classes and the exceptions shared by the engine, the exchange and the traders
+
+from abc import ABC
+from collections import namedtuple
+from enum import Enum
+
+
+class OrderType(Enum):
+    LIMIT = 1
+    MARKET = 2
+    IOC = 3
+    STOP = 4
+    STOP_LIMIT = 5
+    FOK = 6
+
+
+# How long a limit order may rest: until it fills or is cancelled (GTC), until the exchange ends the trading
+# day (DAY), or until the exchange clock reaches its expire_time (GTT, good till time)
+class TimeInForce(Enum):
+    GTC = 0
+    DAY = 1
+    GTT = 2
+
+
+class OrderSide(Enum):
+    BUY = 1
+    SELL = 2
+
+
+class NonPositiveQuantity(Exception):
+    pass
+
+
+class NonPositivePrice(Exception):
+    pass
+
+
+class InvalidSide(Exception):
+    pass
+
+
+class UndefinedOrderType(Exception):
+    pass
+
+
+class UndefinedOrderSide(Exception):
+    pass
+
+
+class NewQuantityNotSmaller(Exception):
+    pass
+
+
+class UndefinedTraderAction(Exception):
+    pass
+
+
+class UndefinedResponse(Exception):
+    pass
+
+
+class PriceNotOnTick(Exception):
+    pass
+
+
+class QuantityNotInLots(Exception):
+    pass
+
+
+class MissingParams(Exception):
+    pass
+
+
+class RiskLimitExceeded(Exception):
+    pass
+
+
+class StaleOrderHandle(Exception):
+    pass
+
+
+# Each trader can take a separate action chosen from the list below:
+
+# Actions:
+# 1 - Place New Order/Order Filled
+# 2 - Amend Quantity Of An Existing Order
+# 3 - Cancel An Existing Order
+# 4 - Return Balance And Position
+# 5 - Order Rejected (a response only, the order failed the exchange's pre-trade risk checks)
+# 6 - Order Accepted (a response only, carries the order id the exchange gave the new order)
+# 7 - Cancel All Open Orders Of The Trader, optionally of one symbol and / or side
+# 8 - Disconnect (the exchange cancels the trader's open orders unless cancel_on_disconnect is off)
+# 9 - End Of Day (the exchange's own request, (OrderActions.End_Of_Day,), cancels every resting day order)
+
+# request - (Action #, Trader ID, Additional Arguments)
+
+# result - (Action #, Action Return)
+
+# Every order carries its symbol and the exchange routes it to that symbol's own matching engine.
+# Amend and cancel requests name the symbol of the order they refer to and optionally its order id,
+# without one they refer to the trader's newest open order in that symbol.
+
+DEFAULT_SYMBOL = 'AAPL'
+
+
+class OrderActions(Enum):
+    Place = 1
+    Amend = 2
+    Cancel = 3
+    Return_Balance_And_Position = 4
+    Reject = 5
+    Ack = 6
+    Cancel_All = 7
+    Disconnect = 8
+    End_Of_Day = 9
+
+
+class Order(ABC):
+    # Orders use __slots__ instead of a per-instance __dict__, a deep book holds millions of them.
+    # level / prev_order / next_order are only set while the order rests in a PriceLevel.
+    # id is the trader's, order_id the order's own: the id until an exchange stamps a unique one.
+    __slots__ = ('id', 'order_id', 'symbol', 'quantity', 'side', 'time', 'wall', 'level', 'prev_order', 'next_order')
+    peak = 0  # the displayed slice of an iceberg order, 0 shows the whole quantity
+    reserve = 0  # the hidden quantity of a resting iceberg order, not part of quantity
+
+    def __init__(self, id, symbol, quantity, side, time):
+        self.id = id
+        self.order_id = id
+        self.symbol = symbol
+        if quantity > 0:
+            self.quantity = quantity
+        else:
+            raise NonPositiveQuantity("Quantity Must Be Positive!")
+        if side in [OrderSide.BUY, OrderSide.SELL]:
+            self.side = side
+        else:
+            raise InvalidSide("Side Must Be Either \"Buy\" or \"OrderSide.SELL\"!")
+        self.time = time
+        self.wall = 0  # arrival wall stamp for the exchange's order latency, set by an exchange with a wall_clock
+
+
+class LimitOrder(Order):
+    # expire_time is a value of the exchange clock, the one that stamps the orders' time
+    __slots__ = ('price', 'time_in_force', 'expire_time')
+    type = OrderType.LIMIT
+
+    def __init__(self, id, symbol, quantity, price, side, time, time_in_force=TimeInForce.GTC, expire_time=None):
+        super().__init__(id, symbol, quantity, side, time)
+        if price > 0:
+            self.price = price
+        else:
+            raise NonPositivePrice("Price Must Be Positive!")
+        if time_in_force == TimeInForce.GTT and expire_time is None:
+            raise MissingParams("Good Till Time Orders Need An Expire Time!")
+        self.time_in_force = time_in_force
+        self.expire_time = expire_time
+
+
+class MarketOrder(Order):
+    __slots__ = ()
+    type = OrderType.MARKET
+
+    def __init__(self, id, symbol, quantity, side, time):
+        super().__init__(id, symbol, quantity, side, time)
+
+
+# An iceberg order trades its whole quantity when it arrives, but rests showing at most `peak` of it: the
+# rest is a hidden reserve. Each time the displayed slice trades away the next one is taken from the reserve
+# and goes to the back of its price level.
+
+class IcebergOrder(LimitOrder):
+    __slots__ = ('peak', 'reserve')
+
+    def __init__(self, id, symbol, quantity, price, peak, side, time, time_in_force=TimeInForce.GTC,
+                 expire_time=None):
+        super().__init__(id, symbol, quantity, price, side, time, time_in_force, expire_time)
+        if peak > 0:
+            self.peak = peak
+        else:
+            raise NonPositiveQuantity("Peak Must Be Positive!")
+        self.reserve = 0
+
+
+# Stop orders wait off the book until a trade prints at or through their stop price (at or above it for a
+# buy, at or below for a sell), then go in as a market order, or a limit order at `price` for a stop limit.
+
+class StopOrder(Order):
+    __slots__ = ('stop_price',)
+    type = OrderType.STOP
+
+    def __init__(self, id, symbol, quantity, stop_price, side, time):
+        super().__init__(id, symbol, quantity, side, time)
+        if stop_price > 0:
+            self.stop_price = stop_price
+        else:
+            raise NonPositivePrice("Stop Price Must Be Positive!")
+
+
+class StopLimitOrder(LimitOrder):
+    __slots__ = ('stop_price',)
+    type = OrderType.STOP_LIMIT
+
+    def __init__(self, id, symbol, quantity, stop_price, price, side, time):
+        super().__init__(id, symbol, quantity, price, side, time)
+        if stop_price > 0:
+            self.stop_price = stop_price
+        else:
+            raise NonPositivePrice("Stop Price Must Be Positive!")
+
+
+class IOCOrder(Order):
+    __slots__ = ('price',)
+    type = OrderType.IOC
+
+    def __init__(self, id, symbol, quantity, price, side, time):
+        super().__init__(id, symbol, quantity, side, time)
+        if price > 0:
+            self.price = price
+        else:
+            raise NonPositivePrice("Price Must Be Positive!")
+
+
+# Fill or kill: trades its whole quantity at once at its price or better, or is cancelled without trading
+class FOKOrder(IOCOrder):
+    __slots__ = ()
+    type = OrderType.FOK
+
+
+class FilledOrder(Order):
+    __slots__ = ('price', 'limit')
+
+    def __init__(self, id, symbol, quantity, price, side, time, limit=False, order_id=None):
+        super().__init__(id, symbol, quantity, side, time)
+        self.price = price
+        self.limit = limit
+        if order_id is not None:
+            self.order_id = order_id
+
+
+# An execution as reported to a trader, (OrderActions.Place, Fill): a plain tuple with the FilledOrder
+# field names, the price in currency units. MatchingEngine reports its trades as Fill tuples too, priced
+# as its orders are.
+Fill = namedtuple('Fill', ['id', 'symbol', 'quantity', 'price', 'side', 'time', 'limit', 'order_id'])
+
+# A new order the exchange turned away, (OrderActions.Reject, Reject): the order is not on the books
+Reject = namedtuple('Reject', ['id', 'order_id', 'symbol', 'reason'])
+
+# A new order the exchange took, (OrderActions.Ack, Ack), sent before its fills: order_id is what
+# amend and cancel requests name it by. (OrderActions.Cancel, Ack) tells a trader that the exchange
+# cancelled one of its good-till-time or day orders when it expired.
+Ack = namedtuple('Ack', ['id', 'order_id', 'symbol'])
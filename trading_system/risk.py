@@ -0,0 +1,103 @@
+# Pre-trade risk: the checks a new order has to pass before the exchange hands it to the matching engine.
+# RiskEngine keeps running aggregates of every trader's resting orders, updated on every fill, cancel and
+# amend, so a check is a few dict lookups however many orders the trader has on the books. Quantities are
+# shares, prices integer ticks and cash integer minor units, as inside the Exchange.
+
+from .orders import OrderSide, OrderType, RiskLimitExceeded
+
+
+class RiskLimits():
+    # None leaves a limit unchecked. max_open_notional is in currency units, like the prices traders send.
+    # buying_power rejects buys whose cost, with the trader's resting buys, is more than its balance.
+
+    def __init__(self, max_order_quantity=None, max_open_notional=None, max_position=None, buying_power=True):
+        self.max_order_quantity = max_order_quantity
+        self.max_open_notional = max_open_notional
+        self.max_position = max_position
+        self.buying_power = buying_power
+
+
+class RiskEngine():
+
+    def __init__(self, limits, tick_value=1, cash_scale=100):
+        self.limits = limits
+        self.tick_value = tick_value  # minor units per share per tick
+        self.max_open_notional = None if limits.max_open_notional is None else \
+            round(limits.max_open_notional * cash_scale)
+        # (trader, symbol column, side) -> [shares, notional in ticks x shares] of the trader's resting orders
+        self.resting = {}
+        self.open_notional = {}  # trader -> notional of all its resting orders
+        self.open_buy_notional = {}  # trader -> notional of its resting buys, the cash they may still take
+
+    def check(self, order, symbol, price, balance, position):
+        # Raise RiskLimitExceeded if `order` may not go to the engine. price is the order's price in ticks,
+        # an estimate for market orders, balance and position the trader's cash and shares of the symbol.
+        limits = self.limits
+        trader = order.id
+        quantity = order.quantity
+        if limits.max_order_quantity is not None and quantity > limits.max_order_quantity:
+            raise RiskLimitExceeded("Order Quantity Exceeds The Limit!")
+        notional = quantity * price
+        if self.max_open_notional is not None and \
+                (self.open_notional.get(trader, 0) + notional) * self.tick_value > self.max_open_notional:
+            raise RiskLimitExceeded("Open Notional Exceeds The Limit!")
+        # the position is checked as if every resting order of the trader on that side traded as well
+        resting = self.resting.get((trader, symbol, order.side))
+        resting_quantity = resting[0] if resting is not None else 0
+        if order.side == OrderSide.BUY:
+            if limits.max_position is not None and position + resting_quantity + quantity > limits.max_position:
+                raise RiskLimitExceeded("Position Exceeds The Limit!")
+            if limits.buying_power and \
+                    (self.open_buy_notional.get(trader, 0) + notional) * self.tick_value > balance:
+                raise RiskLimitExceeded("Insufficient Buying Power!")
+        elif limits.max_position is not None and position - resting_quantity - quantity < -limits.max_position:
+            raise RiskLimitExceeded("Position Exceeds The Limit!")
+
+    def rest(self, order, symbol, price):
+        # the remaining quantity of `order`, an iceberg's hidden reserve included, went on the books at `price` ticks
+        self.rest_shares(order.id, symbol, order.side, order.quantity + order.reserve, price)
+
+    def rest_shares(self, trader, symbol, side, quantity, price):
+        # `quantity` shares of trader's orders on `side` rest at `price` ticks, e.g. read off a snapshot's columns
+        key = (trader, symbol, side)
+        notional = quantity * price
+        resting = self.resting.get(key)
+        if resting is None:
+            self.resting[key] = [quantity, notional]
+        else:
+            resting[0] += quantity
+            resting[1] += notional
+        self.open_notional[trader] = self.open_notional.get(trader, 0) + notional
+        if side == OrderSide.BUY:
+            self.open_buy_notional[trader] = self.open_buy_notional.get(trader, 0) + notional
+
+    def release(self, trader, symbol, side, quantity, price=None):
+        # `quantity` shares of a resting order traded, were cancelled or amended away. A price of None
+        # (resting market orders) releases at the average price of the trader's resting orders on that side.
+        key = (trader, symbol, side)
+        resting = self.resting.get(key)
+        if resting is None:
+            return
+        if quantity >= resting[0]:
+            notional = resting[1]  # the last shares on that side take whatever is left, so no rounding builds up
+            del self.resting[key]
+        else:
+            notional = quantity * price if price is not None else quantity * resting[1] // resting[0]
+            resting[0] -= quantity
+            resting[1] -= notional
+        self.open_notional[trader] -= notional
+        if side == OrderSide.BUY:
+            self.open_buy_notional[trader] -= notional
+
+    def release_order(self, order, symbol, quantity=None):
+        # a resting order was cancelled (all of it) or amended down by `quantity`. Pending stops are not
+        # counted until they trigger, so there is nothing to release for them.
+        if order.type == OrderType.STOP or order.type == OrderType.STOP_LIMIT:
+            return
+        self.release(order.id, symbol, order.side, order.quantity + order.reserve if quantity is None else quantity,
+                     order.price if order.type == OrderType.LIMIT else None)
+
+    def clear(self):
+        self.resting.clear()
+        self.open_notional.clear()
+        self.open_buy_notional.clear()
@@ -0,0 +1,181 @@
+# Sharded execution of the symbol -> engine map in worker processes. This module is what a worker
+# process imports, multiprocessing itself is only imported where a pool or worker is started.
+
+import struct
+import zlib
+
+from .engine import MatchingEngine
+from .orders import FOKOrder, IcebergOrder, IOCOrder, LimitOrder, MarketOrder, NewQuantityNotSmaller, \
+    NonPositiveQuantity, OrderActions, OrderSide, OrderType, StopLimitOrder, StopOrder, TimeInForce
+
+
+def shard_of(symbol, shards):
+    # A stable hash, unlike hash() which is salted per process, so every worker process agrees
+    # on which shard of the symbol -> engine map a symbol belongs to
+    return zlib.crc32(symbol.encode()) % shards
+
+
+# Sharded execution: each shard of the symbol -> engine map runs in its own worker process with its own
+# MatchingEngines. Requests and results cross the process boundary in batches of fixed-width records
+# written into a pair of shared memory buffers per worker; the pipe only carries record counts.
+# A symbol always lives in one worker and its requests are processed in arrival order, so the fills
+# of every symbol are the same as in a single process run.
+
+# action, order type (requests) / limit flag or result (results), side, symbol index, trader id, order id,
+# quantity, price ticks, stop price ticks, time, expire time. An order id of 0 names the trader's newest order, a mass
+# cancel of symbol index -1 covers every book of the worker and its result carries the number of cancelled orders as
+# quantity. A limit order keeps its time in force in the high bits of the order type and its iceberg peak (0 for none)
+# in the stop price field, an order the worker expired comes back as a cancel result with its side set, as does what
+# an IOC or FOK order could not trade.
+RECORD = struct.Struct('<bbbxiqqqqqdd')
+
+
+def expired_records(symbol, orders):
+    return [RECORD.pack(OrderActions.Cancel.value, True, order.side.value, symbol, order.id, order.order_id,
+                        order.quantity, 0, 0, order.time, 0) for order in orders]
+
+
+def shard_worker(conn, requests_name, results_name, capacity):
+    from multiprocessing import shared_memory
+    requests_memory = shared_memory.SharedMemory(name=requests_name)
+    results_memory = shared_memory.SharedMemory(name=results_name)
+    engines = {}  # symbol index -> MatchingEngine
+    trader_symbols = {}  # trader id -> the symbol indices it may have open orders in, as Exchange.trader_symbols
+    while True:
+        count = conn.recv()
+        if count is None:
+            break
+        results = []
+        now = None  # the stamp of the batch's last new order, the other books expire by it at the end
+        for action, kind, side, symbol, id, order_id, quantity, price, stop, stamp, expire in RECORD.iter_unpack(
+                bytes(requests_memory.buf[:count * RECORD.size])):
+            if action == OrderActions.End_Of_Day.value:
+                for book_symbol, engine in engines.items():
+                    results.extend(expired_records(book_symbol, engine.end_day()))
+                continue
+            if action == OrderActions.Cancel_All.value or action == OrderActions.Disconnect.value:
+                cancelled = 0
+                symbols = trader_symbols.get(id, ())
+                for book_symbol in (list(symbols) if symbol == -1 else [symbol] if symbol in symbols else []):
+                    engine = engines[book_symbol]
+                    cancelled += len(engine.cancel_all(id, OrderSide(side) if side else None))
+                    if id not in engine.open_orders:
+                        symbols.discard(book_symbol)
+                results.append(RECORD.pack(action, 0, 0, symbol, id, 0, cancelled, 0, 0, stamp, 0))
+                continue
+            engine = engines.get(symbol)
+            if engine is None:
+                engine = engines[symbol] = MatchingEngine()
+            if action == OrderActions.Place.value:
+                now = stamp
+                trader_symbols.setdefault(id, set()).add(symbol)
+                if engine.expiries and engine.expiries[0][0] <= stamp:
+                    results.extend(expired_records(symbol, engine.expire_orders(stamp)))
+                if kind & 15 == OrderType.LIMIT.value:
+                    time_in_force = TimeInForce(kind >> 4)
+                    if stop:
+                        order = IcebergOrder(id, symbol, quantity, price, stop, OrderSide(side), stamp, time_in_force,
+                                             expire if time_in_force is TimeInForce.GTT else None)
+                    else:
+                        order = LimitOrder(id, symbol, quantity, price, OrderSide(side), stamp, time_in_force,
+                                           expire if time_in_force is TimeInForce.GTT else None)
+                elif kind == OrderType.MARKET.value:
+                    order = MarketOrder(id, symbol, quantity, OrderSide(side), stamp)
+                elif kind == OrderType.STOP.value:
+                    order = StopOrder(id, symbol, quantity, stop, OrderSide(side), stamp)
+                elif kind == OrderType.STOP_LIMIT.value:
+                    order = StopLimitOrder(id, symbol, quantity, stop, price, OrderSide(side), stamp)
+                elif kind == OrderType.FOK.value:
+                    order = FOKOrder(id, symbol, quantity, price, OrderSide(side), stamp)
+                else:
+                    order = IOCOrder(id, symbol, quantity, price, OrderSide(side), stamp)
+                order.order_id = order_id
+                for filled_order in engine.handle_order(order):
+                    results.append(RECORD.pack(action, filled_order.limit, filled_order.side.value, symbol,
+                                               filled_order.id, filled_order.order_id, filled_order.quantity,
+                                               filled_order.price, 0, filled_order.time, 0))
+                if order.quantity and (kind == OrderType.IOC.value or kind == OrderType.FOK.value):
+                    results.extend(expired_records(symbol, [order]))  # the quantity it could not trade
+            else:
+                order = engine.trader_order(id, order_id or None)
+                try:
+                    if order is None:
+                        result = False
+                    elif action == OrderActions.Amend.value:
+                        result = engine.amend_quantity(order.order_id, quantity)
+                    else:
+                        result = engine.cancel_order(order.order_id)
+                except (NewQuantityNotSmaller, NonPositiveQuantity):
+                    result = False
+                results.append(RECORD.pack(action, result, 0, symbol, id, order_id, quantity, 0, 0, stamp, 0))
+        if now is not None:
+            for book_symbol, engine in engines.items():
+                if engine.expiries and engine.expiries[0][0] <= now:
+                    results.extend(expired_records(book_symbol, engine.expire_orders(now)))
+        # results are handed back capacity records at a time, the parent acknowledges every full buffer
+        for start in range(0, max(len(results), 1), capacity):
+            chunk = b''.join(results[start:start + capacity])
+            results_memory.buf[:len(chunk)] = chunk
+            more = start + capacity < len(results)
+            conn.send((len(chunk) // RECORD.size, more))
+            if more:
+                conn.recv()
+    requests_memory.close()
+    results_memory.close()
+
+
+class ShardPool():
+
+    def __init__(self, shards, capacity=4096):
+        import multiprocessing
+        from multiprocessing import shared_memory
+        self.capacity = capacity
+        self.workers = []
+        for _ in range(shards):
+            requests_memory = shared_memory.SharedMemory(create=True, size=capacity * RECORD.size)
+            results_memory = shared_memory.SharedMemory(create=True, size=capacity * RECORD.size)
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=shard_worker, daemon=True,
+                                              args=(worker_conn, requests_memory.name, results_memory.name, capacity))
+            process.start()
+            worker_conn.close()  # a dead worker then shows up as EOFError instead of a hang
+            self.workers.append((process, conn, requests_memory, results_memory))
+        self.pending = [[] for _ in range(shards)]  # packed request records waiting for the next flush
+
+    def submit(self, shard, record):
+        self.pending[shard].append(record)
+
+    def flush(self):
+        # Send every pending batch, then collect. All workers match their batches at the same time.
+        # Returns the result records of each shard, in the order the shard produced them.
+        results = [[] for _ in self.workers]
+        while any(self.pending):
+            busy = []
+            for shard, (process, conn, requests_memory, results_memory) in enumerate(self.workers):
+                batch = self.pending[shard][:self.capacity]
+                if not batch:
+                    continue
+                del self.pending[shard][:self.capacity]
+                chunk = b''.join(batch)
+                requests_memory.buf[:len(chunk)] = chunk
+                conn.send(len(batch))
+                busy.append(shard)
+            for shard in busy:
+                process, conn, requests_memory, results_memory = self.workers[shard]
+                more = True
+                while more:
+                    count, more = conn.recv()
+                    results[shard].extend(RECORD.iter_unpack(bytes(results_memory.buf[:count * RECORD.size])))
+                    if more:
+                        conn.send(True)
+        return results
+
+    def close(self):
+        for process, conn, requests_memory, results_memory in self.workers:
+            conn.send(None)
+            process.join()
+            conn.close()
+            for memory in (requests_memory, results_memory):
+                memory.close()
+                memory.unlink()
+        self.workers = []
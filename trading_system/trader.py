@@ -0,0 +1,336 @@
+# The simulated traders and the generated order flow used for load testing
+
+from collections import defaultdict
+from random import choice
+
+from .exchange import MyThread, exchange_to_trader, trader_to_exchange
+from .orders import DEFAULT_SYMBOL, FOKOrder, IcebergOrder, IOCOrder, LimitOrder, MarketOrder, MissingParams, \
+    OrderActions, OrderSide, OrderType, StopLimitOrder, StopOrder, TimeInForce, UndefinedResponse
+
+
+# The trader needs to continue to take actions until the book balance falls to 0
+# While the trader can take actions, it chooses from a random_action and uploads the action
+# to the exchange
+# The trader then takes any received responses from the exchange and processes it
+
+class Trader(MyThread):
+    def __init__(self, id, symbols=(DEFAULT_SYMBOL,)):
+        super().__init__(id)
+        self.symbols = list(symbols)
+        self.send = trader_to_exchange.append  # where requests go, run_session() points it at an asyncio.Queue
+        self.book_position = defaultdict(int)  # symbol -> shares held
+        self.last_order_id = {}  # symbol -> order id of the trader's newest order the exchange acknowledged
+        self.balance_track = [1000000] # a track?
+        # the traders each start with a balance of 1,000,000 and nothing on the books
+        # each trader is a thread
+
+        # Make sure the limit order given has the parameters necessary to construct the order
+        # It's your choice how to implement the orders that do not have enough information
+        # The 'order' returned must be of type LimitOrder
+        # Make sure you modify the book position after the trade
+        # You must return a tuple of the following:
+        # (the action type enum, the id of the trader, and the order to be executed)
+
+    # The orders' time is left at 0, the exchange stamps them with its clock and a unique order id on arrival
+
+    def place_limit_order(self, quantity=None, price=None, side=None, symbol=None, time_in_force=TimeInForce.GTC,
+                          expire_time=None, peak=None):
+        # a day order rests until the exchange ends the day, a good-till-time one until its exchange clock expire_time.
+        # With a peak the order is an iceberg showing at most that much of its quantity on the book.
+        if peak is None:
+            new_order = LimitOrder(self.id, symbol=symbol or self.symbols[0], quantity=quantity, price=price, side=side,
+                                   time=0, time_in_force=time_in_force, expire_time=expire_time)
+        else:
+            new_order = IcebergOrder(self.id, symbol or self.symbols[0], quantity, price, peak, side, 0, time_in_force,
+                                     expire_time)
+        if new_order.quantity == None:
+            raise MissingParams('Undefined Quantity!')
+        if new_order.price == None:
+            raise MissingParams('Undefined Price!')
+        if new_order.side == None:
+            raise MissingParams('Undefined Side!')
+
+        self.send((OrderType.LIMIT, new_order.id, new_order))
+
+    def place_market_order(self, quantity=None, side=None, symbol=None):
+
+        market_order = MarketOrder(self.id, symbol or self.symbols[0], quantity, side, time=0)
+
+        if market_order.quantity == None:
+            raise MissingParams('Undefined Quantity!')
+        if market_order.side == None:
+            raise MissingParams('Undefined Side!')
+
+        self.send((OrderType.MARKET, market_order.id, market_order))
+
+    def place_ioc_order(self, quantity=None, price=None, side=None, symbol=None):
+
+        ioc_order = IOCOrder(self.id, symbol or self.symbols[0], quantity, price, side, time=0)
+        if ioc_order.quantity == None:
+            raise MissingParams('Undefined Quantity!')
+        if ioc_order.price == None:
+            raise MissingParams('Undefined Price!')
+        if ioc_order.side == None:
+            raise MissingParams('Undefined Side!')
+
+        self.send((ioc_order.type, ioc_order.id, ioc_order))
+
+    def place_fok_order(self, quantity=None, price=None, side=None, symbol=None):
+        # a fill or kill order, all of the quantity trades at once or none of it
+        if quantity == None:
+            raise MissingParams('Undefined Quantity!')
+        if price == None:
+            raise MissingParams('Undefined Price!')
+        if side == None:
+            raise MissingParams('Undefined Side!')
+        fok_order = FOKOrder(self.id, symbol or self.symbols[0], quantity, price, side, time=0)
+
+        self.send((fok_order.type, fok_order.id, fok_order))
+
+    def place_stop_order(self, quantity=None, stop_price=None, side=None, symbol=None, limit_price=None):
+        # a stop order, a stop limit order if limit_price is given
+        if quantity == None:
+            raise MissingParams('Undefined Quantity!')
+        if stop_price == None:
+            raise MissingParams('Undefined Stop Price!')
+        if side == None:
+            raise MissingParams('Undefined Side!')
+        if limit_price is None:
+            stop_order = StopOrder(self.id, symbol or self.symbols[0], quantity, stop_price, side, time=0)
+        else:
+            stop_order = StopLimitOrder(self.id, symbol or self.symbols[0], quantity, stop_price, limit_price, side,
+                                        time=0)
+
+        self.send((stop_order.type, stop_order.id, stop_order))
+
+    def amend_quantity(self, quantity=None, symbol=None, order_id=None):
+        # It's your choice how to implement the 'Amend' action where quantity is not given
+        if quantity == None:
+            raise MissingParams('The Quantity is not given!')
+        # (the action type enum, the id of the trader, quantity to change the order by, the symbol and the
+        # order id, by default that of the trader's newest order in the symbol the exchange acknowledged)
+        symbol = symbol or self.symbols[0]
+        self.send((OrderActions.Amend, self.id, quantity, symbol,
+                   order_id if order_id is not None else self.last_order_id.get(symbol)))
+
+    def cancel_order(self, symbol=None, order_id=None):
+        symbol = symbol or self.symbols[0]
+        self.send((OrderActions.Cancel, self.id, symbol,
+                   order_id if order_id is not None else self.last_order_id.get(symbol)))
+
+    def cancel_all(self, symbol=None, side=None):
+        # every open order of the trader, or those of one symbol and / or side
+        self.send((OrderActions.Cancel_All, self.id, symbol, side))
+
+    def disconnect(self):
+        self.send((OrderActions.Disconnect, self.id))
+
+    def balance_and_position(self):
+        self.send((OrderActions.Return_Balance_And_Position,self.id))
+
+    def process_response(self, response):
+        # Implement this function
+        # the response could be in the following formats
+        # 1. (OrderActions.Place,order) from Exchange.place_new_order()
+        # 2. (OrderActions.Amend, result) from Exchange.amend_quantity()
+        # 3. (OrderActions.Cancel,result) from Exchange.cancel_order(), or (OrderActions.Cancel, Ack) when the
+        #    exchange cancelled an expired good-till-time or day order of the trader, the quantity an IOC order
+        #    could not trade or a killed FOK order
+        # 4. (OrderActions.Return_Balance_And_Position,(self.balance[id], self.position[id])) from Exchange.return_cash_and_position()
+        # 5. (OrderActions.Reject, Reject) when the order failed the exchange's pre-trade risk checks, or its price
+        #    is off the tick or its quantity not in lots (an amendment's quantity too)
+        # 6. (OrderActions.Ack, Ack) when the exchange took a new order, before its fills
+        # 7. (OrderActions.Cancel_All, orders cancelled) from Exchange.cancel_all()
+        # 8. (OrderActions.Disconnect, orders cancelled) from Exchange.disconnect()
+
+        # A Place response carries a Fill, the trader's share of one execution
+        if response[0] == OrderActions.Place:
+            fill = response[1]
+            if fill.side == OrderSide.BUY:
+                self.book_position[fill.symbol] += fill.quantity
+                self.balance_track.append(self.balance_track[-1] - fill.price * fill.quantity)
+            else:
+                self.book_position[fill.symbol] -= fill.quantity
+                self.balance_track.append(self.balance_track[-1] + fill.price * fill.quantity)
+        elif response[0] == OrderActions.Amend:
+            if response[1]:
+                print('Order Quantity Amendment Successful!')
+        elif response[0] == OrderActions.Cancel:
+            if response[1]:
+                print('Order Cancellation Successful!')
+        elif response[0] == OrderActions.Return_Balance_And_Position:
+            print('The balance is:',response[1][0], ', The position is:',response[1][1])
+        elif response[0] == OrderActions.Reject:
+            print('Order Rejected: ' + response[1].reason)
+        elif response[0] == OrderActions.Ack:
+            self.last_order_id[response[1].symbol] = response[1].order_id
+        elif response[0] == OrderActions.Cancel_All or response[0] == OrderActions.Disconnect:
+            if response[1]:
+                print('Orders Cancelled: ' + str(response[1]))
+        else:
+            raise UndefinedResponse("Undefined Response Received!")
+
+    def random_action(self):
+
+        symbol = choice(self.symbols)
+        if self.book_position[symbol] == 0:
+            self.place_limit_order(10,5,OrderSide.BUY,symbol)
+
+        action_list = [1,2,3,4]
+        result = choice(action_list)
+        if result == 1:
+            self.place_limit_order(10,10,OrderSide.BUY,symbol) # a sample order
+        elif result == 2:
+            self.balance_and_position()
+        elif result == 3:
+            self.cancel_order(symbol)
+        else:
+            self.place_limit_order(10,1,OrderSide.SELL,symbol)
+
+    # Implement this function
+    # According to the status of whether you have a position on the book and the action chosen
+    # the trader needs to be able to take a separate action
+    # The action taken can be random or deterministic, your choice
+
+    def run_infinite_loop(self):
+
+        while exchange_to_trader[self.id]:
+            response = exchange_to_trader[self.id].popleft()
+            if response:
+                self.process_response(response)
+
+        while self.balance_track[-1] > 0:
+            print(self.balance_track[-1])  # the whole track grows with every fill
+            self.random_action()
+            while exchange_to_trader[self.id]:
+                response = exchange_to_trader[self.id].popleft()
+                if response:
+                    self.process_response(response)
+            break
+
+    async def run_async(self, inbox, actions=10000):
+        import asyncio
+
+        # The coroutine version of run_infinite_loop: act until the balance runs out (or `actions` is used up),
+        # yield to the exchange after every action and process whatever came back in the inbox queue.
+        # The trader disconnects when it is done, which takes its open orders off the books.
+        for _ in range(actions):
+            if self.balance_track[-1] <= 0:
+                break
+            self.random_action()
+            await asyncio.sleep(0)
+            while not inbox.empty():
+                response = inbox.get_nowait()
+                if response:
+                    self.process_response(response)
+        self.disconnect()
+
+
+# Generated order flow for load testing. FlowGenerator draws whole chunks of requests at once with NumPy
+# (an optional dependency, imported when a generator is made): Poisson arrivals at `rate` requests per
+# second, a random walk mid price per symbol (`volatility` ticks per square root second), limit and IOC
+# prices normally spread `spread` ticks around the mid, geometric quantities in lots and a limit / market /
+# IOC / cancel / amend mix over `traders` traders. chunks() yields structured arrays of at most chunk_size
+# requests, so any number of requests can be streamed; requests() turns a chunk into the exchange's request
+# tuples lazily, one order object at a time. requests() numbers the new orders as an exchange that takes the
+# flow from order id `first_order_id` on will, so each cancel and amend names its trader's latest limit order
+# in the symbol by its order id (None before the trader has one there); the chunks go through it once, in order.
+
+class FlowGenerator():
+
+    KINDS = ('limit', 'market', 'ioc', 'cancel', 'amend')
+    DTYPE = [('kind', 'i1'), ('side', 'i1'), ('symbol', 'i2'), ('trader', 'i4'), ('price', 'i8'),
+             ('quantity', 'i8'), ('time', 'f8')]
+
+    def __init__(self, traders=100, symbols=(DEFAULT_SYMBOL,), mix=None, rate=100000.0, mid=10000, volatility=1.0,
+                 spread=5.0, quantity=10, lot_size=1, tick_size=0.01, seed=None, chunk_size=1 << 16, first_order_id=1):
+        import numpy
+        self.numpy = numpy
+        mix = mix if mix is not None else {'limit': 0.6, 'market': 0.05, 'ioc': 0.05, 'cancel': 0.2, 'amend': 0.1}
+        if set(mix) - set(FlowGenerator.KINDS):
+            raise ValueError("Unknown Request Kind In The Mix!")
+        weights = numpy.array([mix.get(kind, 0.0) for kind in FlowGenerator.KINDS])
+        self.probabilities = weights / weights.sum()
+        self.rng = numpy.random.default_rng(seed)
+        self.traders = traders
+        self.symbols = list(symbols)
+        self.rate = rate
+        self.volatility = volatility
+        self.spread = spread
+        self.quantity = quantity
+        self.lot_size = lot_size
+        self.tick_size = tick_size
+        self.chunk_size = chunk_size
+        self.mids = numpy.full(len(self.symbols), float(mid))  # the walks carry over from chunk to chunk
+        self.last_times = numpy.zeros(len(self.symbols))
+        self.clock = 0.0
+        self.next_order_id = first_order_id
+        self.latest_orders = {}  # (trader, symbol index) -> order id of its latest limit order
+
+    def chunk(self, size):
+        numpy, rng = self.numpy, self.rng
+        requests = numpy.empty(size, dtype=FlowGenerator.DTYPE)
+        requests['kind'] = rng.choice(len(FlowGenerator.KINDS), size, p=self.probabilities)
+        requests['side'] = rng.integers(1, 3, size)  # OrderSide values
+        symbols = rng.integers(0, len(self.symbols), size)
+        requests['symbol'] = symbols
+        requests['trader'] = rng.integers(0, self.traders, size)
+        times = self.clock + numpy.cumsum(rng.exponential(1.0 / self.rate, size))
+        requests['time'] = times
+        self.clock = float(times[-1])
+
+        # each symbol's mid moves by its own random walk between that symbol's requests
+        mids = numpy.empty(size)
+        for symbol in range(len(self.symbols)):
+            where = numpy.flatnonzero(symbols == symbol)
+            if not len(where):
+                continue
+            gaps = numpy.diff(times[where], prepend=self.last_times[symbol])
+            walk = self.mids[symbol] + numpy.cumsum(rng.normal(0.0, self.volatility, len(where)) * numpy.sqrt(gaps))
+            numpy.maximum(walk, 1.0, out=walk)
+            mids[where] = walk
+            self.mids[symbol] = walk[-1]
+            self.last_times[symbol] = times[where[-1]]
+
+        prices = numpy.rint(mids + rng.normal(0.0, self.spread, size)).astype('i8')
+        numpy.maximum(prices, 1, out=prices)
+        requests['price'] = numpy.where(numpy.isin(requests['kind'], (0, 2)), prices, 0)  # limit and IOC only
+        requests['quantity'] = rng.geometric(1.0 / self.quantity, size) * self.lot_size
+        return requests
+
+    def chunks(self, total):
+        while total > 0:
+            size = min(self.chunk_size, total)
+            total -= size
+            yield self.chunk(size)
+
+    def requests(self, chunk):
+        # the chunk as (action, trader id, ...) request tuples; prices go back to currency units
+        sides = (None, OrderSide.BUY, OrderSide.SELL)
+        symbols = self.symbols
+        tick_size = self.tick_size
+        latest_orders = self.latest_orders
+        for kind, side, symbol, trader, price, quantity in zip(chunk['kind'].tolist(), chunk['side'].tolist(),
+                                                                chunk['symbol'].tolist(), chunk['trader'].tolist(),
+                                                                chunk['price'].tolist(), chunk['quantity'].tolist()):
+            if kind <= 2:
+                order_id = self.next_order_id
+                self.next_order_id += 1
+            if kind == 0:
+                latest_orders[trader, symbol] = order_id
+                yield (OrderType.LIMIT, trader, LimitOrder(trader, symbols[symbol], quantity, price * tick_size,
+                                                           sides[side], 0))
+            elif kind == 1:
+                yield (OrderType.MARKET, trader, MarketOrder(trader, symbols[symbol], quantity, sides[side], 0))
+            elif kind == 2:
+                yield (OrderType.IOC, trader, IOCOrder(trader, symbols[symbol], quantity, price * tick_size,
+                                                       sides[side], 0))
+            elif kind == 3:
+                yield (OrderActions.Cancel, trader, symbols[symbol], latest_orders.get((trader, symbol)))
+            else:
+                yield (OrderActions.Amend, trader, quantity, symbols[symbol], latest_orders.get((trader, symbol)))
+
+    def stream(self, total):
+        # `total` request tuples, generated a chunk at a time
+        for chunk in self.chunks(total):
+            yield from self.requests(chunk)